@@ -0,0 +1,89 @@
+"""Compare the insertion speed of variants: one by one vs batched executemany
+
+Usage (from the root of the repository):
+    python -m benchmarks.benchmark_insert [variant_count]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+from cutevariant.core import sql
+
+VARIANT_COUNT = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+ANNOTATION_COUNT_PER_VARIANT = 3
+SAMPLES = ["sacha", "boby", "kevin"]
+BATCH_SIZE = 5000
+
+FIELDS = [
+    {"name": "chr", "category": "variants", "type": "text", "description": "", "constraint": "NOT NULL"},
+    {"name": "pos", "category": "variants", "type": "int", "description": "", "constraint": "NOT NULL"},
+    {"name": "ref", "category": "variants", "type": "text", "description": "", "constraint": "NOT NULL"},
+    {"name": "alt", "category": "variants", "type": "text", "description": "", "constraint": "NOT NULL"},
+    {"name": "qual", "category": "variants", "type": "int", "description": ""},
+    {"name": "gene", "category": "annotations", "type": "str", "description": ""},
+    {"name": "transcript", "category": "annotations", "type": "str", "description": ""},
+    {"name": "impact", "category": "annotations", "type": "str", "description": ""},
+    {"name": "gt", "category": "samples", "type": "int", "description": ""},
+    {"name": "dp", "category": "samples", "type": "int", "description": ""},
+]
+
+
+def generate_variants(count):
+    random.seed(0)
+    for i in range(count):
+        yield {
+            "chr": "chr" + str(i % 22 + 1),
+            "pos": i,
+            "ref": random.choice("ACGT"),
+            "alt": random.choice("ACGT"),
+            "qual": random.randint(0, 100),
+            "annotations": [
+                {"gene": f"gene{i}", "transcript": f"NM_{i}.{j}", "impact": "LOW"}
+                for j in range(ANNOTATION_COUNT_PER_VARIANT)
+            ],
+            "samples": [
+                {"name": name, "gt": random.randint(0, 2), "dp": random.randint(0, 100)}
+                for name in SAMPLES
+            ],
+        }
+
+
+def create_database(filepath):
+    if os.path.exists(filepath):
+        os.remove(filepath)
+    conn = sql.get_sql_connexion(filepath)
+    sql.create_table_fields(conn)
+    sql.insert_many_fields(conn, FIELDS)
+    sql.create_table_selections(conn)
+    sql.create_table_annotations(conn, sql.get_field_by_category(conn, "annotations"))
+    sql.create_table_samples(conn, sql.get_field_by_category(conn, "samples"))
+    sql.insert_many_samples(conn, SAMPLES)
+    sql.create_table_variants(conn, sql.get_field_by_category(conn, "variants"))
+    return conn
+
+
+def run(label, **kwargs):
+    filepath = os.path.join(tempfile.gettempdir(), "benchmark_insert.db")
+    conn = create_database(filepath)
+    variants = list(generate_variants(VARIANT_COUNT))
+
+    start = time.time()
+    sql.insert_many_variants(conn, variants, **kwargs)
+    elapsed = time.time() - start
+    conn.close()
+    os.remove(filepath)
+
+    rows = VARIANT_COUNT * (1 + ANNOTATION_COUNT_PER_VARIANT + len(SAMPLES))
+    print(
+        f"{label:<25} {elapsed:8.2f} s {VARIANT_COUNT / elapsed:12.0f} variants/s"
+        f" {rows / elapsed:12.0f} rows/s"
+    )
+    return elapsed
+
+
+print(f"Insert {VARIANT_COUNT} variants")
+one_by_one = run("one by one")
+batched = run(f"batch of {BATCH_SIZE}", batch_size=BATCH_SIZE)
+print(f"speedup: x{one_by_one / batched:.2f}")
@@ -0,0 +1,52 @@
+"""Compare the parsing speed of VcfReader (PyVCF) and FastVcfReader
+
+examples/test.snpeff.vcf is scaled up by repeating its records.
+
+Usage (from the root of the repository):
+    python -m benchmarks.benchmark_vcfreader [repeat]
+"""
+import os
+import sys
+import tempfile
+import time
+
+from cutevariant.core.reader import VcfReader, FastVcfReader
+
+SOURCE = "examples/test.snpeff.vcf"
+REPEAT = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+
+def scale_vcf(filepath, repeat):
+    """Write a VCF file with the records of SOURCE repeated "repeat" times"""
+    with open(SOURCE) as file:
+        lines = file.readlines()
+    header = [line for line in lines if line.startswith("#")]
+    records = [line.split("\t") for line in lines if not line.startswith("#")]
+
+    with open(filepath, "w") as file:
+        file.writelines(header)
+        for i in range(repeat):
+            for record in records:
+                # Shift positions to keep variants unique
+                record = [record[0], str(int(record[1]) + i * 1_000_000)] + record[2:]
+                file.write("\t".join(record))
+
+
+def run(reader_class, filepath):
+    with open(filepath) as device:
+        reader = reader_class(device, "snpeff")
+        reader.get_fields()
+        start = time.time()
+        count = sum(1 for _ in reader.get_variants())
+        elapsed = time.time() - start
+    print(f"{reader_class.__name__:<15} {elapsed:8.2f} s {count / elapsed:12.0f} variants/s")
+    return elapsed
+
+
+filepath = os.path.join(tempfile.gettempdir(), "benchmark_vcfreader.vcf")
+scale_vcf(filepath, REPEAT)
+print(f"Parse {filepath} ({os.path.getsize(filepath) // 1024} KB)")
+pyvcf = run(VcfReader, filepath)
+fast = run(FastVcfReader, filepath)
+print(f"speedup: x{pyvcf / fast:.2f}")
+os.remove(filepath)
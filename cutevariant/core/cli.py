@@ -1,5 +1,6 @@
 
 import argparse
+import glob
 import os 
 import progressbar
 import pprint
@@ -8,7 +9,7 @@
 
 from columnar import columnar
 
-from cutevariant.core.importer import import_file, async_import_file
+from cutevariant.core.importer import import_file, async_import_file, async_import_files
 from cutevariant.core import sql
 from cutevariant.core import vql
 
@@ -23,8 +24,12 @@ def main():
     
     #createdb parser 
     createdb_parser = sub_parser.add_parser("createdb", help="Build a sqlite database from a vcf file")
-    createdb_parser.add_argument("-i", "--input", help="VCF file path", required=True)
+    createdb_parser.add_argument("-i", "--input", help="VCF file path; repeat it or use a glob pattern to import several files in parallel", action="append", required=True)
     createdb_parser.add_argument("-o", "--output", help="cutevariant sqlite database path")
+    createdb_parser.add_argument("-p", "--processes", help="Number of processes used to parse VCF files (default: 1 for one file, number of CPUs for several files)", type=int)
+    createdb_parser.add_argument("--fast", action="store_true", help="Parse VCF files without building PyVCF records")
+    createdb_parser.add_argument("--resume", action="store_true", help="Resume an interrupted import from its last checkpoint")
+    createdb_parser.add_argument("--append", action="store_true", help="Add the VCF file (new samples) to an existing database")
 
     #show parser 
     show_parser = sub_parser.add_parser("show", help="Display table content")
@@ -45,6 +50,13 @@ def main():
     select_parser.add_argument("-g","--group", action="store_true", help="Group Select query by (chr,pos,ref,alt)")
     select_parser.add_argument("-s","--to-selection",help="Save Select query into a selection name")
 
+    #indexes parser
+    indexes_parser = sub_parser.add_parser("indexes", help="Advise indexes from the filters of previous queries")
+    indexes_parser.add_argument("--db", help="sqlite database. By default, $CUTEVARIANT_DB is used")
+    indexes_parser.add_argument("--apply", action="store_true", help="Create/drop advised indexes; keep only indexes speeding up queries")
+    indexes_parser.add_argument("--min-count", help="Minimum number of queries filtering a field", type=int, default=3)
+    indexes_parser.add_argument("--min-speedup", help="Minimum speedup to keep an index", type=float, default=1.5)
+
     # #Set parser
     # set_parser = sub_parser.add_parser("set", help="Set variable")
     # set_parser.add_argument("--db", help="Set $CUTEVARIANT_DB env variable ",type=str)
@@ -65,18 +77,27 @@ def main():
 
     # ====== CREATEDB ============================
     if args.subparser == "createdb":
+        # Patterns matching no file are kept to report them as missing
+        inputs = [path for pattern in args.input for path in sorted(glob.glob(pattern)) or [pattern]]
+        if len(inputs) > 1 and (args.resume or args.append):
+            createdb_parser.error("--resume and --append only support one input file")
+
         if args.output == None:
 
-            args.output = args.input + ".db"
+            args.output = inputs[0] + ".db"
 
-            if os.path.exists(args.output):
+            if os.path.exists(args.output) and not (args.resume or args.append):
                 os.remove(args.output)
 
         conn = sql.get_sql_connexion(args.output)
 
         if conn:
             #TODO: bug ... max is not 100...
-            for i, message in progressbar.progressbar(async_import_file(conn, args.input), redirect_stdout=True):
+            if len(inputs) > 1:
+                progression = async_import_files(conn, inputs, processes=args.processes, fast=args.fast)
+            else:
+                progression = async_import_file(conn, inputs[0], processes=args.processes or 1, fast=args.fast, resume=args.resume, append=args.append)
+            for i, message in progressbar.progressbar(progression, redirect_stdout=True):
                 print(message)
 
         #TODO: It doesn't set the env to the parent shell
@@ -165,7 +186,42 @@ def main():
 
     ## ********************** SELECT STATEMENT **************************************
         if cmd["cmd"] == "set_cmd":
-            print(cmd)
+            sql.create_selection_from_expression(conn, cmd["target"], cmd["expression"])
+
+        # Filters used by the index advisor
+        sql.save_filter_workload(conn)
+
+    # ====== INDEXES ============================
+    if args.subparser == "indexes":
+        advice = sql.advise_indexes(conn, min_count=args.min_count)
+        headers = ["action", "index", "where", "queries", "mean time (ms)", "rows", "size (KB)"]
+        if args.apply:
+            advice = sql.apply_index_advice(conn, advice, min_speedup=args.min_speedup)
+            headers += ["speedup", "kept"]
+
+        lines = []
+        for item in advice:
+            size = item.get("size") or item["estimated_size"]
+            line = [
+                item["action"],
+                item["name"],
+                item["where"] or "",
+                item["count"],
+                round(item["mean_time"] * 1000, 2),
+                item["rows"] or "",
+                size // 1024 if size is not None else "",
+            ]
+            if args.apply:
+                line += [
+                    round(item["speedup"], 1) if item["speedup"] else "",
+                    item["applied"] and item["action"] == "create",
+                ]
+            lines.append(line)
+
+        if lines:
+            print(columnar(lines, headers=headers, no_borders=True))
+        else:
+            print("No index to create or drop")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,251 @@
+"""Genotypes of samples stored in a NumPy array memory-mapped from a .npy file
+
+The array is a companion of the database: its file is next to the database
+file (See get_genotype_array_filepath()). It has one row per sample (samples
+ordered by id) and one column per variant (column = variant id - 1); the
+genotypes of a sample are contiguous.
+
+Filters on the genotypes of many samples (segregation in families or cohorts)
+are evaluated with vectorized operations on the rows of the samples; the
+variants selected are given back to SQL in a temporary table
+(See QueryBuilder._push_genotype_filters()).
+
+NumPy is an optional dependency: without it, genotype filters are made
+with SQL joins.
+"""
+# Standard imports
+import operator
+import os
+
+# Custom imports
+import cutevariant.commons as cm
+from cutevariant.core.sql import raw_cursor
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+LOGGER = cm.logger()
+
+# Value of missing genotypes (no record in "sample_has_variant" or NULL)
+GENOTYPE_MISSING = -128
+
+# Operators of filters supported by GenotypeArray.evaluate()
+OPERATORS = {
+    "=": operator.eq,
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<>": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+
+# Number of records read at once from "sample_has_variant"
+FETCH_SIZE = 100000
+
+
+def has_numpy():
+    """Return True if NumPy is installed"""
+    return np is not None
+
+
+def get_genotype_array_filepath(conn):
+    """Return the path of the genotype array of the database
+
+    :return: The filepath or None for in-memory or temporary databases.
+    :rtype: <str>
+    """
+    # Avoid circular import
+    from cutevariant.core.sql import get_database_filepath
+
+    filepath = get_database_filepath(conn)
+    if filepath is None:
+        return None
+    return filepath + ".genotypes.npy"
+
+
+def write_genotype_array(conn, filepath=None):
+    """Write the genotypes of "sample_has_variant" into a .npy file
+
+    The file is written next to the previous one then replaced, so that
+    arrays already opened stay valid.
+
+    :param conn: sqlite3.connect
+    :key filepath: Path of the file; by default the path given by
+        get_genotype_array_filepath().
+    :return: The path of the file
+    :rtype: <str>
+    """
+    if np is None:
+        raise ImportError(
+            "write_genotype_array:: You should install optional package 'numpy'"
+        )
+
+    if filepath is None:
+        filepath = get_genotype_array_filepath(conn)
+    if filepath is None:
+        raise ValueError("write_genotype_array:: The database is not a file")
+
+    cursor = raw_cursor(conn)
+    sample_ids = [row[0] for row in cursor.execute("SELECT id FROM samples ORDER BY id")]
+    variant_count = cursor.execute("SELECT MAX(id) FROM variants").fetchone()[0] or 0
+    shape = (len(sample_ids), variant_count)
+
+    temporary_filepath = filepath + ".tmp"
+    if 0 in shape:
+        # Empty files can't be memory-mapped
+        with open(temporary_filepath, "wb") as file:
+            np.save(file, np.full(shape, GENOTYPE_MISSING, dtype=np.int8))
+    else:
+        array = np.lib.format.open_memmap(
+            temporary_filepath, mode="w+", dtype=np.int8, shape=shape
+        )
+        array[:] = GENOTYPE_MISSING
+        for index, sample_id in enumerate(sample_ids):
+            # Records are read in the order of the primary key
+            cursor.execute(
+                f"""SELECT variant_id, MIN(MAX(IFNULL(gt, {GENOTYPE_MISSING}), -127), 127)
+                FROM sample_has_variant WHERE sample_id = ?""",
+                (sample_id,),
+            )
+            while True:
+                records = cursor.fetchmany(FETCH_SIZE)
+                if not records:
+                    break
+                records = np.array(records, dtype=np.int64)
+                array[index, records[:, 0] - 1] = records[:, 1]
+        array.flush()
+        del array
+
+    os.replace(temporary_filepath, filepath)
+    LOGGER.debug("write_genotype_array:: %s samples, %s variants", *shape)
+    return filepath
+
+
+class GenotypeArray:
+    """Read-only genotype array memory-mapped from a file
+
+    Attributes:
+        filepath (str): Path of the .npy file
+        array (numpy.memmap): Genotypes; one row per sample
+        sample_indexes (dict): Row of each sample name
+    """
+
+    def __init__(self, filepath, samples):
+        """Open the given file
+
+        Args:
+            filepath (str): Path of a file written by write_genotype_array()
+            samples (list): Names of samples ordered by id
+        """
+        self.filepath = filepath
+        self.mtime = os.path.getmtime(filepath)
+        self.array = np.load(filepath, mmap_mode="r")
+        self.sample_indexes = {name: index for index, name in enumerate(samples)}
+
+    @classmethod
+    def open(cls, conn):
+        """Open the genotype array of the database if it's possible
+
+        Returns:
+            GenotypeArray: None if NumPy isn't installed, if the file doesn't
+            exist or if it doesn't match the database (samples or variants
+            added since its creation).
+        """
+        if np is None:
+            return None
+
+        filepath = get_genotype_array_filepath(conn)
+        if filepath is None or not os.path.exists(filepath):
+            return None
+
+        samples = [row[0] for row in conn.execute("SELECT name FROM samples ORDER BY id")]
+        variant_count = conn.execute("SELECT MAX(id) FROM variants").fetchone()[0] or 0
+        genotype_array = cls(filepath, samples)
+        if genotype_array.array.shape != (len(samples), variant_count):
+            LOGGER.warning(
+                "GenotypeArray.open:: %s is outdated; it should be rewritten", filepath
+            )
+            return None
+        return genotype_array
+
+    def is_supported(self, node):
+        """Return True if the given filters can be evaluated by evaluate()
+
+        Supported filters are made of AND/OR nodes and conditions on the
+        "gt" field of known samples with integers.
+
+        Args:
+            node (dict): Filters (See QueryBuilder)
+        """
+        if not isinstance(node, dict):
+            return False
+
+        if len(node) == 3:
+            field = node.get("field")
+            value = node.get("value")
+            if not (
+                isinstance(field, tuple)
+                and len(field) == 3
+                and field[0] == "genotype"
+                and field[2] == "gt"
+                and field[1] in self.sample_indexes
+            ):
+                return False
+            if node["operator"] in ("IN", "NOT IN"):
+                return isinstance(value, (tuple, list)) and all(
+                    isinstance(item, int) for item in value
+                )
+            return node["operator"] in OPERATORS and isinstance(value, int)
+
+        if len(node) != 1:
+            return False
+        logic_op, children = next(iter(node.items()))
+        return (
+            logic_op.upper() in ("AND", "OR")
+            and isinstance(children, list)
+            and bool(children)
+            and all(self.is_supported(child) for child in children)
+        )
+
+    def evaluate(self, node):
+        """Evaluate the given filters on genotypes
+
+        Like with SQL joins, missing genotypes don't satisfy any condition.
+
+        Args:
+            node (dict): Filters supported by is_supported()
+
+        Returns:
+            numpy.ndarray: Mask of the selected variants (index = id - 1)
+        """
+        if len(node) == 3:
+            genotypes = self.array[self.sample_indexes[node["field"][1]]]
+            operator_name = node["operator"]
+            if operator_name in ("IN", "NOT IN"):
+                mask = np.isin(genotypes, list(node["value"]))
+                if operator_name == "NOT IN":
+                    mask = ~mask
+            else:
+                mask = OPERATORS[operator_name](genotypes, node["value"])
+            return mask & (genotypes != GENOTYPE_MISSING)
+
+        logic_op, children = next(iter(node.items()))
+        masks = [self.evaluate(child) for child in children]
+        if logic_op.upper() == "AND":
+            return np.logical_and.reduce(masks)
+        return np.logical_or.reduce(masks)
+
+    def select(self, node):
+        """Return the ids of the variants selected by the given filters
+
+        The ids can be used to create a selection
+        (See sql.create_selection_from_ids()).
+
+        Returns:
+            list: Variant ids in ascending order
+        """
+        return (np.flatnonzero(self.evaluate(node)) + 1).tolist()
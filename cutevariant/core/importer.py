@@ -1,19 +1,292 @@
 # Standard imports
 import os
 import csv
+import gzip
+import pathlib
+import io
 import sqlite3
+import multiprocessing
+import tempfile
+from collections import deque
+from itertools import islice, chain
 
 # Custom imports
 from .reader.abstractreader import AbstractReader
-from .readerfactory import create_reader
+from .reader import VcfReader, FastVcfReader
+from .readerfactory import create_reader, detect_vcf_annotation
 from .sql import *
+from .genotypes import has_numpy, get_genotype_array_filepath, write_genotype_array
+import cutevariant.commons as cm
+
+LOGGER = cm.logger()
+
+# Number of variants inserted with one executemany per table
+BATCH_SIZE = 5000
+
+# Number of variants inserted between two commits (and checkpoints)
+COMMIT_EVERY = 100000
+
+# Number of VCF lines sent at once to a parsing process (parallel import)
+CHUNK_SIZE = 5000
 
 
 def async_import_reader(conn, reader: AbstractReader, **kwargs):
     """Import data via the given reader into a SQLite database via the given connection
 
+    Variants are committed periodically with a checkpoint saved in the table
+    "metadatas"; an interrupted import can be resumed with the same data
+    via the `resume` keyword. Readers which can seek (See AbstractReader.tell())
+    resume at the position of the checkpoint; others parse the variants
+    inserted before it again.
+
     :param conn: sqlite connection
     :param reader: must be a AbstractReader base class
+    :key batch_size: Number of variants buffered before their insertion
+        (default: BATCH_SIZE). See sql.insert_variants_rows().
+    :key commit_every: Number of variants inserted between two commits
+        (default: COMMIT_EVERY). See sql.async_insert_many_variants().
+    :key deferred_unique_index: Check the unicity of variants after their
+        insertion instead of during it (default: False).
+        See sql.create_variants_unique_index().
+    :key resume: Resume the interrupted import of the database from its
+        last checkpoint (default: False).
+    :key genotype_matrix: Store the genotypes of samples in the compact
+        "genotype_matrix" table too (default: False).
+        See sql.create_genotype_matrix().
+    :key genotype_array: Write the genotypes of samples in a NumPy array
+        next to the database file too (default: False); ignored if NumPy
+        is not installed. See genotypes.write_genotype_array().
+    :key append: Add the data to an existing database (default: False):
+        new samples and fields are added, variants already in the database
+        get the data of the new samples. Variants are inserted in one
+        transaction which can't be resumed. See _async_extend_schema().
+    :return: yield progression and message
+    :rtype: <generator <int>, <str>>
+    """
+    # The "bulk" profile must be set before the creation of tables (page_size)
+    set_connexion_profile(conn, "bulk")
+
+    resume = kwargs.get("resume", False)
+    append = kwargs.get("append", False)
+    seeked = False
+    if append:
+        if resume:
+            raise Exception("async_import_reader:: An append can't be resumed.")
+        status = "running"
+        last_ids = yield from _async_extend_schema(conn, reader)
+    elif resume:
+        metadatas = get_metadatas(conn)
+        status = metadatas.get("import_status")
+        if status is None:
+            raise Exception("async_import_reader:: No import to resume in this database.")
+        yield 0, f"Resuming import with {reader}"
+        # Set up the annotation parser
+        reader.get_fields()
+        # Go to the position of the checkpoint (See _reader_checkpoint())
+        seeked = "import_record_variants" in metadatas and reader.seek(
+            (
+                int(metadatas["import_read_bytes"]),
+                int(metadatas["import_record_variants"]),
+            )
+        )
+        if not seeked:
+            LOGGER.info(
+                "async_import_reader:: %s can't seek; variants inserted before"
+                " the checkpoint are parsed again",
+                reader,
+            )
+    else:
+        status = "running"
+        yield from _async_create_schema(conn, reader, **kwargs)
+
+    if status == "running":
+        # Insert variants, link them to annotations and samples
+        yield 0, "Inserting variants..."
+        percent = 0
+        for value, message in async_insert_many_variants(
+            conn,
+            reader.get_variants(),
+            batch_size=kwargs.get("batch_size", BATCH_SIZE),
+            commit_every=None if append else kwargs.get("commit_every", COMMIT_EVERY),
+            checkpoint=lambda: _reader_checkpoint(reader),
+            resume=resume,
+            skip_inserted=not seeked,
+            append=append,
+        ):
+
+            if reader.file_size:
+                # file_size of compressed files is only an estimate
+                # (See readerfactory.get_uncompressed_size())
+                percent = min(reader.read_bytes / reader.file_size * 100.0, 100.0)
+            else:
+                # Fallback
+                # TODO: useless for now because we don't give the total of variants
+                # to async_insert_many_variants()
+                percent = value
+            yield percent, message
+
+    if append:
+        yield from _async_update_indexes(
+            conn,
+            *last_ids,
+            kwargs.get("genotype_matrix", False),
+            kwargs.get("genotype_array", False),
+        )
+    elif status != "done":
+        yield from _async_create_indexes(
+            conn,
+            kwargs.get("genotype_matrix", False),
+            kwargs.get("genotype_array", False),
+        )
+
+    set_connexion_profile(conn, "interactive")
+    yield 100, "Import done."
+
+    # session.add(Selection(name="favoris", description="favoris", count = 0))
+
+
+def _async_create_indexes(conn, genotype_matrix=False, genotype_array=False):
+    """Create indexes, the summary of annotations and the statistics of fields,
+    then mark the import as done
+
+    :key genotype_matrix: Create the genotype matrix too
+        (See sql.create_genotype_matrix()).
+    :key genotype_array: Write the NumPy genotype array too if it's possible
+        (See genotypes.write_genotype_array()).
+
+    :return: yield progression and message
+    :rtype: <generator <int>, <str>>
+    """
+    yield 99, "Creating indexes..."
+    create_indexes(conn)
+    yield 99, "Summarizing annotations..."
+    create_annotations_summary(conn)
+    yield 99, "Computing statistics of fields..."
+    compute_field_stats(conn)
+    if genotype_matrix:
+        yield 99, "Packing genotypes..."
+        create_genotype_matrix(conn)
+    if genotype_array:
+        if not has_numpy():
+            LOGGER.warning("NumPy is not installed: the genotype array is not written")
+        elif get_genotype_array_filepath(conn) is not None:
+            yield 99, "Writing genotype array..."
+            write_genotype_array(conn)
+    update_metadatas(conn, {"import_status": "done"})
+    conn.commit()
+    yield 99, "Indexes created."
+
+
+def _reader_checkpoint(reader: AbstractReader):
+    """Return the metadatas saved with checkpoints to resume an import at the
+    position of the reader (See AbstractReader.tell())
+
+    :return: Empty if the reader can't seek
+    :rtype: <dict>
+    """
+    position = reader.tell()
+    if position is None:
+        return {}
+    return {"import_read_bytes": position[0], "import_record_variants": position[1]}
+
+
+def _async_update_indexes(
+    conn, last_variant_id, last_sample_id, genotype_matrix=False, genotype_array=False
+):
+    """Update the data derived from variants after an append
+
+    Indexes are maintained by SQLite during insertions; the summary of
+    annotations, the genotype counters and the statistics of fields are
+    updated with the new variants and samples only. The genotype matrix and
+    the genotype array have one value per variant and sample: they are
+    rewritten if they exist.
+
+    :param last_variant_id: Id of the last variant before the append
+    :param last_sample_id: Id of the last sample before the append
+    :key genotype_matrix: Create the genotype matrix if it doesn't exist
+    :key genotype_array: Write the genotype array if it doesn't exist
+
+    :return: yield progression and message
+    :rtype: <generator <int>, <str>>
+    """
+    yield 99, "Updating indexes..."
+    create_indexes(conn)
+    yield 99, "Summarizing annotations..."
+    update_annotations_summary(conn)
+
+    if GENOTYPE_COUNTER_NAMES[0] in get_columns(conn, "variants"):
+        # Counters of existing variants only change with new samples
+        yield 99, "Counting genotypes..."
+        sample_ids = [
+            row[0]
+            for row in conn.execute(
+                "SELECT id FROM samples WHERE id > ?", (last_sample_id,)
+            )
+        ]
+        update_genotype_counters(conn, sample_ids)
+
+    yield 99, "Computing statistics of fields..."
+    # Existing variants get their missing values (See sql._append_to_variant());
+    # statistics of genotype counters are dropped by update_genotype_counters()
+    updated_fields = [
+        field["name"]
+        for field in get_field_by_category(conn, "variants")
+        if field["name"] not in ("chr", "pos", "ref", "alt") + GENOTYPE_COUNTER_NAMES
+    ]
+    update_field_stats(conn, updated_fields)
+
+    matrix_fields = get_genotype_matrix_fields(conn)
+    if genotype_matrix or matrix_fields:
+        yield 99, "Packing genotypes..."
+        create_genotype_matrix(conn, matrix_fields or None)
+    array_filepath = get_genotype_array_filepath(conn)
+    if array_filepath and (genotype_array or os.path.exists(array_filepath)):
+        if not has_numpy():
+            LOGGER.warning("NumPy is not installed: the genotype array is not written")
+        else:
+            yield 99, "Writing genotype array..."
+            write_genotype_array(conn)
+    update_metadatas(conn, {"import_status": "done"})
+    conn.commit()
+    yield 99, "Indexes updated."
+
+
+def _async_extend_schema(conn, reader: AbstractReader):
+    """Add the samples and the fields of the given reader to an existing
+    database
+
+    :return: yield progression and message; the generator returns the ids
+        of the last variant and of the last sample before the append.
+    :rtype: <generator <int>, <str>>
+    """
+    yield 0, f"Appending data with {reader}"
+    last_variant_id = conn.execute("SELECT MAX(id) FROM variants").fetchone()[0] or 0
+    last_sample_id = conn.execute("SELECT MAX(id) FROM samples").fetchone()[0] or 0
+
+    samples = reader.get_samples()
+    known_samples = {row[0] for row in conn.execute("SELECT name FROM samples")}
+    duplicated_samples = known_samples.intersection(samples)
+    if duplicated_samples:
+        raise ValueError(
+            "_async_extend_schema:: Samples already in the database: "
+            + ", ".join(sorted(duplicated_samples))
+        )
+
+    yield 0, "Inserting new fields..."
+    new_fields = insert_missing_fields(conn, reader.get_fields())
+    LOGGER.debug(
+        "_async_extend_schema:: New fields: %s", [field["name"] for field in new_fields]
+    )
+
+    yield 0, "Inserting samples..."
+    insert_many_samples(conn, samples)
+    return last_variant_id, last_sample_id
+
+
+def _async_create_schema(conn, reader: AbstractReader, **kwargs):
+    """Create the tables of the project and insert samples and fields
+    described by the given reader
+
     :return: yield progression and message
     :rtype: <generator <int>, <str>>
     """
@@ -25,6 +298,9 @@ def async_import_reader(conn, reader: AbstractReader, **kwargs):
         reference=kwargs.get("reference", "UKN"),
     )
 
+    create_table_metadatas(conn)
+    update_metadatas(conn, {"import_status": "running"})
+
     yield 0, "Creating table shema..."
     # Create table fields
     create_table_fields(conn)
@@ -34,8 +310,22 @@ def async_import_reader(conn, reader: AbstractReader, **kwargs):
     # Create annotations tables
     create_table_annotations(conn, reader.get_fields_by_category("annotations"))
 
+    # Genotype counters are computed at import if there are samples
+    # (See sql.GENOTYPE_COUNTER_FIELDS)
+    fields = list(reader.get_fields())
+    if reader.get_samples():
+        fields += [
+            field
+            for field in GENOTYPE_COUNTER_FIELDS
+            if not any(known["name"] == field["name"] for known in fields)
+        ]
+
     # Create variants tables
-    create_table_variants(conn, reader.get_fields_by_category("variants"))
+    create_table_variants(
+        conn,
+        (field for field in fields if field["category"] == "variants"),
+        deferred_unique_index=kwargs.get("deferred_unique_index", False),
+    )
 
     # Create table samples
     create_table_samples(conn, reader.get_fields_by_category("samples"))
@@ -49,42 +339,325 @@ def async_import_reader(conn, reader: AbstractReader, **kwargs):
 
     # Insert fields
     yield 0, "Inserting fields..."
-    insert_many_fields(conn, reader.get_fields())
+    insert_many_fields(conn, fields)
+
+
+## ================ Parallel import of VCF files ===============================
+
+# State of a parsing process, set once by _init_parsing_process()
+_parsing_state = {}
+
+
+def _init_parsing_process(header, annotation_parser, context, fast):
+    """Initializer of the processes of the pool used by async_import_vcf_parallel()
+
+    :param header: Header lines of the VCF file
+    :param annotation_parser: "vep", "snpeff" or None
+    :param context: Dictionnary returned by sql.build_insert_context()
+    :param fast: Use FastVcfReader instead of VcfReader
+    """
+    _parsing_state["reader_class"] = FastVcfReader if fast else VcfReader
+    _parsing_state["header"] = header
+    _parsing_state["annotation_parser"] = annotation_parser
+    _parsing_state["context"] = context
+
+
+def _parse_vcf_chunk(lines):
+    """Parse the given VCF lines into rows ready to be inserted
+
+    Executed in a process of the pool: the lines are parsed by a VcfReader
+    working on the header of the file followed by the chunk.
+
+    :param lines: List of VCF data lines
+    :return: List of tuples returned by sql.variant_to_rows()
+    :rtype: <list <tuple>>
+    """
+    device = io.StringIO(_parsing_state["header"] + "".join(lines))
+    reader = _parsing_state["reader_class"](
+        device, _parsing_state["annotation_parser"]
+    )
+    # Fields must be parsed before variants to set up the annotation parser
+    reader.get_fields()
+    context = _parsing_state["context"]
+    return [variant_to_rows(variant, context) for variant in reader.get_variants()]
+
+
+def read_vcf_chunks(device, chunk_size=CHUNK_SIZE):
+    """Split a VCF file into its header and chunks of data lines
+
+    Chunks are cut at record boundaries (1 record per line).
+
+    :param device: File opened in binary mode, compressed or not (bgzipped
+        files are multi-member gzip files)
+    :param chunk_size: Maximum number of lines per chunk
+    :return: Tuple of the header (str) and a generator of tuples made of
+        a list of lines and the position in the device after them.
+        For compressed files, the position is the number of compressed
+        bytes read (a bit ahead of the chunk because of buffering), which
+        can be compared to the size of the file.
+    :rtype: <tuple <str>, <generator <tuple <list>, <int>>>>
+    """
+    if device.read(3) == b"\x1f\x8b\x08":
+        device.seek(0)
+        lines = gzip.GzipFile(fileobj=device)
+    else:
+        device.seek(0)
+        lines = device
+    lines = (line.decode() for line in lines)
+
+    header = []
+    for line in lines:
+        if not line.startswith("#"):
+            lines = chain((line,), lines)
+            break
+        header.append(line)
+
+    def chunks():
+        while True:
+            chunk = list(islice(lines, chunk_size))
+            if not chunk:
+                return
+            yield chunk, device.tell()
+
+    return "".join(header), chunks()
+
 
-    # yield 0, "count variants..."
-    # total_variant = reader.get_variants_count()
+def async_import_vcf_parallel(
+    conn, filename, processes=None, chunk_size=CHUNK_SIZE, fast=False, **kwargs
+):
+    """Import a VCF file by parsing it with a pool of processes
+
+    The file is split into chunks of lines which are parsed by the processes
+    into rows (see sql.variant_to_rows()). The current process is the only
+    writer: results are drained in the order of the file and inserted by
+    batches with sql.insert_variants_rows().
+
+    Checkpoints are saved like with async_import_reader(); the import is
+    resumed by async_import_reader() (parsed variants are in the same order).
+
+    :param conn: sqlite connection
+    :param filename: VCF file (.vcf or .vcf.gz)
+    :key processes: Number of parsing processes (default: number of CPUs)
+    :key chunk_size: Number of VCF lines parsed at once by a process
+    :key fast: Use FastVcfReader instead of VcfReader in the processes
+    :key commit_every: See async_import_reader()
+    :key deferred_unique_index: See async_import_reader()
+    :key genotype_matrix: See async_import_reader()
+    :key genotype_array: See async_import_reader()
+    :return: yield progression and message
+    :rtype: <generator <int>, <str>>
+    """
+    annotation_parser = detect_vcf_annotation(filename)
+
+    # The "bulk" profile must be set before the creation of tables (page_size)
+    set_connexion_profile(conn, "bulk")
+
+    with create_reader(filename) as reader:
+        yield from _async_create_schema(conn, reader, **kwargs)
+    # Positions of chunks are offsets in the file as stored on disk
+    # (compressed or not); the uncompressed size of a bgzipped file is unknown
+    file_size = os.path.getsize(filename)
 
-    # Insert variants, link them to annotations and samples
     yield 0, "Inserting variants..."
-    percent = 0
-    for value, message in async_insert_many_variants(conn, reader.get_variants()):
+    context = build_insert_context(conn)
+    processes = processes or os.cpu_count() or 1
+    # Bound the number of chunks in memory
+    max_pending = processes * 2
 
-        if reader.file_size:
-            percent = reader.read_bytes / reader.file_size * 100.0
-        else:
-            # Fallback
-            # TODO: useless for now because we don't give the total of variants
-            # to async_insert_many_variants()
-            percent = value
-        yield percent, message
+    commit_every = kwargs.get("commit_every", COMMIT_EVERY)
+    cursor = conn.cursor()
+    errors = 0
+    variant_count = 0
+    committed_count = 0
+    with open(filename, "rb") as device:
+        header, chunks = read_vcf_chunks(device, chunk_size)
 
-    # Create indexes
-    yield 99, "Creating indexes..."
-    create_indexes(conn)
-    yield 100, "Indexes created."
+        with multiprocessing.Pool(
+            processes,
+            initializer=_init_parsing_process,
+            initargs=(header, annotation_parser, context, fast),
+        ) as pool:
+            pending = deque()
+            while True:
+                # Keep the processes busy
+                for lines, position in islice(chunks, max_pending - len(pending)):
+                    pending.append(
+                        (pool.apply_async(_parse_vcf_chunk, (lines,)), position)
+                    )
 
-    # session.add(Selection(name="favoris", description="favoris", count = 0))
+                if not pending:
+                    break
+
+                # Write results in the order of the file
+                result, position = pending.popleft()
+                rows = result.get()
+                errors += insert_variants_rows(cursor, rows, context)
+                variant_count += len(rows)
+
+                if commit_every and variant_count - committed_count >= commit_every:
+                    save_import_checkpoint(conn, variant_count, errors)
+                    conn.commit()
+                    committed_count = variant_count
 
+                percent = position / file_size * 100.0 if file_size else 0
+                yield percent, f"{variant_count} variants inserted."
 
-def async_import_file(conn, filename, project={}):
+    yield from async_end_variants_insertion(
+        conn, context, variant_count, errors, checkpoint={}
+    )
+
+    yield from _async_create_indexes(
+        conn, kwargs.get("genotype_matrix", False), kwargs.get("genotype_array", False)
+    )
+    set_connexion_profile(conn, "interactive")
+    yield 100, "Import done."
+
+
+## ================ Parallel import of several files ===========================
+
+
+def _import_shard(task):
+    """Import a file into a staging database
+
+    Executed in a process of the pool used by async_import_files(); derived
+    data (indexes, summaries, statistics) are not computed.
+
+    :param task: Tuple of the path of the file, the path of the staging
+        database and the fast flag (See create_reader())
+    :return: Tuple of the path of the file, the path of the staging database
+        and the names of the samples of the file
+    :rtype: <tuple <str>, <str>, <list <str>>>
+    """
+    filename, shard_filename, fast = task
+    conn = get_sql_connexion(shard_filename)
+    try:
+        set_connexion_profile(conn, "bulk")
+        with create_reader(filename, fast=fast) as reader:
+            for _ in _async_create_schema(conn, reader):
+                pass
+            for _ in async_insert_many_variants(
+                conn, reader.get_variants(), batch_size=BATCH_SIZE
+            ):
+                pass
+            samples = reader.get_samples()
+    finally:
+        conn.close()
+    return filename, shard_filename, samples
+
+
+def async_import_files(conn, filenames, processes=None, fast=False, **kwargs):
+    """Import several files with a pool of processes
+
+    Each file is imported into its own staging database by a process; the
+    staging databases are merged into the database of the connexion in the
+    order of the files, while the next ones are imported
+    (See sql.merge_database()). Derived data (genotype counters, indexes,
+    summaries, statistics) are computed once at the end.
+
+    Staging databases are written next to the database file (or in the
+    temporary directory for in-memory databases) and removed after their merge.
+
+    :param conn: sqlite connection
+    :param filenames: Paths of the files; a sample can't be in several files.
+    :key processes: Number of importing processes (default: number of CPUs)
+    :key fast: Use FastVcfReader to parse VCF files (See create_reader()).
+    :key project_name: See async_import_reader()
+    :key reference: See async_import_reader()
+    :key genotype_matrix: See async_import_reader()
+    :key genotype_array: See async_import_reader()
+    :return: yield progression and message
+    :rtype: <generator <int>, <str>>
+    """
+    filenames = list(filenames)
+    if not filenames:
+        raise ValueError("async_import_files:: No file to import")
+
+    # The "bulk" profile must be set before the creation of tables (page_size)
+    set_connexion_profile(conn, "bulk")
+
+    # Variants of the staging databases are matched with the unique index
+    with create_reader(filenames[0]) as reader:
+        yield from _async_create_schema(
+            conn, reader, **dict(kwargs, deferred_unique_index=False)
+        )
+    conn.commit()
+
+    yield 0, f"Importing {len(filenames)} files..."
+    processes = min(processes or os.cpu_count() or 1, len(filenames))
+    directory = os.path.dirname(get_database_filepath(conn) or "") or None
+    known_samples = set()
+    with tempfile.TemporaryDirectory(
+        prefix="cutevariant-", dir=directory
+    ) as staging_directory, multiprocessing.Pool(processes) as pool:
+        tasks = [
+            (filename, os.path.join(staging_directory, f"shard{index}.db"), fast)
+            for index, filename in enumerate(filenames)
+        ]
+        shards = pool.imap(_import_shard, tasks)
+        for index, (filename, shard_filename, samples) in enumerate(shards):
+            duplicated_samples = known_samples.intersection(samples)
+            if duplicated_samples:
+                raise ValueError(
+                    f"async_import_files:: Samples of {filename} already imported: "
+                    + ", ".join(sorted(duplicated_samples))
+                )
+            known_samples.update(samples)
+
+            yield index / len(filenames) * 95, f"Merging {filename}..."
+            variant_count = merge_database(conn, shard_filename)
+            os.remove(shard_filename)
+            yield (
+                (index + 1) / len(filenames) * 95,
+                f"{variant_count} new variant(s) has been inserted.",
+            )
+
+    if GENOTYPE_COUNTER_NAMES[0] in get_columns(conn, "variants"):
+        yield 96, "Counting genotypes..."
+        update_genotype_counters(conn)
+
+    # Create default selection (we need the number of variants for this)
+    insert_selection(
+        conn, "", name=cm.DEFAULT_SELECTION_NAME, count=get_variants_count(conn)
+    )
+
+    yield from _async_create_indexes(
+        conn, kwargs.get("genotype_matrix", False), kwargs.get("genotype_array", False)
+    )
+    set_connexion_profile(conn, "interactive")
+    yield 100, "Import done."
+
+
+def async_import_file(
+    conn, filename, project={}, processes=1, fast=False, resume=False, append=False
+):
     """Import filename into SQLite database
 
     :param conn: sqlite connection
     :param filenaame: variant filename
+    :key processes: Number of processes used to parse VCF files.
+        If greater than 1, see async_import_vcf_parallel().
+    :key fast: Use FastVcfReader to parse VCF files (see create_reader()).
+    :key resume: Resume the interrupted import of the same file from its
+        last checkpoint; always made by async_import_reader() with a
+        FastVcfReader for VCF files (it can seek to the checkpoint).
+    :key append: Add the file to the existing database of the connection;
+        always made by async_import_reader().
     :return: yield progression and message
     """
+    if resume:
+        project = dict(project, resume=True)
+        # FastVcfReader gives the same variants as VcfReader
+        fast = True
+    elif append:
+        project = dict(project, append=True)
+    elif processes != 1 and ".vcf" in pathlib.Path(filename).suffixes:
+        yield from async_import_vcf_parallel(
+            conn, filename, processes=processes, fast=fast, **project
+        )
+        return
+
     # Context manager that wraps the given file
-    with create_reader(filename) as reader:
+    with create_reader(filename, fast=fast) as reader:
         yield from async_import_reader(conn, reader, **project)
 
 
@@ -1,7 +1,6 @@
 # Standard imports
 import re
 import sqlite3
-from functools import lru_cache
 
 # Custom imports
 from . import sql
@@ -86,9 +85,9 @@ def conn(self, conn):
         # Get columns description from the given table
         tables = ("variants", "annotations")
         if conn:
+            catalog = sql.get_schema_catalog(conn)
             self.col_table_mapping = {
-                table_name: set(sql.get_columns(self.conn, table_name))
-                for table_name in tables
+                table_name: catalog.get_columns(table_name) for table_name in tables
             }
 
     def extract_samples_from_columns_and_filter(self, filter_only=False):
@@ -131,9 +130,9 @@ def extract_samples_from_columns_and_filter(self, filter_only=False):
         required_samples_names = columns_in_columns | columns_in_filter
 
         self._samples_to_join = {
-            sample["name"]: sample["id"]
-            for sample in sql.get_samples(self.conn)
-            if sample["name"] in required_samples_names
+            name: sample_id
+            for name, sample_id in sql.get_schema_catalog(self.conn).samples_ids.items()
+            if name in required_samples_names
         }
 
         LOGGER.debug("DETECT %s in %s", self._samples_to_join.keys(), self.columns)
@@ -273,10 +272,7 @@ def get_joints(self, do_not_add_default_things=False, filter_only=False):
 
         if self.selection and self.selection != DEFAULT_SELECTION_NAME:
             # Add jointure with 'selections' table
-            query += f"""
-            INNER JOIN selection_has_variant sv ON sv.variant_id = variants.id
-            INNER JOIN selections s ON s.id = sv.selection_id AND s.name = '{self.selection}'
-            """
+            query += sql.selection_join_sql(self.conn, self.selection)
 
         #  Add Join on sample_has_variant
         #  This is done if genotype() function has been found in columns or filter,
@@ -532,12 +528,11 @@ def create_selection(self, name):
 
     ##--------------------------------------------------------------------------
 
-    @lru_cache(maxsize=128)
     def _cached_variants_count_query(self, sql_query):
-        """Wrapped function with a memoizing callable that saves up to the
-        maxsize most recent calls.
+        """Return the count of the given query; results are cached by the
+        connection and invalidated when the database is modified.
 
-        .. note:: The LRU feature performs best when maxsize is a power-of-two.
+        .. seealso:: sql.cached_query()
 
         .. note:: The COUNT() aggregation function is expensive on partially
             indexed tables (because dynamically built) for large dataset
@@ -551,14 +546,14 @@ def _cached_variants_count_query(self, sql_query):
             and self.group_by == ["chr", "pos", "ref", "alt"]
         ):
             LOGGER.debug("SELECT MAX(...")
-            return self.conn.execute(
-                "SELECT MAX(variants.id) as count FROM variants"
-            ).fetchone()[0]
+            return sql.cached_query(
+                self.conn, "SELECT MAX(variants.id) as count FROM variants"
+            )[0][0]
 
         LOGGER.debug(sql_query)
-        return self.conn.execute(
-            f"SELECT COUNT(*) as count FROM ({sql_query})"
-        ).fetchone()[0]
+        return sql.cached_query(
+            self.conn, f"SELECT COUNT(*) as count FROM ({sql_query})"
+        )[0][0]
 
     def variants_count(self) -> int:
         """Return variant count from the current query
@@ -569,9 +564,9 @@ def variants_count(self) -> int:
         """
         LOGGER.debug("Query:variants_count:: query:")
         count = self._cached_variants_count_query(self.sql_count())
-        LOGGER.debug(
-            "Query:variants_count:: %s", self._cached_variants_count_query.cache_info()
-        )
+        cache = getattr(self.conn, "query_cache", None)
+        if cache is not None:
+            LOGGER.debug("Query:variants_count:: %s", cache.cache_info())
         return count
 
     ##--------------------------------------------------------------------------
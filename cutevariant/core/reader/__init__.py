@@ -1,5 +1,6 @@
 """Expose of high-level reader classes"""
 from .vcfreader import VcfReader
+from .fastvcfreader import FastVcfReader
 from .csvreader import CsvReader
 from .fakereader import FakeReader
 from .abstractreader import check_field_schema, check_variant_schema
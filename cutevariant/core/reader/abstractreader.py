@@ -122,6 +122,25 @@ def get_fields_by_category(self, category: str):
         """
         return (field for field in self.get_fields() if field["category"] == category)
 
+    def tell(self):
+        """Return the position of the next variant in the file
+
+        The position can be given to seek() by another reader of the same
+        file to resume an import. Override this method with seek().
+
+        :return: A tuple of integers or None if the reader can't seek
+        """
+        return None
+
+    def seek(self, position):
+        """Start the next calls of get_variants() at the given position
+
+        :param position: Position returned by tell()
+        :return: False if the reader can't seek
+        :rtype: <bool>
+        """
+        return False
+
     def get_variants_count(self) -> int:
         """Get variant count from the device.
         Override this method to make it faster
@@ -110,12 +110,9 @@ def get_intervals(self, stream):
         # Throws line with headers
         skipped_header_line = 0  # Will be used to rewind the stream
         for line in stream:
-            if (
-                line.startswith(("@", "#", "track", "browser"))
-                or len(line.strip()) == 0
-            ):
+            if self._is_header(line):
                 # Header detected
-                print("comment", line)
+                LOGGER.debug("BedTool:get_intervals: comment %s", line)
                 skipped_header_line += 1
                 continue
             else:
@@ -160,11 +157,46 @@ def get_intervals(self, stream):
         )
 
         for line_number, interval in enumerate(csv_reader, 1):
-            print(interval)
             yield interval
 
         self.count = line_number
 
+    def tuples(self):
+        """Yield compact tuples of the intervals in the BED data
+
+        Unlike `__iter__`, the stream is read only once (no dialect sniffing,
+        no rewind) and no dictionnary is built; this is the path for large
+        files.
+
+        :return: Generator of tuples (chrom, start, end, name);
+            start and end are integers, name is None if not given.
+        :rtype: <generator <tuple <str>, <int>, <int>, <str>>>
+        """
+        if self.is_from_string:
+            stream = io.StringIO(self.filepath.strip())
+        elif self.is_gz_file:
+            stream = gzip.open(self.filepath, "rt")
+        else:
+            stream = open(self.filepath, "r")
+
+        self.count = 0
+        with stream:
+            for line in stream:
+                if self._is_header(line):
+                    continue
+                # Delimiters can only be '\t' or ' ' since
+                # 'itemRgb' column is comma separated.
+                fields = line.split("\t") if "\t" in line else line.split()
+                name = fields[3].strip() if len(fields) > 3 else None
+                self.count += 1
+                yield (fields[0].strip(), int(fields[1]), int(fields[2]), name)
+
+    @staticmethod
+    def _is_header(line):
+        """Return True if the given line is a header line or an empty line"""
+        line = line.strip()
+        return not line or line.startswith(("@", "#", "track", "browser"))
+
 
 def parse_bed_file(filepath):
     """Parse the given BED file with 'pybedtools' package, yield features in the file
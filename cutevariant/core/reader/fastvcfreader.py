@@ -0,0 +1,278 @@
+# Standard imports
+import gzip
+import io
+import re
+import vcf
+
+# Custom imports
+from .vcfreader import VcfReader
+from cutevariant.commons import logger
+
+LOGGER = logger()
+
+# Values considered as missing by PyVCF
+MISSING_VALUES = {".", "", "NA"}
+
+ALLELE_DELIMITER = re.compile(r"[|/]")
+
+VCF_TYPE_CAST = {"Integer": int, "Float": float, "String": str, "Character": str}
+
+
+class FastVcfReader(VcfReader):
+    """VCF parser which splits lines directly instead of building PyVCF records
+
+    The header is still parsed once by PyVCF (fields, samples); data lines
+    are tokenized here. Only INFO keys and FORMAT fields declared in the
+    header are decoded, with the same conversions as PyVCF, so the variants
+    are the same as those of VcfReader.
+
+    The progression (read_bytes) is the real offset in the file; for
+    compressed files it is the offset in the uncompressed data
+    (like file_size set by create_reader()). The reader can seek to the
+    position of a variant (See tell()), which is used to resume imports.
+
+    .. seealso:: VcfReader class for more information.
+    """
+
+    def __init__(self, device, annotation_parser: str = None):
+        """Construct a fast VCF Reader
+
+        :param device: File device handler returned by open.
+        :key annotation_parser (str): "vep" or "snpeff"
+        """
+        super().__init__(device, annotation_parser)
+
+        self.device.seek(0)
+        vcf_reader = vcf.VCFReader(self.device)
+        # Declared INFO and FORMAT: (cast function, PyVCF number)
+        # Flags have no cast function
+        self.infos = {
+            key: (VCF_TYPE_CAST.get(info.type), info.num)
+            for key, info in vcf_reader.infos.items()
+        }
+        self.formats = {
+            key: (VCF_TYPE_CAST.get(info.type), info.num)
+            for key, info in vcf_reader.formats.items()
+        }
+        # Position set by seek(); offset of the current line and number of
+        # variants yielded from it (records with several ALT)
+        self._start_position = None
+        self._line_offset = 0
+        self._line_variants = 0
+
+    def tell(self):
+        """Return the position of the next variant: the offset of the line of
+        the last variant and the number of variants already yielded from it
+
+        :return: Tuple (offset, variant count) or None for text devices
+            without binary buffer.
+        """
+        if self._binary_device() is None:
+            return None
+        return self._line_offset, self._line_variants
+
+    def seek(self, position):
+        """Start the next calls of get_variants() at the given position
+
+        Data before the position are not parsed; compressed data are still
+        decompressed.
+
+        :param position: Position returned by tell()
+        :return: False for text devices without binary buffer
+        """
+        if self._binary_device() is None:
+            return False
+        self._start_position = tuple(position)
+        return True
+
+    def parse_variants(self):
+        """Read file and parse variants
+
+        .. note:: self.read_bytes is updated with the size of each line read.
+
+        :return: Generator of variants.
+        :rtype: <generator <dict>>
+        """
+        self.read_bytes = 0
+        infos = self.infos
+        # Variants of the first line yielded before the position given to seek()
+        skipped = self._start_position[1] if self._start_position else 0
+
+        for line in self._read_lines():
+            if line.startswith("#"):
+                continue
+
+            row = line.rstrip("\r\n").split("\t")
+
+            variant = {
+                "chr": row[0],
+                "pos": int(row[1]),
+                "ref": row[3],
+                "rsid": None if row[2] == "." else row[2],
+                "qual": self._parse_qual(row[5]),
+                "filter": "",  # TODO ?,
+            }
+
+            # Parse info
+            if row[7] != ".":
+                for entry in row[7].split(";"):
+                    key, equal, value = entry.partition("=")
+                    if key not in infos:
+                        continue
+                    cast, num = infos[key]
+                    if cast is None or (cast is str and not equal):
+                        # Flag
+                        variant[key.lower()] = True
+                    elif equal:
+                        variant[key.lower()] = self._parse_values(
+                            value.split(","), cast, num
+                        )
+
+            # parse sample
+            if len(row) > 9:
+                variant["samples"] = [
+                    self._parse_sample(name, row[8].split(":"), data.split(":"))
+                    for name, data in zip(self.samples, row[9:])
+                ]
+
+            # split row with multiple alt
+            alts = row[4].split(",")
+            for index, alt in enumerate(alts):
+                if index < skipped:
+                    continue
+                if len(alts) == 1:
+                    alt_variant = variant
+                else:
+                    alt_variant = dict(variant)
+                alt_variant["alt"] = alt
+                self._line_variants = index + 1
+                yield alt_variant
+            skipped = 0
+
+    def _binary_device(self):
+        """Return the binary device of the file or None for text devices
+        without binary buffer (io.StringIO...)"""
+        # Use the binary buffer of text files
+        device = getattr(self.device, "buffer", self.device)
+        if isinstance(device, io.TextIOBase):
+            return None
+        return device
+
+    def _read_lines(self):
+        """Iterate over the lines of the file and update self.read_bytes
+
+        Binary devices (compressed or not) are read directly to get real
+        byte offsets; they are read from the position given to seek().
+        """
+        self.device.seek(0)
+        device = self._binary_device()
+
+        if device is None:
+            # Text without buffer (io.StringIO...)
+            for line in self.device:
+                self._line_offset = self.read_bytes
+                self._line_variants = 0
+                self.read_bytes += len(line)
+                yield line
+            return
+
+        if device.read(3) == b"\x1f\x8b\x08":
+            device.seek(0)
+            device = gzip.GzipFile(fileobj=device)
+        else:
+            device.seek(0)
+
+        if self._start_position:
+            device.seek(self._start_position[0])
+            self.read_bytes = self._start_position[0]
+
+        for line in device:
+            self._line_offset = self.read_bytes
+            self._line_variants = 0
+            self.read_bytes += len(line)
+            yield line.decode()
+
+    def _parse_sample(self, name, keys, values):
+        """Build the data of a sample from its FORMAT keys and values
+
+        Missing trailing values are set to None.
+        """
+        sample = {"name": name}
+        gt = None
+        for index, key in enumerate(keys):
+            if key not in self.formats:
+                continue
+            value = values[index] if index < len(values) else None
+
+            if key == "GT":
+                gt = value
+            elif not value or value == ".":
+                value = None
+            elif key == "FT":
+                # Filters: "" (PASS) or list of filters
+                value = "" if value == "PASS" else value.replace(";", ",")
+            else:
+                cast, num = self.formats[key]
+                if cast is str or cast is None:
+                    # Strings are kept as they are
+                    pass
+                elif num == 1:
+                    value = self._parse_values((value,), cast, num)
+                else:
+                    value = self._parse_values(value.split(","), cast, num)
+
+            sample[key.lower()] = value
+
+        sample["gt"] = self._parse_gt_type(gt)
+        return sample
+
+    @staticmethod
+    def _parse_values(values, cast, num):
+        """Convert the given values like PyVCF + VcfReader do
+
+        Single values are returned as is, lists are joined with commas.
+        """
+        try:
+            values = [
+                None if value in MISSING_VALUES else cast(value) for value in values
+            ]
+        except ValueError:
+            # Allow integers to be parsed as floats (like PyVCF)
+            values = [
+                None if value in MISSING_VALUES else float(value) for value in values
+            ]
+
+        if num == 1:
+            return values[0]
+        return ",".join([str(value) for value in values])
+
+    @staticmethod
+    def _parse_qual(qual):
+        """Return QUAL as an int, a float or None"""
+        try:
+            return int(qual)
+        except ValueError:
+            try:
+                return float(qual)
+            except ValueError:
+                return None
+
+    @staticmethod
+    def _parse_gt_type(gt):
+        """Return the type of the given genotype like PyVCF does
+
+        hom_ref = 0, het = 1, hom_alt = 2, uncalled = -1
+        """
+        if gt is None:
+            return -1
+        alleles = [
+            None if allele == "." else allele for allele in ALLELE_DELIMITER.split(gt)
+        ]
+        if all(allele is None for allele in alleles):
+            return -1
+        if all(allele == alleles[0] for allele in alleles[1:]):
+            return 0 if alleles[0] == "0" else 2
+        return 1
+
+    def __repr__(self):
+        return f"Fast VCF Reader using {type(self.annotation_parser).__name__}"
@@ -21,6 +21,10 @@ def is_gz_file(filepath):
 def get_uncompressed_size(filepath):
     """Get the size of the given compressed file
     This size is stored in the last 4 bytes of the file.
+
+    .. warning:: This is the size of the last gzip member only, modulo 2^32:
+        it is wrong for multi-member files (bgzip: 0 because of the empty
+        EOF block) and for files larger than 4 GiB.
     """
     with open(filepath, "rb") as f:
         f.seek(-4, 2)
@@ -54,7 +58,7 @@ def detect_vcf_annotation(filepath):
 
 
 @contextmanager
-def create_reader(filepath):
+def create_reader(filepath, fast=False):
     """Context manager that wraps the given file and return an accurate reader
 
     A detection of the file type is made as well as a detection of the
@@ -65,7 +69,10 @@ def create_reader(filepath):
         - vcf.gz: snpeff, vep
         - vcf: snpeff, vep
         - csv, tsv, txt: vep
+
+    :key fast: Use FastVcfReader instead of VcfReader for VCF files.
     """
+    vcf_reader_class = FastVcfReader if fast else VcfReader
 
     path = pathlib.Path(filepath)
 
@@ -78,7 +85,7 @@ def create_reader(filepath):
     if ".vcf" in path.suffixes and ".gz" in path.suffixes:
         annotation_detected = detect_vcf_annotation(filepath)
         device = open(filepath, "rb")
-        reader = VcfReader(device, annotation_detected)
+        reader = vcf_reader_class(device, annotation_detected)
         reader.file_size = get_uncompressed_size(filepath)
         yield reader
         device.close()
@@ -87,7 +94,7 @@ def create_reader(filepath):
     if ".vcf" in path.suffixes:
         annotation_detected = detect_vcf_annotation(filepath)
         device = open(filepath, "r")
-        reader = VcfReader(device, annotation_detected)
+        reader = vcf_reader_class(device, annotation_detected)
         reader.file_size = os.path.getsize(filepath)
         yield reader
         device.close()
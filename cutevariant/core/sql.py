@@ -7,14 +7,28 @@
 - Annotations functions
 - Variants functions
 - Samples functions
+- Genotype matrix functions
+- Index advisor functions
 """
 
 # Standard imports
+import bisect
+import hashlib
+import heapq
+import json
+import pathlib
 import sqlite3
+import struct
 import sys
-from collections import defaultdict
+import time
+import weakref
+import zlib
+from array import array
+from collections import OrderedDict
+from functools import reduce
+from itertools import islice, groupby
+from operator import and_, itemgetter, or_, sub, xor
 from pkg_resources import parse_version
-from functools import lru_cache
 
 # Custom imports
 import cutevariant.commons as cm
@@ -25,9 +39,126 @@
 ## ================ Misc functions =============================================
 
 
-def get_sql_connexion(filepath):
-    """Open a SQLite database and return the connexion object"""
-    connexion = sqlite3.connect(filepath)
+class QueryCache:
+    """LRU cache of query results
+
+    Results are stored with the generation of the database at the time of
+    the query (See get_generation()); they are dropped when the database
+    has changed since.
+    Memory is bounded by a maximum number of results and a maximum number
+    of rows for all the results.
+
+    Statistics: hits, misses, evictions (results dropped to free memory)
+    and invalidations (results dropped because the database has changed).
+    """
+
+    def __init__(self, max_results=128, max_rows=100000):
+        self.max_results = max_results
+        self.max_rows = max_rows
+        self.clear()
+
+    def clear(self):
+        """Remove all results and reset statistics"""
+        # {key: (generation, rows)}
+        self._results = OrderedDict()
+        self.row_count = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key, generation):
+        """Return the rows stored for the given key or None"""
+        result = self._results.get(key)
+        if result is None:
+            self.misses += 1
+            return None
+
+        if result[0] != generation:
+            self._remove(key)
+            self.invalidations += 1
+            self.misses += 1
+            return None
+
+        self._results.move_to_end(key)
+        self.hits += 1
+        return result[1]
+
+    def put(self, key, generation, rows):
+        """Store the rows of a query; results too large are not stored"""
+        if len(rows) > self.max_rows:
+            return
+        if key in self._results:
+            self._remove(key)
+
+        self._results[key] = (generation, rows)
+        self.row_count += len(rows)
+
+        # Evict least recently used results
+        while len(self._results) > self.max_results or self.row_count > self.max_rows:
+            self._remove(next(iter(self._results)))
+            self.evictions += 1
+
+    def _remove(self, key):
+        _, rows = self._results.pop(key)
+        self.row_count -= len(rows)
+
+    def cache_info(self):
+        """Return statistics as a dictionnary"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "results": len(self._results),
+            "rows": self.row_count,
+        }
+
+    def __len__(self):
+        return len(self._results)
+
+
+class Connection(sqlite3.Connection):
+    """sqlite3 connection with a cache of query results and of the schema
+
+    .. seealso:: cached_query(), get_generation(), get_schema_catalog()
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Incremented by the functions writing in the database
+        self.generation = 0
+        self.query_cache = QueryCache()
+        # See get_schema_catalog()
+        self.schema_catalog = None
+        # Filters of queries used by the index advisor (See advise_indexes())
+        self.filter_workload = FilterWorkload()
+        # See get_selection_bitsets()
+        self.selection_bitsets = None
+        # See get_site_keys() and get_site_runs()
+        self.site_keys = None
+        self.site_runs = None
+
+
+def get_sql_connexion(filepath, read_only=False, cached_statements=256):
+    """Open a SQLite database and return the connexion object
+
+    :param filepath: Path of the database file
+    :key read_only: Open the database in read-only mode; used by threads
+        that only run queries (See QueryThread of the GUI).
+    :key cached_statements: Number of prepared statements kept by the
+        connexion; queries of QueryBuilder are parameterized to reuse them.
+    :return: The connexion, an instance of Connection.
+    """
+    if read_only:
+        uri = pathlib.Path(filepath).absolute().as_uri() + "?mode=ro"
+        connexion = sqlite3.connect(
+            uri, uri=True, factory=Connection, cached_statements=cached_statements
+        )
+    else:
+        connexion = sqlite3.connect(
+            filepath, factory=Connection, cached_statements=cached_statements
+        )
     # Activate Foreign keys
     connexion.execute("PRAGMA foreign_keys = ON")
     connexion.row_factory = sqlite3.Row
@@ -37,6 +168,238 @@ def get_sql_connexion(filepath):
     return connexion
 
 
+def bump_generation(conn):
+    """Mark the database as modified: cached query results are invalidated
+
+    :param conn: sqlite3 connection or cursor
+    """
+    conn = getattr(conn, "connection", conn)
+    if isinstance(conn, Connection):
+        conn.generation += 1
+
+
+def get_generation(conn):
+    """Return a value which changes each time the database is modified
+
+    The value combines:
+        - the counter of bump_generation(), incremented by the functions
+          writing in the database (selections, imports);
+        - the number of rows modified by this connection (total_changes);
+        - PRAGMA data_version, changed by commits of other connections.
+
+    :rtype: <tuple>
+    """
+    return (
+        getattr(conn, "generation", 0),
+        conn.total_changes,
+        conn.execute("PRAGMA data_version").fetchone()[0],
+    )
+
+
+def cached_query(conn, query: str, params=()):
+    """Execute the given query and return all its rows, from the cache if possible
+
+    The cache of the connection is used (See Connection); queries are
+    executed without cache with other sqlite3 connections.
+
+    :param query: SQL query; whitespaces are normalized in cache keys.
+    :param params: Parameters of the query
+    :rtype: <list>
+    """
+    cache = getattr(conn, "query_cache", None)
+    if cache is None:
+        return conn.execute(query, params).fetchall()
+
+    key = (" ".join(query.split()), tuple(params), conn.row_factory)
+    generation = get_generation(conn)
+    rows = cache.get(key, generation)
+    if rows is None:
+        rows = conn.execute(query, params).fetchall()
+        cache.put(key, generation, rows)
+    return rows
+
+
+class SchemaCatalog:
+    """Schema of a database: columns of tables, fields and samples
+
+    The catalog is read once per connection and shared by its users
+    (QueryBuilder, Query, the filter and columns plugins of the GUI);
+    See get_schema_catalog().
+
+    Attributes:
+        version: Versions of the database at the time of the reading
+            (PRAGMA schema_version and data_version)
+        columns: Columns of each table (without "id") as frozensets
+        fields: Records of the "fields" table, ordered by id; a name can be
+            used by fields of several categories (ex: "dp" of INFO and FORMAT)
+        fields_by_key: Records of fields by (name, category)
+        samples_ids: Ids of samples by name, ordered by id
+    """
+
+    def __init__(self, conn, version=None):
+        self.version = version or get_schema_version(conn)
+        tables = [
+            row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+        ]
+        self.columns = {table: frozenset(get_columns(conn, table)) for table in tables}
+        self.fields = list(get_fields(conn)) if "fields" in self.columns else []
+        self.fields_by_key = {
+            (field["name"], field["category"]): field for field in self.fields
+        }
+        # First field of each name, like get_field_by_name()
+        self._fields_by_name = {}
+        for field in self.fields:
+            self._fields_by_name.setdefault(field["name"], field)
+        self.samples_ids = (
+            {
+                row[0]: row[1]
+                for row in conn.execute("SELECT name, id FROM samples ORDER BY id")
+            }
+            if "samples" in self.columns
+            else dict()
+        )
+
+    def has_table(self, table_name: str):
+        return table_name in self.columns
+
+    def get_columns(self, table_name: str):
+        """Return the columns of the given table (empty if it doesn't exist)
+
+        :rtype: <frozenset <str>>
+        """
+        return self.columns.get(table_name, frozenset())
+
+    def get_field(self, field_name: str, category: str = None):
+        """Return the record of the given field or None
+
+        :key category: Category of the field; the first field with this
+            name by default (See get_field_by_name()).
+        """
+        if category is None:
+            return self._fields_by_name.get(field_name)
+        return self.fields_by_key.get((field_name, category))
+
+    def get_fields_by_category(self, category: str):
+        """Return the records of fields of the given category
+
+        :rtype: <list <dict>>
+        """
+        return [field for field in self.fields if field["category"] == category]
+
+    @property
+    def samples(self):
+        """Names of samples ordered by id"""
+        return list(self.samples_ids)
+
+
+def raw_cursor(conn):
+    """Return a cursor of the connection which gives rows as tuples
+
+    Used to read many rows: tuples are faster to build than sqlite3.Row
+    objects (row_factory of connections of get_sql_connexion()).
+
+    :param conn: sqlite3 connection
+    :rtype: <sqlite3.Cursor>
+    """
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    return cursor
+
+
+def get_schema_version(conn):
+    """Return a tuple which changes when the schema of the database changes
+    or when another connection commits changes"""
+    return (
+        conn.execute("PRAGMA schema_version").fetchone()[0],
+        conn.execute("PRAGMA data_version").fetchone()[0],
+    )
+
+
+def get_schema_catalog(conn):
+    """Return the schema catalog (See SchemaCatalog) of the given connection
+
+    The catalog is stored on Connection objects and is read again when the
+    schema changes (tables created, dropped or altered), when another
+    connection commits changes, or when fields or samples are inserted with
+    this module (See invalidate_schema_catalog()).
+    Other connections get a new catalog at each call.
+
+    :param conn: sqlite3 connection
+    :rtype: <SchemaCatalog>
+    """
+    version = get_schema_version(conn)
+    catalog = getattr(conn, "schema_catalog", None)
+    if catalog is None or catalog.version != version:
+        catalog = SchemaCatalog(conn, version)
+        if isinstance(conn, Connection):
+            conn.schema_catalog = catalog
+    return catalog
+
+
+def invalidate_schema_catalog(conn):
+    """Drop the schema catalog of the connection; called after insertions of
+    fields and samples
+
+    :param conn: sqlite3 connection or cursor
+    """
+    conn = getattr(conn, "connection", conn)
+    if isinstance(conn, Connection):
+        conn.schema_catalog = None
+
+
+def get_database_filepath(conn):
+    """Return the path of the file of the main database of the given connexion
+
+    :return: The filepath or None for in-memory or temporary databases.
+    :rtype: <str>
+    """
+    for database in conn.execute("PRAGMA database_list"):
+        if database[1] == "main":
+            return database[2] or None
+
+
+# PRAGMA statements applied by set_connexion_profile()
+# - bulk: used during imports; durability against OS crashes is traded for
+#   speed. WAL journal (not OFF or MEMORY) keeps the database consistent
+#   after a crash of the application so that the import can be resumed from
+#   its last checkpoint (See save_import_checkpoint()); it also allows
+#   rolling back savepoints during insertions (See insert_variants_rows()).
+#   page_size is only effective before the creation of the first table.
+# - interactive: SQLite default settings, safe for the user's work.
+CONNEXION_PROFILES = {
+    "bulk": {
+        "page_size": 8192,
+        "journal_mode": "WAL",
+        "synchronous": "OFF",
+        "cache_size": -262144,  # 256 MB
+        "temp_store": "MEMORY",
+        "mmap_size": 1073741824,  # 1 GB
+    },
+    "interactive": {
+        "journal_mode": "DELETE",
+        "synchronous": "FULL",
+        "cache_size": -2000,  # 2 MB
+        "temp_store": "DEFAULT",
+        "mmap_size": 0,
+    },
+}
+
+
+def set_connexion_profile(conn, profile: str):
+    """Apply the PRAGMA statements of the given profile to the connexion
+
+    .. note:: The current transaction is committed; journal mode can't be
+        changed inside a transaction.
+
+    :param conn: sqlite3.connect
+    :param profile: Name of a profile in CONNEXION_PROFILES ("bulk", "interactive")
+    """
+    conn.commit()
+    for pragma, value in CONNEXION_PROFILES[profile].items():
+        conn.execute(f"PRAGMA {pragma} = {value}")
+    LOGGER.debug("set_connexion_profile:: %s profile applied", profile)
+
+
 def drop_table(conn, table_name):
     """Drop the given table"""
     cursor = conn.cursor()
@@ -66,6 +429,65 @@ def create_project(conn, name: str, reference: str):
     conn.commit()
 
 
+def create_table_metadatas(conn):
+    """Create the table "metadatas" which stores key/value pairs about the project
+
+    Used to save the checkpoints of imports (See save_import_checkpoint()).
+
+    :param conn: sqlite3.connect
+    """
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS metadatas (key TEXT PRIMARY KEY, value TEXT)"""
+    )
+    conn.commit()
+
+
+def update_metadatas(conn, metadatas: dict):
+    """Insert or replace the given metadatas
+
+    .. note:: No commit is made here.
+
+    :param conn: sqlite3.connect
+    :param metadatas: Dictionnary of keys and values
+    """
+    conn.executemany(
+        """INSERT OR REPLACE INTO metadatas (key, value) VALUES (?, ?)""",
+        metadatas.items(),
+    )
+
+
+def get_metadatas(conn):
+    """Return the metadatas of the project
+
+    :return: Dictionnary of keys and values (values are strings).
+        Empty if the table "metadatas" doesn't exist.
+    :rtype: <dict>
+    """
+    try:
+        return {key: value for key, value in conn.execute("SELECT key, value FROM metadatas")}
+    except sqlite3.OperationalError:
+        return {}
+
+
+def save_import_checkpoint(conn, variant_count: int, errors: int, **metadatas):
+    """Save the progression of an import in the table "metadatas"
+
+    An interrupted import can be resumed from the last checkpoint committed
+    (See async_insert_many_variants()).
+
+    .. note:: No commit is made here; the checkpoint must be committed with
+        the variants it refers to.
+
+    :param variant_count: Number of variants read from the source
+        (inserted or rejected)
+    :param errors: Number of variants rejected
+    :key metadatas: Extra information (ex: import_read_bytes)
+    """
+    metadatas["import_variant_count"] = variant_count
+    metadatas["import_errors"] = errors
+    update_metadatas(conn, metadatas)
+
+
 def get_columns(conn, table_name):
     """Return the list of columns for the given table
 
@@ -108,6 +530,9 @@ def create_table_selections(conn):
         - name: name of the set of variants
         - count: number of variants concerned by this set
         - query: the SQL query which generated the set
+        - bitmap: variant ids of the set if it is stored as a bitmap
+          (See encode_selection_bitmap()); NULL if they are stored in
+          "selection_has_variant"
 
     :param conn: sqlite3.connect
     """
@@ -116,7 +541,7 @@ def create_table_selections(conn):
     cursor.execute(
         """CREATE TABLE selections (
         id INTEGER PRIMARY KEY ASC,
-        name TEXT, count INTEGER, query TEXT
+        name TEXT, count INTEGER, query TEXT, bitmap BLOB
         )"""
     )
 
@@ -141,7 +566,7 @@ def create_selections_indexes(conn):
 
     .. note:: This function ensures the unicity of selections names.
     """
-    conn.execute("""CREATE UNIQUE INDEX idx_selections ON selections (name)""")
+    conn.execute("""CREATE UNIQUE INDEX IF NOT EXISTS idx_selections ON selections (name)""")
 
 
 def create_selection_has_variant_indexes(conn):
@@ -153,11 +578,11 @@ def create_selection_has_variant_indexes(conn):
     """
     # For joints between selections and variants tables
     conn.execute(
-        """CREATE INDEX idx_selection_has_variant ON selection_has_variant (selection_id)"""
+        """CREATE INDEX IF NOT EXISTS idx_selection_has_variant ON selection_has_variant (selection_id)"""
     )
 
 
-def insert_selection(conn, query: str, name="no_name", count=0):
+def insert_selection(conn, query: str, name="no_name", count=0, bitmap=None):
     """Insert one selection record
 
     TODO: retirer le group by inutile
@@ -170,6 +595,8 @@ def insert_selection(conn, query: str, name="no_name", count=0):
     :param name: name of the selection
     :param count: precompute variant count
     :param query: Sql variant query selection
+    :key bitmap: Variant ids of the selection stored as a bitmap
+        (See encode_selection_bitmap())
     :type conn: <sqlite3.Connection> or <sqlite3.Cursor>
     :return: rowid of the new selection inserted.
     :rtype: <int>
@@ -179,10 +606,18 @@ def insert_selection(conn, query: str, name="no_name", count=0):
     # conn can be a cursor or a connection here...
     cursor = conn.cursor() if isinstance(conn, sqlite3.Connection) else conn
 
-    cursor.execute(
-        """INSERT INTO selections (name, count, query) VALUES (?,?,?)""",
-        (name, count, query),
-    )
+    if bitmap is None:
+        cursor.execute(
+            """INSERT INTO selections (name, count, query) VALUES (?,?,?)""",
+            (name, count, query),
+        )
+    else:
+        _add_selections_bitmap_column(cursor.connection)
+        cursor.execute(
+            """INSERT INTO selections (name, count, query, bitmap) VALUES (?,?,?,?)""",
+            (name, count, query, bitmap),
+        )
+    bump_generation(cursor)
     if isinstance(conn, sqlite3.Connection):
         # Commit only if connection is given. => avoid not consistent DB
         conn.commit()
@@ -202,10 +637,11 @@ def delete_selection_by_name(conn, name: str):
         
     cursor = conn.cursor()
     cursor.execute(f"DELETE FROM selections WHERE name = ?", (name,))
+    bump_generation(conn)
     conn.commit()
 
 def create_selection_from_sql(
-    conn, query: str, name: str, count=None, from_selection=False
+    conn, query: str, name: str, count=None, from_selection=False, store=None
 ):
     """Create a selection record from sql variant query
 
@@ -214,11 +650,19 @@ def create_selection_from_sql(
     :param query: sql variant query
     :param from_selection: Optimized flag only for the creation of a selection
         from set operations, variant_id is the only useful column in the given query.
+    :key store: "table" or "bitmap" (See SELECTION_STORES);
+        DEFAULT_SELECTION_STORE by default.
     :return: The id of the new selection. None in case of error.
     :rtype: <int> or None
     """
     cursor = conn.cursor()
 
+    if (store or DEFAULT_SELECTION_STORE) == "bitmap":
+        id_column = "variant_id" if from_selection else "id"
+        cursor.row_factory = None
+        variant_ids = sorted({row[0] for row in cursor.execute(f"SELECT {id_column} FROM ({query})")})
+        return create_selection_from_ids(conn, name, variant_ids, query=query, store="bitmap")
+
     # Compute query count
     #  TODO : this can take a while .... need to compute only one from elsewhere
     if not count:
@@ -268,12 +712,26 @@ def create_selection_from_sql(
 
 
 def create_selection_from_bed(conn, source: str, target: str, bed_intervals):
-    """Create a new selection based on the given intervals taken from a BED file"""
+    """Create a new selection based on the given intervals taken from a BED file
+
+    Intervals are loaded in "bed_table" with their genomic bin; all the bins
+    that may contain overlapping variants are stored in "bed_bins".
+    Thus, the join with variants uses the index idx_variants_bin
+    (chr, bin, pos) instead of a nested scan.
+
+    .. seealso:: reg2bins()
+
+    :param source: Name of the selection from which variants are taken
+    :param target: Name of the new selection
+    :param bed_intervals: BedTool object or iterable of intervals
+        (dict with chrom, start, end and name keys)
+    """
 
     cur = conn.cursor()
 
-    #  Create temporary table
+    #  Create temporary tables
     cur.execute("DROP TABLE IF exists bed_table")
+    cur.execute("DROP TABLE IF exists bed_bins")
     cur.execute(
         """CREATE TABLE bed_table (
         id INTEGER PRIMARY KEY ASC, 
@@ -283,40 +741,190 @@ def create_selection_from_bed(conn, source: str, target: str, bed_intervals):
         end INTEGER,
         name INTEGER )"""
     )
+    cur.execute(
+        """CREATE TABLE bed_bins (
+        bed_id INTEGER,
+        bin INTEGER,
+        PRIMARY KEY (bed_id, bin)) WITHOUT ROWID"""
+    )
+
+    # Intervals are streamed: BED files can be too large to be kept in memory
+    cur.executemany(
+        "INSERT INTO bed_table (bin, chrom, start, end, name) VALUES (?,?,?,?,?)",
+        (
+            (reg2bin(start, max(end, start + 1)), chrom, start, end, name)
+            for chrom, start, end, name in iter_bed_tuples(bed_intervals)
+        ),
+    )
+    # Variants are selected if start <= pos <= end (pos is 1-based)
+    # => their bins overlap [start - 1, end[ in 0-based coordinates
+    cur.executemany(
+        "INSERT INTO bed_bins (bed_id, bin) VALUES (?,?)",
+        (
+            (bed_id, bin)
+            for bed_id, start, end in conn.execute(
+                "SELECT id, start, end FROM bed_table"
+            )
+            for bin in reg2bins(max(start - 1, 0), max(end, start))
+        ),
+    )
+
+    if "bin" in get_columns(conn, "variants"):
+        # CROSS JOIN forces the loop order: intervals, bins, then variants
+        # found with the index idx_variants_bin
+        query = """
+        SELECT variants.id as variant_id FROM bed_table
+        CROSS JOIN bed_bins ON bed_bins.bed_id = bed_table.id
+        CROSS JOIN variants ON
+            variants.chr = bed_table.chrom AND
+            variants.bin = bed_bins.bin AND
+            variants.pos >= bed_table.start AND
+            variants.pos <= bed_table.end """
+    else:
+        # Databases created without bins
+        query = """
+        SELECT variants.id as variant_id FROM variants
+        INNER JOIN bed_table ON
+            variants.chr = bed_table.chrom AND
+            variants.pos >= bed_table.start AND
+            variants.pos <= bed_table.end """
+
+    if source != "variants":
+        query += selection_join_sql(conn, source)
+
+    return create_selection_from_sql(conn, query, target, from_selection=True)
+
 
+def iter_bed_tuples(bed_intervals):
+    """Iterate over intervals as tuples (chrom, start, end, name)
+
+    BedTool objects are read with their streaming method `tuples()`;
+    other iterables must yield dictionnaries like `BedTool.__iter__` does.
+
+    :param bed_intervals: BedTool object or iterable of dict with chrom,
+        start, end and name keys
+    :rtype: <generator <tuple <str>, <int>, <int>, <str>>>
+    """
+    tuples = getattr(bed_intervals, "tuples", None)
+    if tuples:
+        yield from tuples()
+        return
     for interval in bed_intervals:
-        cur.execute(
-            "INSERT INTO bed_table (bin, chrom, start, end, name) VALUES (?,?,?,?,?)",
-            (
-                0,
-                interval["chrom"],
-                interval["start"],
-                interval["end"],
-                interval["name"],
-            ),
+        yield (
+            interval["chrom"],
+            int(interval["start"]),
+            int(interval["end"]),
+            interval.get("name"),
         )
 
+
+def create_selection_from_sorted_bed(conn, source: str, target: str, bed_intervals):
+    """Create a new selection from intervals sorted by chromosome and start
+
+    Intervals are never stored: overlapping intervals are merged on the fly
+    and each chromosome is intersected with its variants sorted by position
+    (sweep line). Memory usage only depends on the number of selected
+    variants.
+
+    Intervals must be grouped by chromosome and sorted by start
+    (`sort -k1,1 -k2,2n`).
+
+    .. seealso:: create_selection_from_bed() for unsorted intervals.
+
+    :param source: Name of the selection from which variants are taken
+    :param target: Name of the new selection
+    :param bed_intervals: BedTool object or iterable of intervals
+        (dict with chrom, start, end and name keys)
+    :return: The id of the new selection.
+    :rtype: <int>
+    :raises ValueError: If intervals are not sorted.
+    """
     if source == "variants":
-        source_query = "SELECT variants.id as variant_id FROM variants"
+        query = "SELECT id, pos FROM variants WHERE chr = ? ORDER BY pos"
+        params = ()
     else:
-        source_query = """
-        SELECT variants.id as variant_id FROM variants
-        INNER JOIN selections ON selections.name = '{}'
-        INNER JOIN selection_has_variant sv ON sv.variant_id = variants.id AND sv.selection_id = selections.id  
-        """.format(
-            source
+        query = (
+            "SELECT variants.id, variants.pos FROM variants"
+            + selection_join_sql(conn, source, "?")
+            + " WHERE variants.chr = ? ORDER BY variants.pos"
         )
+        params = (source,)
+
+    variant_ids = []
+    seen_chroms = set()
+    for chrom, intervals in groupby(iter_bed_tuples(bed_intervals), key=itemgetter(0)):
+        if chrom in seen_chroms:
+            raise ValueError(f"BED intervals are not grouped by chromosome: {chrom}")
+        seen_chroms.add(chrom)
+
+        variants = conn.execute(query, params + (chrom,))
+        variant = next(variants, None)
+        previous_start = -1
+        for _, start, end, _ in _merge_sorted_intervals(intervals):
+            if start < previous_start:
+                raise ValueError(f"BED intervals are not sorted: {chrom}:{start}")
+            previous_start = start
+            # Variants are selected if start <= pos <= end
+            while variant and variant[1] < start:
+                variant = next(variants, None)
+            while variant and variant[1] <= end:
+                variant_ids.append(variant[0])
+                variant = next(variants, None)
+
+    return create_selection_from_ids(conn, target, variant_ids)
+
+
+def _merge_sorted_intervals(intervals):
+    """Merge overlapping intervals of a sorted iterable of tuples
+
+    Unsorted intervals are yielded as they are, so that the caller can
+    detect them.
+    """
+    current = None
+    for interval in intervals:
+        if current and current[1] <= interval[1] <= current[2]:
+            if interval[2] > current[2]:
+                current = (current[0], current[1], interval[2], current[3])
+            continue
+        if current:
+            yield current
+        current = interval
+    if current:
+        yield current
 
-    query = (
-        source_query
-        + """  
-                INNER JOIN bed_table ON 
-                variants.chr = bed_table.chrom AND 
-                variants.pos >= bed_table.start AND 
-                variants.pos <= bed_table.end """
-    )
 
-    return create_selection_from_sql(conn, query, target, from_selection=True)
+def create_selection_from_ids(conn, name: str, variant_ids, query="", store=None):
+    """Create a selection record from the given variant ids
+
+    Selections stored as bitmaps are written in one row of "selections";
+    the index of "selection_has_variant" is not modified.
+
+    :param conn: sqlite3 connection
+    :param name: name of the selection
+    :param variant_ids: List of unique variant ids; they must be sorted
+        to be stored as a bitmap.
+    :key query: SQL query saved with the selection
+    :key store: "table" or "bitmap" (See SELECTION_STORES);
+        DEFAULT_SELECTION_STORE by default.
+    :return: The id of the new selection.
+    :rtype: <int>
+    """
+    cursor = conn.cursor()
+    if (store or DEFAULT_SELECTION_STORE) == "bitmap":
+        bitmap = encode_selection_bitmap(variant_ids)
+        selection_id = insert_selection(
+            cursor, query, name=name, count=len(variant_ids), bitmap=bitmap
+        )
+        conn.commit()
+        return selection_id
+
+    selection_id = insert_selection(cursor, query, name=name, count=len(variant_ids))
+    cursor.executemany(
+        "INSERT INTO selection_has_variant (variant_id, selection_id) VALUES (?,?)",
+        ((variant_id, selection_id) for variant_id in variant_ids),
+    )
+    conn.commit()
+    return selection_id
 
 
 def get_selections(conn):
@@ -341,6 +949,7 @@ def delete_selection(conn, selection_id: int):
     # ON CASCADE deletion
     cursor = conn.cursor()
     cursor.execute("DELETE FROM selections WHERE rowid = ?", (selection_id,))
+    bump_generation(conn)
     conn.commit()
     return cursor.rowcount
 
@@ -355,10 +964,302 @@ def edit_selection(conn, selection: dict):
     conn.execute(
         "UPDATE selections SET name=:name, count=:count WHERE id = :id", selection
     )
+    bump_generation(conn)
     conn.commit()
     return cursor.rowcount
 
 
+# Selection bitmaps (alternative store of selections, See
+# create_selection_from_ids()): variant ids are split in containers of 65536
+# ids sharing their high bits (key); each container is stored in the most
+# compact form:
+# - array: low 16 bits of the ids (2 bytes per id),
+# - bitset: one bit per id of the container (8192 bytes),
+# - runs: (low bits of the first id, length - 1) of runs of consecutive ids
+#   (4 bytes per run).
+# Containers start with a header: key, type, number of ids or runs
+SELECTION_BITMAP_HEADER = struct.Struct("<HBH")
+BITMAP_ARRAY, BITMAP_BITSET, BITMAP_RUNS = 0, 1, 2
+BITMAP_CONTAINER_SIZE = 1 << 16
+BITMAP_BITSET_SIZE = BITMAP_CONTAINER_SIZE // 8
+# Stores of selections: rows of "selection_has_variant" or bitmap in "selections"
+SELECTION_STORES = ("table", "bitmap")
+DEFAULT_SELECTION_STORE = "table"
+
+# Positions of the bits set in each byte
+_BYTE_BITS = [tuple(bit for bit in range(8) if byte >> bit & 1) for byte in range(256)]
+
+
+def _uint16_to_bytes(values):
+    data = array("H", values)
+    if sys.byteorder == "big":
+        data.byteswap()
+    return data.tobytes()
+
+
+def _bytes_to_uint16(payload):
+    data = array("H")
+    data.frombytes(payload)
+    if sys.byteorder == "big":
+        data.byteswap()
+    return data
+
+
+def encode_selection_bitmap(variant_ids):
+    """Encode variant ids into a selection bitmap
+
+    :param variant_ids: Unique variant ids in ascending order (32 bits)
+    :return: The bitmap (See SELECTION_BITMAP_HEADER)
+    :rtype: <bytes>
+    """
+    if not isinstance(variant_ids, list):
+        variant_ids = list(variant_ids)
+    if variant_ids and (variant_ids[0] < 0 or variant_ids[-1] >> 32):
+        raise ValueError("encode_selection_bitmap:: ids must be 32 bits integers")
+
+    containers = []
+    start = 0
+    while start < len(variant_ids):
+        key = variant_ids[start] >> 16
+        base = key << 16
+        end = bisect.bisect_left(variant_ids, base + BITMAP_CONTAINER_SIZE, start)
+        chunk = variant_ids[start:end]
+        count = end - start
+        start = end
+
+        # Runs (2 values per run) unless they are larger than other forms
+        max_size = min(count, BITMAP_BITSET_SIZE // 2)
+        if chunk[-1] - chunk[0] + 1 == count:
+            runs = [chunk[0] - base, count - 1]
+        else:
+            runs = []
+            run_start = previous = chunk[0]
+            for variant_id in islice(chunk, 1, None):
+                if variant_id != previous + 1:
+                    runs += (run_start - base, previous - run_start)
+                    if len(runs) >= max_size:
+                        break
+                    run_start = variant_id
+                previous = variant_id
+            else:
+                runs += (run_start - base, previous - run_start)
+
+        if len(runs) < max_size:
+            kind, size, payload = BITMAP_RUNS, len(runs) // 2, _uint16_to_bytes(runs)
+        elif count < BITMAP_BITSET_SIZE // 2:
+            kind, size = BITMAP_ARRAY, count
+            payload = _uint16_to_bytes([variant_id - base for variant_id in chunk])
+        else:
+            kind, size = BITMAP_BITSET, 0
+            payload = bytearray(BITMAP_BITSET_SIZE)
+            for variant_id in chunk:
+                low = variant_id - base
+                payload[low >> 3] |= 1 << (low & 7)
+
+        containers.append(SELECTION_BITMAP_HEADER.pack(key, kind, size))
+        containers.append(payload)
+
+    return b"".join(containers)
+
+
+def _iter_selection_bitmap(bitmap):
+    """Iterate over the containers of a bitmap: (first id, type, payload)"""
+    offset = 0
+    while offset < len(bitmap):
+        key, kind, size = SELECTION_BITMAP_HEADER.unpack_from(bitmap, offset)
+        offset += SELECTION_BITMAP_HEADER.size
+        if kind == BITMAP_BITSET:
+            size = BITMAP_BITSET_SIZE
+        elif kind == BITMAP_ARRAY:
+            size *= 2
+        else:
+            size *= 4
+        yield key << 16, kind, bitmap[offset : offset + size]
+        offset += size
+
+
+def decode_selection_bitmap(bitmap):
+    """Return the variant ids of a selection bitmap in ascending order
+
+    :rtype: <list <int>>
+    """
+    variant_ids = []
+    for base, kind, payload in _iter_selection_bitmap(bitmap):
+        if kind == BITMAP_ARRAY:
+            variant_ids += [base + low for low in _bytes_to_uint16(payload)]
+        elif kind == BITMAP_RUNS:
+            runs = _bytes_to_uint16(payload)
+            for index in range(0, len(runs), 2):
+                first = base + runs[index]
+                variant_ids += range(first, first + runs[index + 1] + 1)
+        else:
+            for index, byte in enumerate(payload):
+                if byte:
+                    first = base + index * 8
+                    variant_ids += [first + bit for bit in _BYTE_BITS[byte]]
+    return variant_ids
+
+
+def selection_bitmap_to_bitset(bitmap):
+    """Return the bitset of the variant ids of a selection bitmap
+
+    Bit i (bit i % 8 of byte i // 8) is set if the id i is in the selection;
+    int.from_bytes(bitset, "little") gives the same set as an integer.
+
+    :rtype: <bytearray>
+    """
+    containers = list(_iter_selection_bitmap(bitmap))
+    if not containers:
+        return bytearray()
+    bitset = bytearray((containers[-1][0] + BITMAP_CONTAINER_SIZE) // 8)
+    for base, kind, payload in containers:
+        if kind == BITMAP_BITSET:
+            bitset[base // 8 : base // 8 + BITMAP_BITSET_SIZE] = payload
+        elif kind == BITMAP_ARRAY:
+            for low in _bytes_to_uint16(payload):
+                bitset[(base + low) >> 3] |= 1 << (low & 7)
+        else:
+            runs = _bytes_to_uint16(payload)
+            for index in range(0, len(runs), 2):
+                first = base + runs[index]
+                _set_bits(bitset, first, first + runs[index + 1])
+    return bitset
+
+
+def _set_bits(bitset, first, last):
+    """Set the bits from first to last (included) of a bytearray"""
+    while first <= last and first & 7:
+        bitset[first >> 3] |= 1 << (first & 7)
+        first += 1
+    while first <= last and (last + 1) & 7:
+        bitset[last >> 3] |= 1 << (last & 7)
+        last -= 1
+    if first <= last:
+        bitset[first >> 3 : (last >> 3) + 1] = b"\xff" * ((last - first + 1) >> 3)
+
+
+class SelectionBitsets:
+    """Bitsets of the selections stored as bitmaps
+
+    They are used by the SQL function in_selection(selection_id, variant_id)
+    registered on the connection (See get_selection_bitsets()). Bitsets are
+    loaded by load_selection_bitset() before the queries; unknown selections
+    are loaded on demand.
+
+    Attributes:
+        bitsets (dict): {selection id: (bitmap, bitset)}
+        bounds (dict): {selection id: (first id, last id)}; (1, 0) if empty
+    """
+
+    def __init__(self, conn):
+        self.bitsets = dict()
+        self.bounds = dict()
+        # The connection keeps a reference to this object
+        self._conn = weakref.ref(conn) if isinstance(conn, Connection) else lambda: conn
+
+    def load(self, selection_id, bitmap):
+        """Decode the bitmap of a selection if it has changed"""
+        cached = self.bitsets.get(selection_id)
+        if cached is None or cached[0] != bitmap:
+            bitset = selection_bitmap_to_bitset(bitmap)
+            self.bitsets[selection_id] = (bitmap, bitset)
+            # Lowest and highest bits set
+            first = len(bitset) - len(bitset.lstrip(b"\0"))
+            last = len(bitset.rstrip(b"\0")) - 1
+            if last < 0:
+                self.bounds[selection_id] = (1, 0)
+            else:
+                self.bounds[selection_id] = (
+                    first * 8 + _BYTE_BITS[bitset[first]][0],
+                    last * 8 + _BYTE_BITS[bitset[last]][-1],
+                )
+
+    def contains(self, selection_id, variant_id):
+        """Return 1 if the variant is in the selection, 0 otherwise"""
+        cached = self.bitsets.get(selection_id)
+        if cached is None:
+            record = self._conn().execute(
+                "SELECT bitmap FROM selections WHERE id = ?", (selection_id,)
+            ).fetchone()
+            self.load(selection_id, record[0] if record and record[0] else b"")
+            cached = self.bitsets[selection_id]
+        bitset = cached[1]
+        index = variant_id >> 3
+        return bitset[index] >> (variant_id & 7) & 1 if index < len(bitset) else 0
+
+
+def get_selection_bitsets(conn):
+    """Return the bitsets of selections of the connection
+
+    The SQL function in_selection() is registered on the first call.
+
+    :rtype: <SelectionBitsets>
+    """
+    bitsets = getattr(conn, "selection_bitsets", None)
+    if bitsets is None:
+        bitsets = SelectionBitsets(conn)
+        if sys.version_info >= (3, 8):
+            conn.create_function("in_selection", 2, bitsets.contains, deterministic=True)
+        else:
+            conn.create_function("in_selection", 2, bitsets.contains)
+        if isinstance(conn, Connection):
+            conn.selection_bitsets = bitsets
+    return bitsets
+
+
+def load_selection_bitset(conn, name: str):
+    """Load the bitset of a selection stored as a bitmap
+
+    :return: The id of the selection, None if it isn't stored as a bitmap.
+    :rtype: <int>
+    """
+    if "bitmap" not in get_schema_catalog(conn).get_columns("selections"):
+        return None
+    record = conn.execute(
+        "SELECT id, bitmap FROM selections WHERE name = ?", (name,)
+    ).fetchone()
+    if record is None or record[1] is None:
+        return None
+    get_selection_bitsets(conn).load(record[0], record[1])
+    return record[0]
+
+
+def selection_join_sql(conn, name: str, name_sql=None, id_column="variants.id"):
+    """Return the SQL joins restricting variants to those of a selection
+
+    Selections stored as bitmaps are joined with the function in_selection();
+    the range of their ids is given to SQLite to scan only this range of
+    variants. Other selections are joined with "selection_has_variant".
+
+    :param name: Name of the selection
+    :key name_sql: SQL expression of the name; the quoted name by default
+        ("?" for parameterized queries)
+    :key id_column: Column of variant ids to join
+    :rtype: <str>
+    """
+    if name_sql is None:
+        name_sql = "'" + name.replace("'", "''") + "'"
+    selection_id = load_selection_bitset(conn, name)
+    if selection_id is not None:
+        first, last = get_selection_bitsets(conn).bounds[selection_id]
+        return (
+            f" INNER JOIN selections s ON s.name = {name_sql}"
+            f" AND {id_column} BETWEEN {first} AND {last}"
+            f" AND in_selection(s.id, {id_column})"
+        )
+    return (
+        f" INNER JOIN selection_has_variant sv ON sv.variant_id = {id_column} "
+        f"INNER JOIN selections s ON s.id = sv.selection_id AND s.name = {name_sql}"
+    )
+
+
+def _add_selections_bitmap_column(conn):
+    """Add the column "bitmap" to "selections" of databases created without it"""
+    if "bitmap" not in get_schema_catalog(conn).get_columns("selections"):
+        conn.execute("ALTER TABLE selections ADD COLUMN bitmap BLOB")
+        invalidate_schema_catalog(conn)
+
+
 ## ================ Operations on sets of variants =============================
 
 
@@ -401,64 +1302,434 @@ def subtract_variants(query1, query2, **kwargs):
     return f"""{query1} EXCEPT {query2}"""
 
 
-## ================ Fields functions ===========================================
+# Operators of set expressions (See evaluate_set_expression()) on bitsets
+# held by Python integers (bit i is set if variant i is in the set)
+SET_OPERATORS = {
+    "+": or_,
+    "&": and_,
+    "-": lambda bitset1, bitset2: bitset1 & ~bitset2,
+    "^": xor,
+}
 
+# Operators of set expressions on sets of site keys (See apply_site_operator())
+SITE_OPERATORS = {"+": or_, "&": and_, "-": sub, "^": xor}
 
-def create_table_fields(conn):
-    """Create the table "fields"
+# Ways variants are compared by set operations (See evaluate_set_expression())
+SET_OPERATION_MODES = ("variant", "site")
 
-    This table contain fields. A field is a column with its description and type;
-    it can be choose by a user to build a Query
-    Fields are the columns of the tables: variants, annotations and sample_has_variant.
-    Fields are extracted from reader objects and are dynamically constructed.
 
-    variants:
-    Chr,pos,ref,alt, filter, qual, dp, af, etc.
+def _popcount(bitset: int):
+    """Return the number of bits set in an integer"""
+    if sys.version_info >= (3, 10):
+        return bitset.bit_count()
+    return bin(bitset).count("1")
 
-    annotations:
-    Gene, transcrit, etc.
 
-    sample_has_variant:
-    Genotype
+def _int_to_bytes(bitset: int):
+    """Return the bytes of a bitset held by an integer (little endian)"""
+    return bitset.to_bytes((bitset.bit_length() + 7) // 8, "little")
 
-    :param conn: sqlite3.connect
-    """
-    cursor = conn.cursor()
-    cursor.execute(
-        """CREATE TABLE fields
-        (id INTEGER PRIMARY KEY, name TEXT, category TEXT, type TEXT, description TEXT)
-        """
-    )
-    conn.commit()
 
+def _ids_to_bitset(variant_ids):
+    """Return the bitset of the given variant ids as a bytearray"""
+    bitset = bytearray()
+    for variant_id in variant_ids:
+        index = variant_id >> 3
+        if index >= len(bitset):
+            bitset.extend(bytes(max(index + 1 - len(bitset), len(bitset))))
+        bitset[index] |= 1 << (variant_id & 7)
+    return bitset
 
-def insert_field(
-    conn, name="no_name", category="variants", type="text", description=str()
-):
-    """Insert one field record (NOT USED)
 
-    :param conn: sqlite3.connect
-    :key name: field name
-    :key category: category field name.
-        .. warning:: The default is "variants". Don't use sample as category name
-    :key type: sqlite type which can be: INTEGER, REAL, TEXT
-        .. todo:: Check this argument...
-    :key description: Text that describes the field (showed to the user).
-    :return: Last row id
-    :rtype: <int>
+def get_selection_bitset(conn, name: str):
+    """Return the variant ids of a selection as a bitset
+
+    Selections stored as bitmaps are decoded without reading their variants;
+    the ids of "variants" and of other selections are read in ascending
+    order.
+
+    :param name: Name of the selection; "variants" for all the variants
+    :return: Bitset; bit i (bit i % 8 of byte i // 8) is set if the
+        variant i is in the selection.
+    :rtype: <bytearray>
+    :raises ValueError: If the selection doesn't exist.
     """
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        INSERT INTO fields VALUES (?, ?, ?, ?)
-        """,
-        (name, category, type, description),
+    cursor = raw_cursor(conn)
+    if name == "variants":
+        first, last, count = cursor.execute(
+            "SELECT MIN(id), MAX(id), COUNT(*) FROM variants"
+        ).fetchone()
+        if count and last - first + 1 == count:
+            # No gap in ids: set a range of bits
+            bitset = bytearray((last >> 3) + 1)
+            _set_bits(bitset, first, last)
+            return bitset
+        return _ids_to_bitset(row[0] for row in cursor.execute("SELECT id FROM variants"))
+
+    has_bitmap = "bitmap" in get_schema_catalog(conn).get_columns("selections")
+    record = cursor.execute(
+        f"SELECT id, {'bitmap' if has_bitmap else 'NULL'} FROM selections WHERE name = ?",
+        (name,),
+    ).fetchone()
+    if record is None:
+        raise ValueError(f"get_selection_bitset:: Unknown selection '{name}'")
+    if record[1] is not None:
+        return selection_bitmap_to_bitset(record[1])
+    return _ids_to_bitset(
+        row[0]
+        for row in cursor.execute(
+            "SELECT variant_id FROM selection_has_variant WHERE selection_id = ?",
+            (record[0],),
+        )
     )
-    conn.commit()
-    return cursor.lastrowid
 
 
-def insert_many_fields(conn, data: list):
+def encode_selection_bitset(bitset):
+    """Encode a bitset into a selection bitmap
+
+    Containers are built from the bytes of the bitset: dense containers are
+    copied as they are, runs are found with integer operations; only sparse
+    containers are read id by id.
+
+    :param bitset: Bitset as bytes (See get_selection_bitset()) or integer
+    :return: The bitmap (See encode_selection_bitmap())
+    :rtype: <bytes>
+    """
+    if isinstance(bitset, int):
+        bitset = _int_to_bytes(bitset)
+    if (len(bitset) + BITMAP_BITSET_SIZE - 1) // BITMAP_BITSET_SIZE > BITMAP_CONTAINER_SIZE:
+        raise ValueError("encode_selection_bitset:: ids must be 32 bits integers")
+
+    containers = []
+    for key, start in enumerate(range(0, len(bitset), BITMAP_BITSET_SIZE)):
+        chunk = bytes(bitset[start : start + BITMAP_BITSET_SIZE])
+        bits = int.from_bytes(chunk, "little")
+        count = _popcount(bits)
+        if not count:
+            continue
+
+        # First and last bits of runs
+        run_starts = bits & ~(bits << 1)
+        run_count = _popcount(run_starts)
+        if 2 * run_count < min(count, BITMAP_BITSET_SIZE // 2):
+            run_ends = bits & ~(bits >> 1)
+            runs = []
+            for first, last in zip(
+                _bitset_positions(run_starts.to_bytes(BITMAP_BITSET_SIZE, "little")),
+                _bitset_positions(run_ends.to_bytes(BITMAP_BITSET_SIZE, "little")),
+            ):
+                runs += (first, last - first)
+            kind, size, payload = BITMAP_RUNS, run_count, _uint16_to_bytes(runs)
+        elif count < BITMAP_BITSET_SIZE // 2:
+            kind, size = BITMAP_ARRAY, count
+            payload = _uint16_to_bytes(_bitset_positions(chunk))
+        else:
+            kind, size = BITMAP_BITSET, 0
+            payload = chunk.ljust(BITMAP_BITSET_SIZE, b"\0")
+
+        containers.append(SELECTION_BITMAP_HEADER.pack(key, kind, size))
+        containers.append(payload)
+
+    return b"".join(containers)
+
+
+def _bitset_positions(bitset):
+    """Return the positions of the bits set in a bitset, in ascending order"""
+    positions = []
+    for index, byte in enumerate(bitset):
+        if byte:
+            first = index * 8
+            positions += [first + bit for bit in _BYTE_BITS[byte]]
+    return positions
+
+
+def get_site_keys(conn):
+    """Return the site keys of variants indexed by variant ids
+
+    Keys are read from the column "site" and kept by the connection until
+    the database is modified; they are computed from chr and pos for
+    variants without site key (See get_site_key(), update_site_keys()).
+
+    :return: Site key of each variant id; 0 for ids without variant.
+    :rtype: <array <int>>
+    """
+    generation = get_generation(conn)
+    cached = getattr(conn, "site_keys", None)
+    if cached is not None and cached[0] == generation:
+        return cached[1]
+
+    cursor = raw_cursor(conn)
+    first_id, last_id, count = cursor.execute(
+        "SELECT MIN(id), MAX(id), COUNT(*) FROM variants"
+    ).fetchone()
+    if "site" not in get_columns(conn, "variants"):
+        site_keys = array("q", bytes(8 * ((last_id or 0) + 1)))
+        missing = ""
+    elif count and last_id - first_id + 1 == count:
+        # No gap in ids: keys are appended in the order of ids
+        site_keys = array("q", bytes(8 * first_id))
+        records = cursor.execute("SELECT IFNULL(site, 0) FROM variants ORDER BY id")
+        site_keys.extend(map(itemgetter(0), records))
+        missing = "WHERE site IS NULL"
+    else:
+        site_keys = array("q", bytes(8 * ((last_id or 0) + 1)))
+        for variant_id, site in cursor.execute(
+            "SELECT id, site FROM variants WHERE site IS NOT NULL"
+        ):
+            site_keys[variant_id] = site
+        missing = "WHERE site IS NULL"
+
+    for variant_id, chrom, pos in cursor.execute(
+        f"SELECT id, chr, pos FROM variants {missing}"
+    ):
+        site_keys[variant_id] = get_site_key(chrom, pos)
+
+    if isinstance(conn, Connection):
+        conn.site_keys = (generation, site_keys)
+    return site_keys
+
+
+def get_site_runs(conn):
+    """Return the variants located at the same site as the previous variant
+
+    Variants of a site usually have consecutive ids since files are sorted
+    by position; only sites with several variants are read, with the index
+    idx_variants_site. The result is kept by the connection until the
+    database is modified.
+
+    :return: Bitset where bit i is set if variants i - 1 and i have the same
+        site; None if the variants of a site don't have consecutive ids or if
+        some variants have no site key (See update_site_keys()).
+    :rtype: <int>
+    """
+    generation = get_generation(conn)
+    cached = getattr(conn, "site_runs", None)
+    if cached is not None and cached[0] == generation:
+        return cached[1]
+
+    cursor = raw_cursor(conn)
+    runs = None
+    if "site" in get_columns(conn, "variants") and not cursor.execute(
+        "SELECT 1 FROM variants WHERE site IS NULL LIMIT 1"
+    ).fetchone():
+        run_ids = []
+        records = cursor.execute(
+            """SELECT site, id FROM variants WHERE site IN
+            (SELECT site FROM variants GROUP BY site HAVING COUNT(*) > 1)
+            ORDER BY site, id"""
+        )
+        for _, group in groupby(records, itemgetter(0)):
+            variant_ids = [record[1] for record in group]
+            if variant_ids[-1] - variant_ids[0] + 1 != len(variant_ids):
+                break
+            run_ids += variant_ids[1:]
+        else:
+            runs = int.from_bytes(_ids_to_bitset(run_ids), "little")
+
+    if isinstance(conn, Connection):
+        conn.site_runs = (generation, runs)
+    return runs
+
+
+def _expand_to_sites(bitset: int, runs: int):
+    """Add to a bitset the variants located at the sites of its variants
+
+    :param runs: Bitset returned by get_site_runs()
+    """
+    while True:
+        expanded = bitset | (bitset << 1) & runs | (bitset & runs) >> 1
+        if expanded == bitset:
+            return bitset
+        bitset = expanded
+
+
+def apply_site_operator(conn, set_operator: str, bitsets):
+    """Apply a set operator to sets of variants compared by site (chr, pos)
+
+    The sites of the operands are combined; the result is made of the
+    variants of the operands located at the resulting sites.
+
+    When variants of a site have consecutive ids (See get_site_runs()),
+    operands are expanded to all the variants of their sites and combined
+    as bitsets; otherwise their sites are combined as sets of site keys
+    (See get_site_keys()).
+
+    :Example:
+
+        A & B: variants of A and B at the sites shared by A and B
+        A - B: variants of A at sites without variants of B
+
+    :param set_operator: Operator of SET_OPERATORS
+    :param bitsets: Bitsets of variants held by integers
+    :return: The bitset of the result
+    :rtype: <int>
+    """
+    runs = get_site_runs(conn)
+    if runs is not None:
+        expanded = (_expand_to_sites(bitset, runs) for bitset in bitsets)
+        return reduce(SET_OPERATORS[set_operator], expanded) & reduce(or_, bitsets)
+
+    site_keys = get_site_keys(conn)
+    function = SITE_OPERATORS[set_operator]
+    sites = None
+    for bitset in bitsets:
+        variant_ids = _bitset_positions(_int_to_bytes(bitset))
+        operand_sites = set(map(site_keys.__getitem__, variant_ids))
+        sites = operand_sites if sites is None else function(sites, operand_sites)
+
+    variants = reduce(or_, bitsets)
+    variant_ids = _bitset_positions(_int_to_bytes(variants))
+    kept_ids = [i for i in variant_ids if site_keys[i] in sites]
+    if 2 * len(kept_ids) <= len(variant_ids):
+        return int.from_bytes(_ids_to_bitset(kept_ids), "little")
+    # Build the smallest bitset: the one of removed variants
+    removed_ids = [i for i in variant_ids if site_keys[i] not in sites]
+    return variants & ~int.from_bytes(_ids_to_bitset(removed_ids), "little")
+
+
+def evaluate_set_expression(conn, expression, mode="variant"):
+    """Evaluate a set expression on selections in memory
+
+    Selections are loaded once as bitsets held by integers
+    (See get_selection_bitset()); operators of SET_OPERATORS are applied
+    from left to right.
+
+    :param expression: Name of a selection or {operator: [operands]};
+        operands are names or expressions (See vql.SetExpression).
+    :key mode: Define the way variants are compared to each other:
+        - "variant" (default): chr,pos,ref,alt = variant.id
+        - "site": chr,pos (See apply_site_operator())
+    :return: The bitset of the result
+    :rtype: <int>
+    """
+    if mode not in SET_OPERATION_MODES:
+        raise ValueError(f"evaluate_set_expression:: Unknown mode '{mode}'")
+    bitsets = dict()
+
+    def evaluate(node):
+        if isinstance(node, str):
+            if node not in bitsets:
+                bitsets[node] = int.from_bytes(get_selection_bitset(conn, node), "little")
+            return bitsets[node]
+        (set_operator, operands), = node.items()
+        if mode == "site":
+            return apply_site_operator(
+                conn, set_operator, [evaluate(operand) for operand in operands]
+            )
+        function = SET_OPERATORS[set_operator]
+        result = evaluate(operands[0])
+        for operand in operands[1:]:
+            result = function(result, evaluate(operand))
+        return result
+
+    return evaluate(expression)
+
+
+def set_expression_to_vql(expression):
+    """Return the VQL text of a set expression"""
+    if isinstance(expression, str):
+        return expression
+    (set_operator, operands), = expression.items()
+    return "(" + f" {set_operator} ".join(set_expression_to_vql(i) for i in operands) + ")"
+
+
+def create_selection_from_bitset(conn, name: str, bitset, query=""):
+    """Create a selection stored as a bitmap from a bitset
+
+    :param bitset: Bitset as bytes or integer (See get_selection_bitset())
+    :key query: Query or expression saved with the selection
+    :return: The id of the new selection.
+    :rtype: <int>
+    """
+    if isinstance(bitset, int):
+        count = _popcount(bitset)
+    else:
+        count = _popcount(int.from_bytes(bitset, "little"))
+    cursor = conn.cursor()
+    selection_id = insert_selection(
+        cursor, query, name=name, count=count, bitmap=encode_selection_bitset(bitset)
+    )
+    conn.commit()
+    return selection_id
+
+
+def create_selection_from_expression(conn, name: str, expression, mode="variant"):
+    """Create a selection from a set expression on selections
+
+    The expression is evaluated in memory (See evaluate_set_expression());
+    the result is stored as a bitmap with its count.
+
+    :param name: Name of the new selection
+    :param expression: Set expression (See vql.SetExpression)
+    :key mode: "variant" or "site" (See evaluate_set_expression())
+    :return: The id of the new selection.
+    :rtype: <int>
+    """
+    bitset = evaluate_set_expression(conn, expression, mode)
+    return create_selection_from_bitset(
+        conn, name, bitset, query=set_expression_to_vql(expression)
+    )
+
+
+## ================ Fields functions ===========================================
+
+
+def create_table_fields(conn):
+    """Create the table "fields"
+
+    This table contain fields. A field is a column with its description and type;
+    it can be choose by a user to build a Query
+    Fields are the columns of the tables: variants, annotations and sample_has_variant.
+    Fields are extracted from reader objects and are dynamically constructed.
+
+    variants:
+    Chr,pos,ref,alt, filter, qual, dp, af, etc.
+
+    annotations:
+    Gene, transcrit, etc.
+
+    sample_has_variant:
+    Genotype
+
+    :param conn: sqlite3.connect
+    """
+    cursor = conn.cursor()
+    cursor.execute(
+        """CREATE TABLE fields
+        (id INTEGER PRIMARY KEY, name TEXT, category TEXT, type TEXT, description TEXT)
+        """
+    )
+    conn.commit()
+
+
+def insert_field(
+    conn, name="no_name", category="variants", type="text", description=str()
+):
+    """Insert one field record (NOT USED)
+
+    :param conn: sqlite3.connect
+    :key name: field name
+    :key category: category field name.
+        .. warning:: The default is "variants". Don't use sample as category name
+    :key type: sqlite type which can be: INTEGER, REAL, TEXT
+        .. todo:: Check this argument...
+    :key description: Text that describes the field (showed to the user).
+    :return: Last row id
+    :rtype: <int>
+    """
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        INSERT INTO fields VALUES (?, ?, ?, ?)
+        """,
+        (name, category, type, description),
+    )
+    conn.commit()
+    invalidate_schema_catalog(conn)
+    return cursor.lastrowid
+
+
+def insert_many_fields(conn, data: list):
     """Insert multiple fields into "fields" table using one commit
 
     :param conn: sqlite3.connect
@@ -480,6 +1751,36 @@ def insert_many_fields(conn, data: list):
         data,
     )
     conn.commit()
+    invalidate_schema_catalog(conn)
+
+
+def insert_missing_fields(conn, fields):
+    """Insert the given fields which are not in the database yet
+
+    Used to append a file to an existing database: the columns of new fields
+    are added to the table of their category, without constraint (existing
+    rows have no value).
+
+    :param fields: list of field dictionnary
+    :return: The inserted fields
+    :rtype: <list <dict>>
+    """
+    known_fields = {(field["name"], field["category"]) for field in get_fields(conn)}
+    new_fields = []
+    for field in fields:
+        key = (field["name"], field["category"])
+        if key in known_fields:
+            continue
+        known_fields.add(key)
+        new_fields.append(field)
+        if field["category"] in FIELD_STATS_TABLES:
+            table = FIELD_STATS_TABLES[field["category"]][0]
+            if field["name"] not in get_columns(conn, table):
+                conn.execute(
+                    f"ALTER TABLE {table} ADD COLUMN `{field['name']}` {field['type']}"
+                )
+    insert_many_fields(conn, new_fields)
+    return new_fields
 
 
 def get_fields(conn):
@@ -528,12 +1829,21 @@ def get_field_by_name(conn, field_name: str):
 
 def get_field_range(conn, field_name: str):
     """ Return (min,max) of field_name records . 
+
+    The range is read from the statistics of the field if they have been
+    computed (See compute_field_stats()).
     
     :param conn: sqlite3.connect
     :param field_name (str): field name
     :return: (min, max) 
     :rtype: tuple
     """
+    stats = get_field_stats(conn, field_name)
+    if stats is not None:
+        if stats["min"] is None:
+            return None
+        return stats["min"], stats["max"]
+
     field = get_field_by_name(conn, field_name)
     table = field["category"]  # variants, or annotations or samples
     query = f"""SELECT min({field_name}), max({field_name}) FROM {table}"""
@@ -550,11 +1860,18 @@ def get_field_range(conn, field_name: str):
 def get_field_unique_values(conn, field_name: str):
     """ Return unique record value for a field name 
 
+    Values are read from the statistics of the field if they have been
+    computed and hold all the values of the field (See compute_field_stats()).
+
     :param conn: sqlite3.connect 
     :param field_name (str): field_name
     :return: list of unique values
     :rtype: list
     """
+    stats = get_field_stats(conn, field_name)
+    if stats is not None and stats["complete"]:
+        return stats["missing_values"] + [value for value, _ in stats["top_values"]]
+
     field = get_field_by_name(conn, field_name)
     table = field["category"]  # variants, or annotations or samples
     # conn.row_factory = None
@@ -562,6 +1879,372 @@ def get_field_unique_values(conn, field_name: str):
     return [i[field_name] for i in conn.execute(query)]
 
 
+# Statistics of fields (See compute_field_stats()): number of values kept
+# with their frequency, and number of buckets of histograms
+FIELD_STATS_MAX_VALUES = 1000
+FIELD_STATS_HISTOGRAM_BUCKETS = 20
+
+# Table and column holding the variant id of the fields of each category
+FIELD_STATS_TABLES = {
+    "variants": ("variants", "id"),
+    "annotations": ("annotations", "variant_id"),
+    "samples": ("sample_has_variant", "variant_id"),
+}
+
+
+def create_table_field_stats(conn):
+    """Create the "field_stats" table
+
+    One row per field:
+        - row_count, null_count: number of rows and of missing values
+          (NULL or empty strings)
+        - missing_values: JSON list of the forms of missing values found
+          (null and/or "")
+        - distinct_count: number of distinct values
+        - min, max: range of values (missing values are ignored)
+        - top_values: JSON list of [value, count] ordered by decreasing
+          count; all the values if complete is 1, the
+          FIELD_STATS_MAX_VALUES most frequent values otherwise
+        - histogram: JSON list of the upper bounds of an equi-depth
+          histogram of numeric fields, or NULL
+        - last_variant_id, last_sample_id: ids of the last variant and of
+          the last sample taken into account; statistics are not used when
+          variants or samples have been added since (See get_field_stats()
+          and update_field_stats())
+    """
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS field_stats (
+        name TEXT NOT NULL,
+        category TEXT NOT NULL,
+        row_count INTEGER,
+        null_count INTEGER,
+        missing_values TEXT,
+        distinct_count INTEGER,
+        min,
+        max,
+        top_values TEXT,
+        complete INTEGER,
+        histogram TEXT,
+        last_variant_id INTEGER,
+        last_sample_id INTEGER,
+        PRIMARY KEY (name, category))"""
+    )
+
+
+def _iter_stats_fields(conn, fields=None):
+    """Yield the records of fields having statistics, with the table and
+    the column of variant ids of their category
+
+    Fields are yielded for each category, including names used by several
+    categories (ex: "dp" of INFO and FORMAT).
+    """
+    catalog = get_schema_catalog(conn)
+    for field in catalog.fields:
+        if fields is not None and field["name"] not in fields:
+            continue
+        if field["category"] not in FIELD_STATS_TABLES:
+            continue
+        table, id_column = FIELD_STATS_TABLES[field["category"]]
+        if field["name"] in catalog.get_columns(table):
+            yield field, table, id_column
+
+
+def _read_field_stats(conn, field, table, id_column, last_ids=None):
+    """Compute the statistics of a field for the rows added after last_ids
+
+    Values are read with one GROUP BY query, in ascending order.
+
+    :key last_ids: Tuple of the ids of the last variant and of the last
+        sample already taken into account (rows of samples are new if
+        their variant or their sample is new); all the rows by default.
+    :return: Dictionnary of the columns of "field_stats"
+    """
+    value = f"`{field['name']}`"
+    # Full scans are faster than the use of indexes on variant ids
+    new_rows = "1"
+    if last_ids is not None:
+        new_rows = f"`{id_column}` > {int(last_ids[0])}"
+        if table == "sample_has_variant":
+            new_rows += f" OR sample_id > {int(last_ids[1])}"
+    cursor = raw_cursor(conn)
+    cursor.execute(
+        f"""SELECT {value}, COUNT(*) FROM `{table}` WHERE {new_rows}
+        GROUP BY {value} ORDER BY {value}"""
+    )
+
+    numeric = field["type"] in ("int", "integer", "float", "real")
+    row_count = null_count = distinct_count = numeric_count = 0
+    missing_values = []
+    min_value = max_value = None
+    # Most frequent values: min-heap of (count, -position, value)
+    top_values = []
+    # Cumulative counts of numeric values: (count, value), thinned out
+    # to keep at most 2 * FIELD_STATS_MAX_VALUES points
+    points = []
+    step = 1
+    for position, (group_value, count) in enumerate(cursor):
+        row_count += count
+        # Missing values are NULL or empty strings (See variant_to_rows())
+        if group_value is None or group_value == "":
+            null_count += count
+            missing_values.append(group_value)
+            continue
+
+        distinct_count += 1
+        if min_value is None:
+            min_value = group_value
+        max_value = group_value
+
+        item = (count, -position, group_value)
+        if len(top_values) < FIELD_STATS_MAX_VALUES:
+            heapq.heappush(top_values, item)
+        elif item > top_values[0]:
+            heapq.heapreplace(top_values, item)
+
+        if numeric and isinstance(group_value, (int, float)):
+            numeric_count += count
+            if not points or numeric_count >= points[-1][0] + step:
+                points.append((numeric_count, group_value))
+                if len(points) > 2 * FIELD_STATS_MAX_VALUES:
+                    points = points[1::2]
+                    step *= 2
+
+    histogram = None
+    if numeric_count:
+        # Upper bounds of equi-depth buckets; equal bounds are merged
+        if points[-1] != (numeric_count, max_value):
+            points.append((numeric_count, max_value))
+        counts = [point[0] for point in points]
+        histogram = []
+        for bucket in range(1, FIELD_STATS_HISTOGRAM_BUCKETS + 1):
+            target = numeric_count * bucket / FIELD_STATS_HISTOGRAM_BUCKETS
+            bound = points[bisect.bisect_left(counts, target)][1]
+            if not histogram or histogram[-1] != bound:
+                histogram.append(bound)
+
+    return {
+        "name": field["name"],
+        "category": field["category"],
+        "row_count": row_count,
+        "null_count": null_count,
+        "missing_values": missing_values,
+        "distinct_count": distinct_count,
+        "min": min_value,
+        "max": max_value,
+        "top_values": [
+            [group_value, count] for count, _, group_value in sorted(top_values, reverse=True)
+        ],
+        "complete": distinct_count <= FIELD_STATS_MAX_VALUES,
+        "histogram": histogram,
+    }
+
+
+def _sqlite_order(value):
+    """Sort key of values ordered like SQLite: numbers before strings"""
+    return (isinstance(value, str), value)
+
+
+def _merge_field_stats(stats, new_stats):
+    """Merge the statistics of new variants into the statistics of a field
+
+    Counts of values are exact if the values of both statistics are
+    complete; otherwise distinct_count is an upper bound and top_values
+    are approximated. Histograms are kept.
+    """
+    if not new_stats["row_count"]:
+        return stats
+
+    counts = dict(map(tuple, stats["top_values"]))
+    new_counts = dict(map(tuple, new_stats["top_values"]))
+    new_distinct_count = len(set(new_counts) - set(counts))
+    for value, count in new_counts.items():
+        counts[value] = counts.get(value, 0) + count
+
+    complete = stats["complete"] and new_stats["complete"]
+    if complete:
+        distinct_count = stats["distinct_count"] + new_distinct_count
+    else:
+        distinct_count = stats["distinct_count"] + new_stats["distinct_count"]
+
+    top_values = sorted(counts.items(), key=lambda item: (-item[1], _sqlite_order(item[0])))
+    bounds = [
+        value for value in (stats["min"], stats["max"], new_stats["min"], new_stats["max"])
+        if value is not None
+    ]
+    missing_values = stats["missing_values"] + new_stats["missing_values"]
+    return dict(
+        stats,
+        row_count=stats["row_count"] + new_stats["row_count"],
+        null_count=stats["null_count"] + new_stats["null_count"],
+        missing_values=[value for value in (None, "") if value in missing_values],
+        distinct_count=distinct_count,
+        min=min(bounds, key=_sqlite_order) if bounds else None,
+        max=max(bounds, key=_sqlite_order) if bounds else None,
+        top_values=[list(item) for item in top_values[:FIELD_STATS_MAX_VALUES]],
+        complete=complete and distinct_count <= FIELD_STATS_MAX_VALUES,
+    )
+
+
+def _write_field_stats(conn, stats, last_ids):
+    conn.execute(
+        """INSERT OR REPLACE INTO field_stats
+        (name, category, row_count, null_count, missing_values, distinct_count,
+        min, max, top_values, complete, histogram, last_variant_id, last_sample_id)
+        VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)""",
+        (
+            stats["name"],
+            stats["category"],
+            stats["row_count"],
+            stats["null_count"],
+            json.dumps(stats["missing_values"]),
+            stats["distinct_count"],
+            stats["min"],
+            stats["max"],
+            json.dumps(stats["top_values"]),
+            stats["complete"],
+            None if stats["histogram"] is None else json.dumps(stats["histogram"]),
+        )
+        + tuple(last_ids),
+    )
+
+
+def _get_last_ids(conn):
+    """Return the ids of the last variant and of the last sample
+
+    The query is cached until the database is modified (See cached_query()).
+
+    :rtype: <tuple <int>, <int>>
+    """
+    row = cached_query(
+        conn, "SELECT (SELECT MAX(id) FROM variants), (SELECT MAX(id) FROM samples)"
+    )[0]
+    return tuple(value or 0 for value in row)
+
+
+def compute_field_stats(conn, fields=None):
+    """Compute the statistics of fields into the "field_stats" table
+
+    Called at the end of imports; See create_table_field_stats().
+
+    :key fields: Names of the fields to compute; all fields by default.
+    """
+    create_table_field_stats(conn)
+    last_ids = _get_last_ids(conn)
+    for field, table, id_column in _iter_stats_fields(conn, fields):
+        stats = _read_field_stats(conn, field, table, id_column)
+        _write_field_stats(conn, stats, last_ids)
+    bump_generation(conn)
+    conn.commit()
+
+
+def update_field_stats(conn, updated_fields=()):
+    """Update the statistics of fields with the variants and the samples
+    inserted since their computation
+
+    Only the new rows are read (See _merge_field_stats()): rows of new
+    variants, and for fields of samples, rows of new samples attached to
+    existing variants by an append. Fields without statistics are fully
+    computed.
+
+    :key updated_fields: Names of fields of variants whose values have been
+        modified for existing variants (values filled by an append); they
+        are fully computed.
+    """
+    create_table_field_stats(conn)
+    last_ids = _get_last_ids(conn)
+    for field, table, id_column in _iter_stats_fields(conn):
+        stats = _load_field_stats(conn, field["name"], field["category"])
+        if stats is None or (
+            field["category"] == "variants" and field["name"] in updated_fields
+        ):
+            stats = _read_field_stats(conn, field, table, id_column)
+        elif _are_field_stats_up_to_date(stats, last_ids):
+            continue
+        else:
+            new_stats = _read_field_stats(
+                conn,
+                field,
+                table,
+                id_column,
+                (stats["last_variant_id"], stats["last_sample_id"]),
+            )
+            stats = _merge_field_stats(stats, new_stats)
+        _write_field_stats(conn, stats, last_ids)
+    bump_generation(conn)
+    conn.commit()
+
+
+def invalidate_field_stats(conn, fields, category="variants"):
+    """Drop the statistics of fields whose values have been modified for
+    existing rows; they are computed again by update_field_stats()
+
+    :param fields: Names of the fields
+    :key category: Category of the fields
+    """
+    if get_schema_catalog(conn).has_table("field_stats"):
+        conn.executemany(
+            "DELETE FROM field_stats WHERE name = ? AND category = ?",
+            ((name, category) for name in fields),
+        )
+
+
+def _are_field_stats_up_to_date(stats, last_ids):
+    """Return True if no variant, and no sample for fields of samples, has
+    been added since the computation of the statistics"""
+    if stats["last_variant_id"] != last_ids[0]:
+        return False
+    return stats["category"] != "samples" or stats["last_sample_id"] == last_ids[1]
+
+
+def get_field_stats(conn, field_name: str, category=None):
+    """Return the statistics of a field computed by compute_field_stats()
+
+    Statistics are not returned if variants or samples have been inserted
+    since their computation (See update_field_stats()); the ids of the
+    last variant and sample are read again when the database is modified.
+
+    :key category: Category of the field; the category of the first field
+        with this name by default.
+    :return: Dictionnary of the columns of "field_stats" (JSON columns are
+        decoded) or None if there are no up-to-date statistics.
+    :rtype: <dict>
+    """
+    stats = _load_field_stats(conn, field_name, category)
+    if stats is None or not _are_field_stats_up_to_date(stats, _get_last_ids(conn)):
+        return None
+    return stats
+
+
+def _load_field_stats(conn, field_name: str, category=None):
+    """Read the statistics of a field, up-to-date or not
+
+    .. seealso:: get_field_stats()
+    """
+    catalog = get_schema_catalog(conn)
+    if not catalog.has_table("field_stats"):
+        return None
+    if category is None:
+        field = catalog.get_field(field_name)
+        if field is None:
+            return None
+        category = field["category"]
+
+    cursor = conn.cursor()
+    cursor.row_factory = sqlite3.Row
+    record = cursor.execute(
+        "SELECT * FROM field_stats WHERE name = ? AND category = ?", (field_name, category)
+    ).fetchone()
+    if record is None:
+        return None
+    stats = dict(record)
+    stats["missing_values"] = json.loads(stats["missing_values"])
+    stats["top_values"] = json.loads(stats["top_values"])
+    stats["complete"] = bool(stats["complete"])
+    if stats["histogram"] is not None:
+        stats["histogram"] = json.loads(stats["histogram"])
+    return stats
+
+
 ## ================ Annotations functions ======================================
 
 
@@ -606,59 +2289,351 @@ def create_annotations_indexes(conn):
     """
 
     # Allow search on variant_id
-    conn.execute("""CREATE INDEX idx_annotations ON annotations (variant_id)""")
+    conn.execute("""CREATE INDEX IF NOT EXISTS idx_annotations ON annotations (variant_id)""")
 
 
-## ================ Variants functions =========================================
+# Rank of impacts used to choose the annotation displayed for a variant
+# (the worst consequence); other impacts come after.
+ANNOTATION_IMPACT_RANKS = ("HIGH", "MODERATE", "LOW", "MODIFIER")
 
 
-def create_table_variants(conn, fields):
-    """Create "variants" and "sample_has_variant" tables which contains dynamics fields
+def create_annotations_summary(conn):
+    """Create or refresh the "annotations_summary" table
 
-    :Example:
+    This table gives for each annotated variant:
+        - annotation_count: its number of annotations;
+        - annotation_id: rowid of the annotation displayed for the variant
+          in grouped views: the one with the worst impact (See
+          ANNOTATION_IMPACT_RANKS), the first one in case of ties or if
+          there is no impact field.
 
-        fields = get_fields()
-        create_table_variants(conn, fields)
+    Grouped views read this table instead of grouping annotations
+    (See QueryBuilder.build_sql()).
 
-    .. seealso:: get_fields
+    .. note:: This function must be called after insertions of annotations;
+        it is called at the end of imports.
+    .. note:: No commit is made here.
+    """
+    conn.execute("DROP TABLE IF EXISTS annotations_summary")
+    conn.execute(
+        """CREATE TABLE annotations_summary (
+        variant_id INTEGER PRIMARY KEY,
+        annotation_count INTEGER,
+        annotation_id INTEGER)"""
+    )
+    _insert_annotations_summary(conn)
 
-    .. note:: "gt" field in "sample_has_variant" = Patient's genotype.
-        - Patient without variant: gt = 0: Wild homozygote
-        - Patient with variant in the heterozygote state: gt = -1: Heterozygote
-        - Patient with variant in the homozygote state: gt = 2: Homozygote
 
-        :Example of VQL query:
-            SELECT chr, pos, genotype("pierre") FROM variants
+def update_annotations_summary(conn):
+    """Add the annotations of new variants to the "annotations_summary" table
 
-    :param conn: sqlite3.connect
-    :param fields: list of field dictionnary.
+    Annotations are inserted with their variants: variants after the last
+    one of the table are new.
+
+    .. note:: No commit is made here.
     """
-    cursor = conn.cursor()
+    if not has_annotations_summary(conn):
+        create_annotations_summary(conn)
+        return
+    last_variant_id = conn.execute(
+        "SELECT MAX(variant_id) FROM annotations_summary"
+    ).fetchone()[0]
+    _insert_annotations_summary(conn, last_variant_id or 0)
+
+
+def _insert_annotations_summary(conn, last_variant_id=0):
+    """Summarize the annotations of the variants after last_variant_id"""
+    if "impact" in get_columns(conn, "annotations"):
+        rank = (
+            "CASE upper(impact) "
+            + " ".join(
+                f"WHEN '{impact}' THEN {i}"
+                for i, impact in enumerate(ANNOTATION_IMPACT_RANKS)
+            )
+            + f" ELSE {len(ANNOTATION_IMPACT_RANKS)} END"
+        )
+    else:
+        rank = "0"
 
-    # Primary key MUST NOT have NULL fields !
-    # PRIMARY KEY should always imply NOT NULL.
-    # Unfortunately, due to a bug in some early versions, this is not the case in SQLite.
-    # For the purposes of UNIQUE constraints, NULL values are considered distinct
-    # from all other values, including other NULLs.
-    schema = ",".join(
-        [
-            f'`{field["name"]}` {field["type"]} {field.get("constraint", "")}'
-            for field in fields
-            if field["name"]
-        ]
+    # The rank and the rowid are packed in one integer: MIN() gives the
+    # annotation with the best rank and the lowest rowid.
+    conn.execute(
+        f"""INSERT INTO annotations_summary (variant_id, annotation_count, annotation_id)
+        SELECT variant_id, COUNT(*), MIN(({rank}) << 48 | rowid) & {(1 << 48) - 1}
+        FROM annotations WHERE variant_id > ? GROUP BY variant_id""",
+        (last_variant_id,),
     )
+    bump_generation(conn)
 
-    LOGGER.debug("create_table_variants:: schema: %s", schema)
-    # Unicity constraint or NOT NULL fields (Cf VcfReader, FakeReader, etc.)
-    # NOTE: specify the constraint in CREATE TABLE generates a lighter DB than
-    # a separated index... Don't know why.
-    cursor.execute(
-        f"""CREATE TABLE variants (id INTEGER PRIMARY KEY, {schema},
-        UNIQUE (chr,pos,ref,alt))"""
-    )
-    # cursor.execute(f"""CREATE UNIQUE INDEX idx_variants_unicity ON variants (chr,pos,ref,alt)""")
 
+def has_annotations_summary(conn):
+    """Return True if the "annotations_summary" table exists"""
+    return bool(
+        conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'annotations_summary'"
+        ).fetchone()
+    )
+
+
+## ================ Variants functions =========================================
+
+
+def reg2bin(start: int, end: int):
+    """Return the smallest genomic bin containing the given region
+
+    Hierarchical binning scheme of UCSC/SAM (6 levels of bins of 512Mb, 64Mb,
+    8Mb, 1Mb, 128kb and 16kb).
+
+    .. seealso:: reg2bins()
+
+    :param start: 0-based start of the region
+    :param end: 0-based end of the region (excluded)
+    :rtype: <int>
+    """
+    end -= 1
+    if start >> 14 == end >> 14:
+        return 4681 + (start >> 14)
+    if start >> 17 == end >> 17:
+        return 585 + (start >> 17)
+    if start >> 20 == end >> 20:
+        return 73 + (start >> 20)
+    if start >> 23 == end >> 23:
+        return 9 + (start >> 23)
+    if start >> 26 == end >> 26:
+        return 1 + (start >> 26)
+    return 0
+
+
+def reg2bins(start: int, end: int):
+    """Return the list of bins that may contain regions overlapping the given one
+
+    .. seealso:: reg2bin()
+
+    :param start: 0-based start of the region
+    :param end: 0-based end of the region (excluded)
+    :rtype: <list <int>>
+    """
+    end -= 1
+    bins = [0]
+    for offset, shift in ((1, 26), (9, 23), (73, 20), (585, 17), (4681, 14)):
+        bins.extend(range(offset + (start >> shift), offset + (end >> shift) + 1))
+    return bins
+
+
+def get_variant_bin(pos: int, ref: str):
+    """Return the bin of a variant; i.e. the bin of its reference allele
+
+    :param pos: 1-based position of the variant
+    :param ref: Reference allele
+    """
+    start = int(pos) - 1
+    return reg2bin(start, start + max(len(ref), 1))
+
+
+# Site keys: integers identifying (chr, pos) regardless of alleles, stored in
+# the column "site" of "variants" (See get_site_key())
+SITE_POSITION_BITS = 32
+
+# Indexes of chromosomes which are not numbers ("chr" prefix excluded)
+CHROMOSOME_INDEXES = {"X": 1001, "Y": 1002, "M": 1003, "MT": 1003}
+
+
+def get_chromosome_index(chrom: str):
+    """Return the index of a chromosome used in site keys
+
+    "chr1" and "1" have the same index. Numbered chromosomes keep their
+    number; contigs without known index get a stable index computed from
+    their name (CRC-32), above the known ones.
+
+    :rtype: <int>
+    """
+    name = str(chrom).upper()
+    if name.startswith("CHR"):
+        name = name[3:]
+    if name.isdigit() and int(name) <= 1000:
+        return int(name)
+    index = CHROMOSOME_INDEXES.get(name)
+    if index is None:
+        index = 1024 + zlib.crc32(name.encode()) % ((1 << 31) - 1024)
+    return index
+
+
+def get_site_key(chrom: str, pos: int):
+    """Return the site key of a position: chromosome index packed with position
+
+    Variants with the same site key are located at the same site; keys are
+    ordered like (chromosome index, position).
+
+    :param chrom: Chromosome
+    :param pos: Position of the variant
+    :rtype: <int>
+    """
+    return get_chromosome_index(chrom) << SITE_POSITION_BITS | int(pos)
+
+
+def update_site_keys(conn):
+    """Fill the column "site" of variants without site key
+
+    The column and its index are added to databases created without them.
+
+    .. seealso:: get_site_key()
+
+    :return: Number of updated variants
+    :rtype: <int>
+    """
+    if "site" not in get_columns(conn, "variants"):
+        conn.execute("ALTER TABLE variants ADD COLUMN site INTEGER")
+        invalidate_schema_catalog(conn)
+    conn.create_function("site_key", 2, get_site_key)
+    updated = conn.execute(
+        "UPDATE variants SET site = site_key(chr, pos) WHERE site IS NULL"
+    ).rowcount
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_variants_site ON variants (site)")
     conn.commit()
+    bump_generation(conn)
+    return updated
+
+
+def get_region_filter(conn, chrom: str, start: int, end: int):
+    """Return the filters of the variants located in the given region
+
+    Bins of the region are added to the filters to use the index
+    idx_variants_bin (if the column "bin" exists in the database).
+
+    :Example:
+
+        query_builder.filters = get_region_filter(conn, "chr3", 100, 100000)
+
+    :param chrom: Chromosome
+    :param start: 1-based start of the region (included)
+    :param end: 1-based end of the region (included)
+    :return: Filters usable by QueryBuilder and Query
+    :rtype: <dict>
+    """
+    filters = [{"field": "chr", "operator": "=", "value": chrom}]
+    if "bin" in get_columns(conn, "variants"):
+        bins = tuple(reg2bins(max(start - 1, 0), end))
+        filters.append({"field": "bin", "operator": "IN", "value": bins})
+
+    filters.append({"field": "pos", "operator": ">=", "value": start})
+    filters.append({"field": "pos", "operator": "<=", "value": end})
+    return {"AND": filters}
+
+
+def create_table_variants(conn, fields, deferred_unique_index=False):
+    """Create "variants" and "sample_has_variant" tables which contains dynamics fields
+
+    :Example:
+
+        fields = get_fields()
+        create_table_variants(conn, fields)
+
+    .. seealso:: get_fields
+
+    .. note:: "gt" field in "sample_has_variant" = Patient's genotype.
+        - Patient without variant: gt = 0: Wild homozygote
+        - Patient with variant in the heterozygote state: gt = -1: Heterozygote
+        - Patient with variant in the homozygote state: gt = 2: Homozygote
+
+        :Example of VQL query:
+            SELECT chr, pos, genotype("pierre") FROM variants
+
+    :param conn: sqlite3.connect
+    :param fields: list of field dictionnary.
+    :key deferred_unique_index: If True, the unicity of (chr,pos,ref,alt)
+        is not checked during insertions; create_variants_unique_index()
+        must be called after them.
+
+    .. note:: The columns "bin" and "site" are added to the fields; they
+        contain the genomic bin of the variant (See get_variant_bin()) and its
+        site key (See get_site_key()) and are filled during insertions.
+    """
+    cursor = conn.cursor()
+
+    # Primary key MUST NOT have NULL fields !
+    # PRIMARY KEY should always imply NOT NULL.
+    # Unfortunately, due to a bug in some early versions, this is not the case in SQLite.
+    # For the purposes of UNIQUE constraints, NULL values are considered distinct
+    # from all other values, including other NULLs.
+    schema = ",".join(
+        [
+            f'`{field["name"]}` {field["type"]} {field.get("constraint", "")}'
+            for field in fields
+            if field["name"]
+        ]
+    )
+
+    LOGGER.debug("create_table_variants:: schema: %s", schema)
+    # Unicity constraint or NOT NULL fields (Cf VcfReader, FakeReader, etc.)
+    # NOTE: specify the constraint in CREATE TABLE generates a lighter DB than
+    # a separated index... Don't know why.
+    if deferred_unique_index:
+        cursor.execute(
+            f"""CREATE TABLE variants (id INTEGER PRIMARY KEY, {schema}, bin INTEGER,
+            site INTEGER)"""
+        )
+    else:
+        cursor.execute(
+            f"""CREATE TABLE variants (id INTEGER PRIMARY KEY, {schema}, bin INTEGER,
+            site INTEGER, UNIQUE (chr,pos,ref,alt))"""
+        )
+
+    conn.commit()
+
+
+def has_variants_unique_index(conn):
+    """Return True if the unicity of (chr,pos,ref,alt) is checked on insertion
+
+    .. seealso:: create_table_variants(), create_variants_unique_index()
+    """
+    # ((seq, name, unique, origin, partial), ...
+    return any(index[2] for index in conn.execute("PRAGMA index_list(variants)"))
+
+
+def create_variants_unique_index(conn):
+    """Remove duplicated variants and create the index enforcing the unicity
+    of (chr,pos,ref,alt)
+
+    Used after insertions in a table created with deferred_unique_index=True.
+    Like with the UNIQUE constraint, the first inserted variant is kept;
+    annotations and samples data of the others are removed.
+
+    .. note:: No commit is made here.
+
+    :param conn: sqlite3.connect
+    :return: Number of removed variants
+    :rtype: <int>
+    """
+    cursor = conn.cursor()
+    cursor.execute(
+        """CREATE TEMP TABLE duplicated_variants AS
+        SELECT id FROM variants WHERE id NOT IN
+        (SELECT MIN(id) FROM variants GROUP BY chr,pos,ref,alt)"""
+    )
+    duplicates = cursor.execute("SELECT COUNT(*) FROM duplicated_variants").fetchone()[0]
+
+    if duplicates:
+        LOGGER.error(
+            "create_variants_unique_index:: %s variant(s) are duplications of "
+            "the primary key: (chr,pos,ref,alt). "
+            "Please check your data; these variants and their attached "
+            "data are removed!",
+            duplicates,
+        )
+        for table in ("annotations", "sample_has_variant"):
+            cursor.execute(
+                f"""DELETE FROM {table}
+                WHERE variant_id IN (SELECT id FROM duplicated_variants)"""
+            )
+        cursor.execute(
+            "DELETE FROM variants WHERE id IN (SELECT id FROM duplicated_variants)"
+        )
+
+    cursor.execute("DROP TABLE duplicated_variants")
+    cursor.execute(
+        "CREATE UNIQUE INDEX idx_variants_unicity ON variants (chr,pos,ref,alt)"
+    )
+    return duplicates
 
 
 def create_variants_indexes(conn):
@@ -676,11 +2651,26 @@ def create_variants_indexes(conn):
 
     # Complementary index of the primary key (sample_id, variant_id)
     conn.execute(
-        """CREATE INDEX idx_sample_has_variant ON sample_has_variant (variant_id)"""
+        """CREATE INDEX IF NOT EXISTS idx_sample_has_variant ON sample_has_variant (variant_id)"""
     )
 
-    conn.execute("""CREATE INDEX idx_variants_pos ON variants (pos)""")
-    conn.execute("""CREATE INDEX idx_variants_ref_alt ON variants (ref, alt)""")
+    conn.execute("""CREATE INDEX IF NOT EXISTS idx_variants_pos ON variants (pos)""")
+    # Interval queries (See get_region_filter() and create_selection_from_bed())
+    conn.execute(
+        """CREATE INDEX IF NOT EXISTS idx_variants_bin ON variants (chr, bin, pos)"""
+    )
+    conn.execute("""CREATE INDEX IF NOT EXISTS idx_variants_ref_alt ON variants (ref, alt)""")
+    # Set operations by site (See get_site_keys())
+    if "site" in get_columns(conn, "variants"):
+        conn.execute("""CREATE INDEX IF NOT EXISTS idx_variants_site ON variants (site)""")
+
+    # Filters on genotype counters (See GENOTYPE_COUNTER_FIELDS)
+    columns = get_columns(conn, "variants")
+    for name in ("count_het", "count_hom", "count_var"):
+        if name in columns:
+            conn.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_variants_{name} ON variants ({name})"
+            )
 
 
 def get_one_variant(conn, id: int):
@@ -719,182 +2709,529 @@ def get_variants_count(conn):
     return conn.execute("""SELECT COUNT(*) FROM variants""").fetchone()[0]
 
 
-def async_insert_many_variants(conn, data, total_variant_count=None, yield_every=3000):
-    """Insert many variants from data into variants table
+# Per-variant counters of genotypes, stored in the "variants" table;
+# they are computed at import (See variant_to_rows()) or refreshed by
+# update_genotype_counters(), and can be indexed and filtered without joins.
+# In VQL they are available as functions: count_het(), carriers()...
+GENOTYPE_COUNTER_FIELDS = [
+    {
+        "name": "count_ref",
+        "category": "variants",
+        "type": "int",
+        "description": "Number of homozygous reference samples (gt = 0)",
+    },
+    {
+        "name": "count_het",
+        "category": "variants",
+        "type": "int",
+        "description": "Number of heterozygous samples (gt = 1)",
+    },
+    {
+        "name": "count_hom",
+        "category": "variants",
+        "type": "int",
+        "description": "Number of homozygous alternative samples (gt = 2)",
+    },
+    {
+        "name": "count_var",
+        "category": "variants",
+        "type": "int",
+        "description": "Number of samples carrying the variant (gt > 0)",
+    },
+    {
+        "name": "cohort_af",
+        "category": "variants",
+        "type": "float",
+        "description": "Allele frequency in the samples with a called genotype",
+    },
+    {
+        "name": "carriers",
+        "category": "variants",
+        "type": "text",
+        "description": "Names of the samples carrying the variant (gt > 0)",
+    },
+]
+
+GENOTYPE_COUNTER_NAMES = tuple(field["name"] for field in GENOTYPE_COUNTER_FIELDS)
+
+
+def count_genotypes(samples):
+    """Compute the genotype counters of a variant
+
+    :param samples: Samples of a variant as returned by
+        AbstractReader.get_variants(): dictionnaries with name and gt keys
+    :return: Values of the fields of GENOTYPE_COUNTER_FIELDS
+    :rtype: <dict>
+    """
+    counts = [0, 0, 0]
+    carriers = []
+    for sample in samples:
+        gt = sample.get("gt")
+        if gt in (0, 1, 2):
+            counts[gt] += 1
+            if gt:
+                carriers.append(sample["name"])
+    return _genotype_counters(counts, carriers)
+
+
+def _genotype_counters(counts, carriers):
+    """Return the genotype counters from the numbers of samples with gt 0, 1, 2
+    and the names of carriers"""
+    called = sum(counts)
+    return {
+        "count_ref": counts[0],
+        "count_het": counts[1],
+        "count_hom": counts[2],
+        "count_var": counts[1] + counts[2],
+        "cohort_af": (counts[1] + 2 * counts[2]) / (2 * called) if called else None,
+        "carriers": ",".join(carriers),
+    }
 
-    :param conn: sqlite3.connect
-    :param data: list of variant dictionnary which contains same number of key than fields numbers.
-    :param variant_count: total variant count, to compute progression
-    :return: Yield a tuple with progression and message.
-        Progression is 0 if total_variant_count is not set.
-    :rtype: <generator <tuple <int>, <str>>
 
+def update_genotype_counters(conn, sample_ids=None):
+    """Add the genotype counters to the "variants" table if they are missing,
+    and compute them from "sample_has_variant"
 
-    :Example:
+    Used for databases imported without counters or when samples have been
+    added; carriers are ordered by sample id.
 
-        insert_many_variant(conn, [{chr:"chr1", pos:24234, alt:"A","ref":T }])
-        insert_many_variant(conn, reader.get_variants())
+    :key sample_ids: Ids of samples added to the database; only the counters
+        of their variants are computed. All the counters by default.
+    """
+    columns = get_columns(conn, "variants")
+    for field in GENOTYPE_COUNTER_FIELDS:
+        if field["name"] not in columns:
+            conn.execute(
+                f"ALTER TABLE variants ADD COLUMN `{field['name']}` {field['type']}"
+            )
+    known_fields = {field["name"] for field in get_field_by_category(conn, "variants")}
+    insert_many_fields(
+        conn,
+        [field for field in GENOTYPE_COUNTER_FIELDS if field["name"] not in known_fields],
+    )
 
-    .. warning:: Using reader, this can take a while
-    .. todo:: with large dataset, need to cache import
-    .. todo:: handle insertion errors...
-    .. seealso:: abstractreader
+    if sample_ids is None:
+        counters = _genotype_counters([0, 0, 0], [])
+        conn.execute(
+            "UPDATE variants SET "
+            + ",".join(f"`{name}` = ?" for name in GENOTYPE_COUNTER_NAMES),
+            tuple(counters[name] for name in GENOTYPE_COUNTER_NAMES),
+        )
+        variants = ""
+    else:
+        variants = (
+            "WHERE variant_id IN (SELECT variant_id FROM sample_has_variant"
+            f" WHERE sample_id IN ({','.join(str(int(i)) for i in sample_ids)}))"
+        )
 
-    .. warning:: About using INSERT OR IGNORE:
-        INSERT OR IGNORE avoids errors:
+    cursor = raw_cursor(conn)
+    cursor.execute(
+        f"""SELECT variant_id, SUM(gt = 0), SUM(gt = 1), SUM(gt = 2),
+        group_concat(CASE WHEN gt > 0 THEN name END)
+        FROM (
+            SELECT variant_id, gt, samples.name FROM sample_has_variant
+            INNER JOIN samples ON samples.id = sample_has_variant.sample_id
+            {variants}
+            ORDER BY variant_id, sample_id
+        ) GROUP BY variant_id"""
+    )
 
-            - Upon insertion of a duplicate key where the column must contain
-            a PRIMARY KEY or UNIQUE constraint
-            - Upon insertion of NULL value where the column has
-            a NOT NULL constraint.
-        => This is not recommended
-    """
+    def rows():
+        for variant_id, count_ref, count_het, count_hom, carriers in cursor:
+            counters = _genotype_counters(
+                [count_ref, count_het, count_hom], [carriers] if carriers else []
+            )
+            yield tuple(counters[name] for name in GENOTYPE_COUNTER_NAMES) + (variant_id,)
+
+    # The query is read entirely before the update of the table
+    conn.executemany(
+        "UPDATE variants SET "
+        + ",".join(f"`{name}` = ?" for name in GENOTYPE_COUNTER_NAMES)
+        + " WHERE id = ?",
+        list(rows()),
+    )
+    invalidate_field_stats(conn, GENOTYPE_COUNTER_NAMES)
+    bump_generation(conn)
+    conn.commit()
 
-    def build_columns_and_placeholders(table_name):
-        """Build a tuple of columns and "?" placeholders for INSERT queries
-        """
-        # Get columns description from the given table
-        cols = get_columns(conn, table_name)
-        # Build dynamic insert query
-        # INSERT INTO variant qcol1, qcol2.... VALUES ?, ?
-        tb_cols = ",".join([f"`{col}`" for col in cols])
-        tb_places = ",".join(["?" for place in cols])
-        return tb_cols, tb_places
-
-    # TODO: Can we avoid this step ? This function should receive columns names
-    # because all the tables were created before...
-    # Build placeholders
-    var_cols, var_places = build_columns_and_placeholders("variants")
-    ann_cols, ann_places = build_columns_and_placeholders("annotations")
 
+def build_insert_context(conn, append=False):
+    """Gather once everything needed to insert variants into the database
+
+    Columns and insertion queries are computed here from the tables that were
+    created before the import; they are reused for every variant.
+
+    .. note:: Used by async_insert_many_variants() and by the parallel importer
+        which builds rows in worker processes.
+
+    :param conn: sqlite3.connect
+    :key append: Variants already in the database are not rejected: the data
+        of their samples are attached to them (See _append_to_variant()).
+    :return: Dictionnary with the following keys:
+        - variants_columns: columns of "variants" table (without id, bin
+            and site)
+        - has_bin: True if the column "bin" exists in "variants" table
+        - has_site: True if the column "site" exists in "variants" table
+        - annotations_columns: columns of "annotations" table (without variant_id)
+        - samples_columns: columns of "sample_has_variant" table
+            (without sample_id and variant_id)
+        - samples_ids: mapping of samples names to their sqlite ids
+        - genotype_counters: True if "variants" table has the columns of
+            GENOTYPE_COUNTER_FIELDS
+        - unique_index: False if the unicity of variants is checked after
+            insertions (see create_variants_unique_index())
+        - variants_query, annotations_query, samples_query: INSERT queries
+        - append: True if variants already in the database are completed
+        - variant_id_query, update_query, append_samples_query: queries
+            completing variants already in the database (append mode)
+        - key_positions, update_positions: positions in the values of a
+            variant of (chr,pos,ref,alt) and of the columns of update_query
+    :rtype: <dict>
+    """
+    # "bin" and "site" are not fields, they are computed from the position
+    # (See variant_to_rows())
     var_columns = get_columns(conn, "variants")
-    ann_columns = get_columns(conn, "annotations")
-    sample_columns = get_columns(conn, "sample_has_variant")
+    has_bin = "bin" in var_columns
+    has_site = "site" in var_columns
+    var_columns = [col for col in var_columns if col not in ("bin", "site")]
+    # variant_id is always the first column of these tables
+    ann_columns = [col for col in get_columns(conn, "annotations") if col != "variant_id"]
+    sample_columns = [
+        col
+        for col in get_columns(conn, "sample_has_variant")
+        if col not in ("sample_id", "variant_id")
+    ]
 
     # Get samples with samples names as keys and sqlite rowid as values
     # => used as a mapping for samples ids
-    samples_id_mapping = {
+    samples_ids = {
         name: rowid for name, rowid in conn.execute("SELECT name, id FROM samples")
     }
-    samples_names = samples_id_mapping.keys()
+
+    var_cols = ",".join(
+        f"`{col}`" for col in var_columns + ["bin"] * has_bin + ["site"] * has_site
+    )
+    var_places = ",".join("?" * (len(var_columns) + has_bin + has_site))
 
     # Check SQLite version and build insertion queries for variants
     # Old version doesn't support ON CONFLICT ..target.. DO ... statements
     # to handle violation of unicity constraint.
     old_sqlite_version = parse_version(sqlite3.sqlite_version) < parse_version("3.24.0")
+    unique_index = has_variants_unique_index(conn)
 
-    if old_sqlite_version:
+    if not unique_index:
+        # Unicity is checked after insertions (see create_variants_unique_index())
+        variants_query = f"""INSERT INTO variants ({var_cols})
+                VALUES ({var_places})"""
+    elif old_sqlite_version:
         LOGGER.warning(
-            "async_insert_many_variants:: Old SQLite version: %s"
+            "build_insert_context:: Old SQLite version: %s"
             " - Fallback to ignore errors!",
             sqlite3.sqlite_version,
         )
         # /!\ This syntax is SQLite specific
         # /!\ We mask all errors here !
-        variant_insert_query = f"""INSERT OR IGNORE INTO variants ({var_cols})
+        variants_query = f"""INSERT OR IGNORE INTO variants ({var_cols})
                 VALUES ({var_places})"""
-
     else:
         # Handle conflicts on the primary key
-        variant_insert_query = f"""INSERT INTO variants ({var_cols})
+        variants_query = f"""INSERT INTO variants ({var_cols})
                 VALUES ({var_places})
                 ON CONFLICT (chr,pos,ref,alt) DO NOTHING"""
 
+    ann_cols = ",".join(f"`{col}`" for col in ["variant_id"] + ann_columns)
+    ann_places = ",".join("?" * (len(ann_columns) + 1))
+
+    sample_cols = ",".join(
+        f"`{col}`" for col in ["sample_id", "variant_id"] + sample_columns
+    )
+    sample_places = ",".join("?" * (len(sample_columns) + 2))
+
+    context = {
+        "variants_columns": var_columns,
+        "has_bin": has_bin,
+        "has_site": has_site,
+        "annotations_columns": ann_columns,
+        "samples_columns": sample_columns,
+        "samples_ids": samples_ids,
+        "genotype_counters": any(col in GENOTYPE_COUNTER_NAMES for col in var_columns),
+        "unique_index": unique_index,
+        "variants_query": variants_query,
+        "annotations_query": f"INSERT INTO annotations ({ann_cols}) VALUES ({ann_places})",
+        "samples_query": f"INSERT INTO sample_has_variant ({sample_cols}) VALUES ({sample_places})",
+        "append": append,
+    }
+    if append:
+        # Known values are kept, missing ones (new fields) are filled;
+        # genotype counters are computed after the insertions
+        update_columns = [
+            col
+            for col in var_columns
+            if col not in ("chr", "pos", "ref", "alt") + GENOTYPE_COUNTER_NAMES
+        ]
+        context.update(
+            variant_id_query=(
+                "SELECT id FROM variants WHERE chr = ? AND pos = ? AND ref = ? AND alt = ?"
+            ),
+            key_positions=[var_columns.index(col) for col in ("chr", "pos", "ref", "alt")],
+            update_query=(
+                "UPDATE variants SET "
+                + ",".join(f"`{col}` = IFNULL(NULLIF(`{col}`, ''), ?)" for col in update_columns)
+                + " WHERE id = ?"
+                if update_columns
+                else None
+            ),
+            update_positions=[var_columns.index(col) for col in update_columns],
+            # The first genotype of a sample is kept (duplicated variants)
+            append_samples_query=(
+                f"INSERT OR IGNORE INTO sample_has_variant ({sample_cols})"
+                f" VALUES ({sample_places})"
+            ),
+        )
+    return context
+
+
+def variant_to_rows(variant: dict, context: dict):
+    """Convert a variant dictionnary into compact tuples ready to be inserted
+
+    Missing values are replaced by empty strings (as it was done with
+    defaultdict(str) before). Genotype counters are computed here if the
+    "variants" table has their columns (See GENOTYPE_COUNTER_FIELDS).
+
+    :param variant: Variant as returned by AbstractReader.get_variants()
+    :param context: Dictionnary returned by build_insert_context()
+    :return: Tuple of 3 items:
+        - values of the variant, ordered as context["variants_columns"],
+            followed by its bin if context["has_bin"] is True and its site
+            key if context["has_site"] is True
+        - list of annotations values (without variant_id)
+        - list of samples values (sample_id first, without variant_id)
+    :rtype: <tuple <tuple>, <list <tuple>>, <list <tuple>>>
+    """
+    if context["genotype_counters"]:
+        variant = dict(variant, **count_genotypes(variant.get("samples", ())))
+
+    values = tuple(variant.get(col, "") for col in context["variants_columns"])
+    if context["has_bin"]:
+        values += (get_variant_bin(variant["pos"], variant["ref"]),)
+    if context["has_site"]:
+        values += (get_site_key(variant["chr"], variant["pos"]),)
+
+    ann_columns = context["annotations_columns"]
+    annotations = [
+        tuple(ann.get(col, "") for col in ann_columns)
+        for ann in variant.get("annotations", ())
+    ]
+
+    # Retrieve the id of the sample to build the association in
+    # "sample_has_variant" table carrying the data "gt" (genotype)
+    samples_ids = context["samples_ids"]
+    sample_columns = context["samples_columns"]
+    samples = [
+        (samples_ids[sample["name"]],) + tuple(sample.get(col, "") for col in sample_columns)
+        for sample in variant.get("samples", ())
+    ]
+    return values, annotations, samples
+
+
+def insert_variants_rows(cursor, rows: list, context: dict):
+    """Insert a batch of rows built by variant_to_rows() with one executemany
+    per table
+
+    Variant ids are pre-assigned: SQLite gives MAX(id)+1 to each new row of
+    an INTEGER PRIMARY KEY table, so when the whole batch is accepted,
+    the ids of the batch are consecutive from MAX(id)+1.
+
+    If some variants are rejected by the unicity constraint on
+    (chr,pos,ref,alt), the batch is rolled back to a savepoint and inserted
+    again row by row to keep the link between each variant and its data;
+    rejected variants and their attached data are skipped. In append mode
+    (See build_insert_context()), variants already in the database are
+    completed instead (See _append_to_variant()).
+
+    .. note:: No commit is made here.
+
+    :param cursor: sqlite3 cursor
+    :param rows: List of tuples returned by variant_to_rows()
+    :param context: Dictionnary returned by build_insert_context()
+    :return: Number of variants rejected
+    :rtype: <int>
+    """
+    if not rows:
+        return 0
+
+    bump_generation(cursor)
+    first_id = (cursor.execute("SELECT MAX(id) FROM variants").fetchone()[0] or 0) + 1
+
+    # Open the transaction explicitly: releasing an outermost savepoint
+    # would commit the batch
+    if not cursor.connection.in_transaction:
+        cursor.execute("BEGIN")
+    cursor.execute("SAVEPOINT insert_variants_batch")
+    cursor.executemany(context["variants_query"], (row[0] for row in rows))
+
+    if cursor.rowcount == len(rows):
+        # All variants have been inserted with consecutive ids
+        variants_ids = range(first_id, first_id + len(rows))
+        errors = 0
+    else:
+        # Some variants have been rejected: their position in the batch
+        # is unknown => insert them one by one
+        cursor.execute("ROLLBACK TO insert_variants_batch")
+        variants_ids = []
+        errors = 0
+        for values, _, samples in rows:
+            cursor.execute(context["variants_query"], values)
+
+            if (
+                cursor.rowcount == 0
+                and context["append"]
+                and _append_to_variant(cursor, values, samples, context) is not None
+            ):
+                # The data of the variant are attached here
+                variants_ids.append(None)
+
+            # If the row is not inserted we skip this erroneous variant
+            # and the data that goes with
+            elif cursor.rowcount == 0:
+                _log_rejected_variant("insert_variants_rows", values)
+                variants_ids.append(None)
+                errors += 1
+            else:
+                variants_ids.append(cursor.lastrowid)
+
+    # If variant has annotation data, insert record into "annotations" table
+    # One-to-many relationships
+    cursor.executemany(
+        context["annotations_query"],
+        (
+            (variant_id,) + annotation
+            for variant_id, (_, annotations, _) in zip(variants_ids, rows)
+            if variant_id is not None
+            for annotation in annotations
+        ),
+    )
+
+    # If variant has sample data, insert record into "sample_has_variant" table
+    # Many-to-many relationships
+    cursor.executemany(
+        context["samples_query"],
+        (
+            (sample[0], variant_id) + sample[1:]
+            for variant_id, (_, _, samples) in zip(variants_ids, rows)
+            if variant_id is not None
+            for sample in samples
+        ),
+    )
+
+    cursor.execute("RELEASE insert_variants_batch")
+    return errors
+
+
+def async_insert_many_variants(
+    conn,
+    data,
+    total_variant_count=None,
+    yield_every=3000,
+    batch_size=None,
+    commit_every=None,
+    checkpoint=None,
+    resume=False,
+    skip_inserted=True,
+    append=False,
+):
+    """Insert many variants from data into variants table
+
+    :param conn: sqlite3.connect
+    :param data: list of variant dictionnary which contains same number of key than fields numbers.
+    :param variant_count: total variant count, to compute progression
+    :key batch_size: If set, variants are buffered and inserted by batches of
+        this size with one executemany per table (see insert_variants_rows()).
+        Otherwise, variants are inserted one by one.
+    :key commit_every: If set, a commit is made every time this number of
+        variants is inserted, with a checkpoint in the table "metadatas"
+        (see save_import_checkpoint()). The table must exist.
+        Otherwise, the only commit is made at the end.
+    :key checkpoint: Function returning a dictionnary of extra metadatas
+        saved with each checkpoint.
+    :key resume: Resume the counts of the interrupted import from its last
+        checkpoint.
+    :key skip_inserted: On resume, skip the variants of data inserted before
+        the last checkpoint; data must be the same as the interrupted import.
+        If False, data already start after the checkpoint
+        (See AbstractReader.seek()).
+    :key append: Add data to a database which already contains variants:
+        variants already in the database get the data of their samples
+        (See build_insert_context()); the count of the default selection
+        is updated.
+    :return: Yield a tuple with progression and message.
+        Progression is 0 if total_variant_count is not set.
+    :rtype: <generator <tuple <int>, <str>>
+
+
+    :Example:
+
+        insert_many_variant(conn, [{chr:"chr1", pos:24234, alt:"A","ref":T }])
+        insert_many_variant(conn, reader.get_variants())
+
+    .. warning:: Using reader, this can take a while
+    .. todo:: with large dataset, need to cache import
+    .. seealso:: abstractreader, insert_variants_rows
+
+    .. warning:: About using INSERT OR IGNORE:
+        INSERT OR IGNORE avoids errors:
+
+            - Upon insertion of a duplicate key where the column must contain
+            a PRIMARY KEY or UNIQUE constraint
+            - Upon insertion of NULL value where the column has
+            a NOT NULL constraint.
+        => This is not recommended
+    """
+    context = build_insert_context(conn, append=append)
+    if append and not context["unique_index"]:
+        raise ValueError(
+            "async_insert_many_variants:: Variants can't be appended to a database"
+            " without unique index on (chr,pos,ref,alt)"
+        )
+    previous_count = get_variants_count(conn) if append else 0
+
     # Insertion - Begin transaction
     cursor = conn.cursor()
 
     # Loop over variants
     errors = 0
     progress = 0
-    for variant_count, variant in enumerate(data, 1):
-
-        # Insert current variant
-        # Use default dict to handle missing values
-        LOGGER.debug(
-            "async_insert_many_variants:: QUERY: %s\nVALUES: %s",
-            variant_insert_query,
-            variant,
+    variant_count = 0
+    if resume:
+        metadatas = get_metadatas(conn)
+        variant_count = int(metadatas.get("import_variant_count", 0))
+        errors = int(metadatas.get("import_errors", 0))
+        LOGGER.info(
+            "async_insert_many_variants:: Resume after %s variants", variant_count
         )
+        if skip_inserted:
+            data = islice(data, variant_count, None)
 
-        #  Create list of value to insert
-        # ["chr",234234,"A","G"]
-        default_values = defaultdict(str, variant)
-        values = [default_values[col] for col in var_columns]
-
-        cursor.execute(variant_insert_query, values)
-
-        # If the row is not inserted we skip this erroneous variant
-        # and the data that goes with
-        if cursor.rowcount == 0:
-            LOGGER.error(
-                "async_insert_many_variants:: The following variant "
-                "contains erroneous data; most of the time it is a "
-                "duplication of the primary key: (chr,pos,ref,alt). "
-                "Please check your data; this variant and its attached "
-                "data will not be inserted!\n%s",
-                variant,
-            )
-            errors += 1
-            continue
+    committed_count = variant_count
+    batch = []
+    for variant_count, variant in enumerate(data, variant_count + 1):
+
+        rows = variant_to_rows(variant, context)
 
-        # Get variant rowid
-        variant_id = cursor.lastrowid
-
-        # If variant has annotation data, insert record into "annotations" table
-        # One-to-many relationships
-        if "annotations" in variant:
-            # print("VAR annotations:", variant["annotations"])
-
-            # [{'allele': 'T', 'consequence': 'intergenic_region', 'impact': 'MODIFIER', ...}]
-            # The aim is to execute all insertions through executemany()
-            # We remove the placeholder :variant_id from places,
-            # and fix it's value.
-            # TODO: handle missing values;
-            # Les dict de variant["annotations"] contiennent a priori déjà
-            # tous les champs requis (mais vides) car certaines annotations
-            # ont des données manquantes.
-            # A t'on l'assurance de cela ?
-            # Dans ce cas pourquoi doit-on bricoler le variant lui-meme avec un
-            # defaultdict(str,variant)) ? Les variants n'ont pas leurs champs par def ?
-
-            values = []
-            for ann in variant["annotations"]:
-                default_values = defaultdict(str, ann)
-                value = [default_values[col] for col in ann_columns[1:]]
-                value.insert(0, variant_id)
-                values.append(value)
-
-            temp_ann_places = ",".join(["?"] * (len(ann_columns)))
-
-            q = f"""INSERT INTO annotations ({ann_cols})
-                VALUES ({temp_ann_places})"""
-
-            cursor.executemany(q, values)
-
-        # If variant has sample data, insert record into "sample_has_variant" table
-        # Many-to-many relationships
-        if "samples" in variant:
-            # print("VAR samples:", variant["samples"])
-            # [{'name': 'NORMAL', 'gt': 1, 'AD': '64,0', 'AF': 0.0, ...}]
-            # Insertion only if the current sample name is in samples_names
-            # (authorized sample names already in the database)
-            # TODO: is this test usefull since samples that are in the database
-            # have been inserted from the same source file (or it is not the case ?) ?
-            # Retrieve the id of the sample to build the association in
-            # "sample_has_variant" table carrying the data "gt" (genotype)
-
-            samples = []
-            for sample in variant["samples"]:
-                sample_id = samples_id_mapping[sample["name"]]
-                default_values = defaultdict(str, sample)
-                sample_value = [sample_id, variant_id]
-                sample_value += [default_values[i] for i in sample_columns[2:]]
-                samples.append(sample_value)
-
-            placeholder = ",".join(["?"] * len(sample_columns))
-
-            q = f"""INSERT INTO sample_has_variant VALUES ({placeholder})"""
-            cursor.executemany(q, samples)
+        if batch_size:
+            batch.append(rows)
+            if len(batch) >= batch_size:
+                errors += insert_variants_rows(cursor, batch, context)
+                batch = []
+        else:
+            errors += _insert_single_variant_rows(cursor, rows, context)
+
+        # Commit only when no variant is pending in the batch
+        if commit_every and not batch and variant_count - committed_count >= commit_every:
+            extra = checkpoint() if checkpoint else {}
+            save_import_checkpoint(conn, variant_count, errors, **extra)
+            conn.commit()
+            committed_count = variant_count
 
         # Yield progression
         if variant_count % yield_every == 0:
@@ -903,8 +3240,60 @@ def build_columns_and_placeholders(table_name):
 
             yield progress, f"{variant_count} variants inserted."
 
-    # Commit the transaction
-    conn.commit()
+    # Flush remaining variants
+    errors += insert_variants_rows(cursor, batch, context)
+
+    yield from async_end_variants_insertion(
+        conn,
+        context,
+        variant_count,
+        errors,
+        checkpoint=((checkpoint() if checkpoint else {}) if commit_every else None),
+        previous_count=previous_count,
+    )
+
+
+def async_end_variants_insertion(
+    conn, context, variant_count, errors, checkpoint=None, previous_count=0
+):
+    """End the insertion of variants made with the given context
+
+    Check the unicity of variants if their unique index was deferred, then
+    create the default selection (or update its count for an append).
+    Used by async_insert_many_variants() and by parallel imports.
+
+    :param context: Dictionnary returned by build_insert_context()
+    :param variant_count: Number of variants read from the source
+    :param errors: Number of variants rejected so far
+    :key checkpoint: If set, dictionnary of extra metadatas of the last
+        checkpoint (see save_import_checkpoint()), committed with the
+        default selection. Otherwise, the transaction is committed.
+    :key previous_count: Number of variants before an append
+    :return: Yield a tuple with progression and message.
+    :rtype: <generator <tuple <int>, <str>>
+    """
+    if not context["unique_index"]:
+        yield 96, "Checking unicity of variants..."
+        errors += create_variants_unique_index(conn)
+
+    if checkpoint is not None:
+        # The last checkpoint is committed with the default selection
+        save_import_checkpoint(
+            conn, variant_count, errors, import_status="inserted", **checkpoint
+        )
+    else:
+        # Commit the transaction
+        conn.commit()
+
+    if context["append"]:
+        count = get_variants_count(conn)
+        yield 97, f"{count - previous_count} new variant(s) has been inserted."
+        conn.execute(
+            "UPDATE selections SET count = ? WHERE name = ?",
+            (count, cm.DEFAULT_SELECTION_NAME),
+        )
+        conn.commit()
+        return
 
     yield 97, f"{variant_count - errors} variant(s) has been inserted."
 
@@ -914,11 +3303,224 @@ def build_columns_and_placeholders(table_name):
     )
 
 
+def _log_rejected_variant(caller, values):
+    """Log a variant rejected by the database
+
+    :param caller: Name of the inserting function
+    :param values: Values of the variant (See variant_to_rows())
+    """
+    LOGGER.error(
+        "%s:: The following variant "
+        "contains erroneous data; most of the time it is a "
+        "duplication of the primary key: (chr,pos,ref,alt). "
+        "Please check your data; this variant and its attached "
+        "data will not be inserted!\n%s",
+        caller,
+        values,
+    )
+
+
+def _insert_single_variant_rows(cursor, rows, context):
+    """Insert one variant and its attached data (one execute per variant)
+
+    :return: 1 if the variant has been rejected, 0 otherwise.
+    """
+    values, annotations, samples = rows
+    cursor.execute(context["variants_query"], values)
+
+    if (
+        cursor.rowcount == 0
+        and context["append"]
+        and _append_to_variant(cursor, values, samples, context) is not None
+    ):
+        return 0
+
+    # If the row is not inserted we skip this erroneous variant
+    # and the data that goes with
+    if cursor.rowcount == 0:
+        _log_rejected_variant("async_insert_many_variants", values)
+        return 1
+
+    # Get variant rowid
+    variant_id = cursor.lastrowid
+
+    if annotations:
+        cursor.executemany(
+            context["annotations_query"],
+            ((variant_id,) + annotation for annotation in annotations),
+        )
+
+    if samples:
+        cursor.executemany(
+            context["samples_query"],
+            ((sample[0], variant_id) + sample[1:] for sample in samples),
+        )
+    return 0
+
+
+def _append_to_variant(cursor, values, samples, context):
+    """Complete a variant already in the database with the data of a new file
+
+    Missing values of the variant are filled (fields added by the new file)
+    and the data of its samples are inserted; annotations are not inserted
+    again.
+
+    :param values, samples: Items returned by variant_to_rows()
+    :param context: Dictionnary returned by build_insert_context(conn, append=True)
+    :return: The id of the variant or None if the variant is not in the
+        database (rejected for another reason than its unicity)
+    :rtype: <int>
+    """
+    key = tuple(values[i] for i in context["key_positions"])
+    record = cursor.execute(context["variant_id_query"], key).fetchone()
+    if record is None:
+        return None
+    variant_id = record[0]
+    if context["update_query"]:
+        cursor.execute(
+            context["update_query"],
+            tuple(values[i] for i in context["update_positions"]) + (variant_id,),
+        )
+    cursor.executemany(
+        context["append_samples_query"],
+        ((sample[0], variant_id) + sample[1:] for sample in samples),
+    )
+    return variant_id
+
+
 def insert_many_variants(conn, data, **kwargs):
-    for _, _ in async_insert_many_variants(conn, data, kwargs):
+    for _, _ in async_insert_many_variants(conn, data, **kwargs):
         pass
 
 
+def merge_database(conn, filename):
+    """Merge the variants of another database into the database of the connexion
+
+    The other database (a staging database filled by another process) is
+    attached and copied with bulk INSERT ... SELECT statements; its variant
+    ids are remapped to the ids of the main database through a temporary
+    table:
+
+        - new fields are added (See insert_missing_fields());
+        - samples are matched by name; unknown samples are added;
+        - variants already in the main database (chr,pos,ref,alt) are
+          completed like with an append (See build_insert_context());
+          new variants are inserted with their annotations;
+        - the data of samples are attached to the variants.
+
+    Genotype counters, the default selection and indexes are not updated:
+    the caller does it once all the databases are merged.
+
+    :param conn: sqlite3.connect; the "variants" table must have a unique
+        index on (chr,pos,ref,alt).
+    :param filename: Path of the database to merge
+    :return: Number of new variants
+    :rtype: <int>
+    """
+    # ATTACH/DETACH can't be executed in a transaction
+    conn.commit()
+    conn.execute("ATTACH DATABASE ? AS shard", (filename,))
+    cursor = raw_cursor(conn)
+    try:
+        insert_missing_fields(
+            conn,
+            [
+                dict(zip(("name", "category", "type", "description"), row))
+                for row in cursor.execute(
+                    "SELECT name, category, type, description FROM shard.fields"
+                )
+            ],
+        )
+
+        def common_columns(table, excluded=()):
+            columns = get_columns(conn, table)
+            return [
+                f"`{col}`"
+                for _, col, *_ in cursor.execute(f"PRAGMA shard.table_info({table})")
+                if col in columns and col not in excluded
+            ]
+
+        cursor.execute(
+            """INSERT INTO samples (name) SELECT name FROM shard.samples
+            WHERE name NOT IN (SELECT name FROM main.samples) ORDER BY id"""
+        )
+
+        last_variant_id = cursor.execute("SELECT MAX(id) FROM variants").fetchone()[0]
+        last_variant_id = last_variant_id or 0
+        var_columns = common_columns("variants", ("id",))
+        cursor.execute(
+            f"""INSERT OR IGNORE INTO main.variants ({",".join(var_columns)})
+            SELECT {",".join(var_columns)} FROM shard.variants ORDER BY id"""
+        )
+        new_variant_count = cursor.rowcount
+
+        # Ids of the variants of the other database in the main one
+        cursor.execute("DROP TABLE IF EXISTS temp.variant_map")
+        cursor.execute(
+            "CREATE TEMP TABLE variant_map (shard_id INTEGER PRIMARY KEY, id INTEGER UNIQUE)"
+        )
+        cursor.execute(
+            """INSERT INTO temp.variant_map
+            SELECT shard.variants.id, main.variants.id FROM shard.variants
+            INNER JOIN main.variants ON main.variants.chr = shard.variants.chr
+            AND main.variants.pos = shard.variants.pos
+            AND main.variants.ref = shard.variants.ref
+            AND main.variants.alt = shard.variants.alt"""
+        )
+
+        # Known values are kept, missing ones (new fields) are filled;
+        # genotype counters are computed after the merge
+        update_columns = [
+            col
+            for col in var_columns
+            if col.strip("`") not in ("chr", "pos", "ref", "alt") + GENOTYPE_COUNTER_NAMES
+        ]
+        if update_columns:
+            cursor.execute(
+                f"""UPDATE main.variants SET ({",".join(update_columns)}) = (
+                SELECT {",".join(f"IFNULL(NULLIF(main.variants.{col}, ''), shard.variants.{col})" for col in update_columns)}
+                FROM temp.variant_map
+                INNER JOIN shard.variants ON shard.variants.id = variant_map.shard_id
+                WHERE variant_map.id = main.variants.id)
+                WHERE id <= ? AND id IN (SELECT id FROM temp.variant_map)""",
+                (last_variant_id,),
+            )
+
+        ann_columns = common_columns("annotations", ("variant_id",))
+        if ann_columns:
+            cursor.execute(
+                f"""INSERT INTO main.annotations (variant_id, {",".join(ann_columns)})
+                SELECT variant_map.id, {",".join(ann_columns)} FROM shard.annotations
+                INNER JOIN temp.variant_map ON variant_map.shard_id = annotations.variant_id
+                WHERE variant_map.id > ? ORDER BY variant_map.id""",
+                (last_variant_id,),
+            )
+
+        # The first genotype of a sample is kept (like with an append)
+        sample_columns = common_columns("sample_has_variant", ("sample_id", "variant_id"))
+        selected_columns = "".join(f", sample_has_variant.{col}" for col in sample_columns)
+        cursor.execute(
+            f"""INSERT OR IGNORE INTO main.sample_has_variant
+            (sample_id, variant_id{"".join(", " + col for col in sample_columns)})
+            SELECT main.samples.id, variant_map.id{selected_columns}
+            FROM shard.sample_has_variant
+            INNER JOIN temp.variant_map ON variant_map.shard_id = sample_has_variant.variant_id
+            INNER JOIN shard.samples ON shard.samples.id = sample_has_variant.sample_id
+            INNER JOIN main.samples ON main.samples.name = shard.samples.name"""
+        )
+        cursor.execute("DROP TABLE temp.variant_map")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.execute("DETACH DATABASE shard")
+
+    bump_generation(conn)
+    LOGGER.debug("merge_database:: %s new variants from %s", new_variant_count, filename)
+    return new_variant_count
+
+
 ## ================ Samples functions ==========================================
 
 
@@ -975,33 +3577,709 @@ def insert_sample(conn, name="no_name"):
     cursor = conn.cursor()
     cursor.execute("""INSERT INTO samples (name) VALUES (?)""", [name])
     conn.commit()
+    invalidate_schema_catalog(conn)
     return cursor.lastrowid
 
 
-def insert_many_samples(conn, samples: list):
-    """Insert many samples at a time in samples table
+def insert_many_samples(conn, samples: list):
+    """Insert many samples at a time in samples table
+
+    :param samples: List of samples names
+        .. todo:: only names in this list ?
+    :type samples: <list <str>>
+    """
+    cursor = conn.cursor()
+    cursor.executemany(
+        """INSERT INTO samples (name) VALUES (?)""", ((sample,) for sample in samples)
+    )
+    conn.commit()
+    invalidate_schema_catalog(conn)
+
+
+def get_samples(conn):
+    """"Get samples from sample table
+
+    :param con: sqlite3.conn
+    :return: Generator of dictionnaries with as sample fields as values.
+        :Example: ({'id': <unique_id>, 'name': <sample_name>})
+    :rtype: <generator <dict>>
+    """
+    conn.row_factory = sqlite3.Row
+    return (dict(data) for data in conn.execute("""SELECT * FROM samples"""))
+
+
+## ================ Genotype matrix functions ==================================
+
+# Fields of "sample_has_variant" which can be stored in the genotype matrix,
+# with the type code of their arrays: gt on 1 signed byte per sample,
+# other fields on 4 signed bytes per sample.
+GENOTYPE_MATRIX_FIELDS = {"gt": "b", "dp": "i", "gq": "i"}
+
+# Value of missing data for each type code
+GENOTYPE_MATRIX_MISSING = {"b": -128, "i": -0x80000000}
+
+# Range of the values stored for each type code (the missing value excluded)
+GENOTYPE_MATRIX_RANGES = {"b": (-127, 127), "i": (-0x7FFFFFFF, 0x7FFFFFFF)}
+
+# Number of values read at once by create_genotype_matrix()
+GENOTYPE_MATRIX_CHUNK_SIZE = 1000000
+
+# SQL function extracting the value of a sample for each type code
+# (See register_genotype_functions())
+GENOTYPE_MATRIX_SQL_FUNCTIONS = {"b": "sample_gt", "i": "sample_value"}
+
+
+def _genotype_matrix_value(value, typecode):
+    """Return the given value as stored in the genotype matrix
+
+    None, empty strings (missing values of variant_to_rows()) and non-numeric
+    values are missing values.
+
+    :raises ValueError: If the value can't be stored exactly (non-integral
+        numbers or integers out of the range of the type code).
+    """
+    if isinstance(value, str):
+        try:
+            value = float(value)
+        except ValueError:
+            return GENOTYPE_MATRIX_MISSING[typecode]
+    if value is None or value != value:
+        # None or NaN
+        return GENOTYPE_MATRIX_MISSING[typecode]
+    low, high = GENOTYPE_MATRIX_RANGES[typecode]
+    if value != int(value) or not low <= value <= high:
+        raise ValueError(
+            f"_genotype_matrix_value:: {value!r} can't be stored in the genotype matrix"
+        )
+    return int(value)
+
+
+def pack_genotype_values(values, field="gt"):
+    """Pack the values of a field for all samples into bytes
+
+    Missing values are stored with the missing value of the type code of
+    the field (See GENOTYPE_MATRIX_FIELDS and _genotype_matrix_value()).
+    Arrays are little endian.
+
+    :param values: Values of samples in the order of the matrix
+        (See get_genotype_matrix_samples())
+    :param field: Name of the field
+    :return: Packed values
+    :rtype: <bytes>
+    :raises ValueError: If a value can't be stored exactly
+    """
+    typecode = GENOTYPE_MATRIX_FIELDS[field]
+    missing = GENOTYPE_MATRIX_MISSING[typecode]
+    values = [missing if value is None else value for value in values]
+    try:
+        data = array(typecode, values)
+    except (OverflowError, TypeError):
+        data = None
+
+    if data is None or data.count(missing) != values.count(missing):
+        # Slow path: strings, floats, values out of range or equal to the
+        # missing value
+        data = array(
+            typecode,
+            (
+                missing if value is missing else _genotype_matrix_value(value, typecode)
+                for value in values
+            ),
+        )
+    if sys.byteorder == "big":
+        data.byteswap()
+    return data.tobytes()
+
+
+def unpack_genotype_values(blob, field="gt"):
+    """Unpack the values packed by pack_genotype_values()
+
+    :return: Values of samples; missing values are None
+    :rtype: <list>
+    """
+    typecode = GENOTYPE_MATRIX_FIELDS[field]
+    missing = GENOTYPE_MATRIX_MISSING[typecode]
+    data = array(typecode)
+    data.frombytes(blob)
+    if sys.byteorder == "big":
+        data.byteswap()
+    return [None if value == missing else value for value in data]
+
+
+def _sample_gt(blob, index):
+    """SQL function: genotype of the sample at the given index or NULL"""
+    if blob is None or not 0 <= index < len(blob):
+        return None
+    value = blob[index]
+    if value == 0x80:
+        return None
+    return value - 256 if value > 127 else value
+
+
+def _sample_value(blob, index):
+    """SQL function: value of the sample at the given index or NULL"""
+    if blob is None or not 0 <= 4 * index <= len(blob) - 4:
+        return None
+    value = int.from_bytes(blob[4 * index : 4 * index + 4], "little", signed=True)
+    return None if value == GENOTYPE_MATRIX_MISSING["i"] else value
+
+
+def _count_gt(blob, gt):
+    """SQL function: number of samples with the given genotype (NULL: missing)"""
+    if blob is None:
+        return 0
+    if gt is None:
+        return blob.count(0x80)
+    if not -127 <= gt <= 127:
+        return 0
+    return blob.count(gt & 0xFF)
+
+
+def register_genotype_functions(conn):
+    """Register the SQL functions reading the genotype matrix
+
+    - sample_gt(gt_blob, index): genotype of a sample or NULL
+    - sample_value(blob, index): value of a sample for 4 bytes fields
+      (dp, gq) or NULL
+    - count_gt(gt_blob, gt): number of samples with the given genotype
+
+    Indexes of samples are given by get_genotype_matrix_samples().
+    """
+    # Deterministic functions can be used in indexes and are optimized
+    kwargs = {"deterministic": True} if sys.version_info >= (3, 8) else {}
+    conn.create_function("sample_gt", 2, _sample_gt, **kwargs)
+    conn.create_function("sample_value", 2, _sample_value, **kwargs)
+    conn.create_function("count_gt", 2, _count_gt, **kwargs)
+
+
+def get_genotype_matrix_samples(conn):
+    """Return the names of samples in the order of the genotype matrix
+
+    Samples are stored by ascending id; samples added after the creation
+    of the matrix have no value (SQL functions return NULL).
+
+    :rtype: <list <str>>
+    """
+    return [row[0] for row in conn.execute("SELECT name FROM samples ORDER BY id")]
+
+
+def get_genotype_matrix_fields(conn):
+    """Return the fields stored in the "genotype_matrix" table
+
+    :return: Empty list if the table doesn't exist
+    :rtype: <list <str>>
+    """
+    return [
+        column
+        for column in get_columns(conn, "genotype_matrix")
+        if column != "variant_id"
+    ]
+
+
+def _is_storable_in_genotype_matrix(conn, field):
+    """Return True if the numbers of the given field of "sample_has_variant"
+    are integers in the range of its type code (See GENOTYPE_MATRIX_RANGES)
+
+    Filters on the genotype matrix must give the same results as filters on
+    "sample_has_variant": values are never rounded or clamped.
+    """
+    low, high = GENOTYPE_MATRIX_RANGES[GENOTYPE_MATRIX_FIELDS[field]]
+    return not conn.execute(
+        f"""SELECT EXISTS (SELECT 1 FROM sample_has_variant
+        WHERE typeof(`{field}`) IN ('integer', 'real')
+        AND (`{field}` != CAST(`{field}` AS INTEGER) OR `{field}` NOT BETWEEN ? AND ?))""",
+        (low, high),
+    ).fetchone()[0]
+
+
+def create_genotype_matrix(conn, fields=None):
+    """Create or refresh the "genotype_matrix" table
+
+    This table is a compact copy of "sample_has_variant" with one row per
+    variant: the values of a field for all samples are packed in a BLOB
+    (See pack_genotype_values()). Filters on the genotypes of many samples
+    are made with one join by primary key (See QueryBuilder.build_sql()).
+
+    :param fields: Fields of "sample_has_variant" to store; by default all
+        the fields of GENOTYPE_MATRIX_FIELDS found in the table whose values
+        can be stored exactly (See _genotype_matrix_value()).
+    :return: Stored fields
+    :rtype: <list <str>>
+
+    .. note:: No commit is made here.
+    """
+    sample_columns = get_columns(conn, "sample_has_variant")
+    if fields is None:
+        fields = []
+        for field in GENOTYPE_MATRIX_FIELDS:
+            if field not in sample_columns:
+                continue
+            if _is_storable_in_genotype_matrix(conn, field):
+                fields.append(field)
+            else:
+                LOGGER.warning(
+                    "create_genotype_matrix:: %s has values which can't be stored;"
+                    " it is filtered with joins",
+                    field,
+                )
+    else:
+        fields = list(fields)
+        for field in fields:
+            if (
+                field not in GENOTYPE_MATRIX_FIELDS
+                or field not in sample_columns
+                or not _is_storable_in_genotype_matrix(conn, field)
+            ):
+                raise ValueError(f"create_genotype_matrix:: Unsupported field {field}")
+
+    conn.execute("DROP TABLE IF EXISTS genotype_matrix")
+    schema = "".join(f", `{field}` BLOB" for field in fields)
+    conn.execute(
+        f"CREATE TABLE genotype_matrix (variant_id INTEGER PRIMARY KEY{schema})"
+    )
+    bump_generation(conn)
+    if not fields:
+        return fields
+
+    sample_ids = [row[0] for row in conn.execute("SELECT id FROM samples ORDER BY id")]
+    sample_count = len(sample_ids)
+    columns = "".join(f", `{field}`" for field in fields)
+    # Number of variants read at once: about GENOTYPE_MATRIX_CHUNK_SIZE values
+    chunk_size = max(1, GENOTYPE_MATRIX_CHUNK_SIZE // max(1, sample_count))
+
+    def rows():
+        cursor = raw_cursor(conn)
+        variant_ids = [row[0] for row in cursor.execute("SELECT id FROM variants ORDER BY id")]
+        for chunk_start in range(0, len(variant_ids), chunk_size):
+            chunk_ids = variant_ids[chunk_start : chunk_start + chunk_size]
+            positions = {
+                variant_id: i * sample_count for i, variant_id in enumerate(chunk_ids)
+            }
+            # Values of the chunk: one list per field, sample_count values per variant
+            values = [[None] * (len(chunk_ids) * sample_count) for _ in fields]
+            # Read samples one by one in the order of the primary key
+            for index, sample_id in enumerate(sample_ids):
+                cursor.execute(
+                    f"SELECT variant_id{columns} FROM sample_has_variant"
+                    " WHERE sample_id = ? AND variant_id BETWEEN ? AND ?",
+                    (sample_id, chunk_ids[0], chunk_ids[-1]),
+                )
+                for record in cursor:
+                    position = positions[record[0]] + index
+                    for i, field_values in enumerate(values, 1):
+                        field_values[position] = record[i]
+
+            for variant_id, position in positions.items():
+                yield (variant_id,) + tuple(
+                    pack_genotype_values(
+                        field_values[position : position + sample_count], field
+                    )
+                    for field, field_values in zip(fields, values)
+                )
+
+    places = ",".join("?" * (len(fields) + 1))
+    conn.executemany(
+        f"INSERT INTO genotype_matrix (variant_id{columns}) VALUES ({places})", rows()
+    )
+    return fields
+
+
+## ================ Index advisor functions ====================================
+
+# Tables of the fields recorded by FilterWorkload and the indexed columns put
+# before the field in the indexes created by advise_indexes()
+INDEX_ADVISOR_TABLES = {
+    "variants": (),
+    "annotations": (),
+    "sample_has_variant": ("sample_id",),
+}
+# Operators of filters able to use an index
+INDEX_ADVISOR_OPERATORS = ("=", "==", "<", "<=", ">", ">=", "IN", "IS", "BETWEEN")
+# Prefix of the names of the indexes managed by the advisor
+INDEX_ADVISOR_PREFIX = "idx_advisor_"
+# Fields with more missing values than this ratio get partial indexes
+# (WHERE field IS NOT NULL), usable by any comparison on the field
+INDEX_ADVISOR_PARTIAL_RATIO = 0.5
+# Estimated size of an index entry without the key: rowid and cell header
+INDEX_ADVISOR_ENTRY_OVERHEAD = 12
+
+
+class FilterWorkload:
+    """Usage of the fields in the filters of queries
+
+    Conditions are recorded by QueryBuilder for each executed query, with
+    the time of the query (See record_filter_workload()); they are kept in
+    memory until they are saved in the table "filter_workload"
+    (See save_filter_workload()) because connections of queries may be
+    read-only.
+
+    Attributes:
+        usages (dict): {(table, field, operator): [count, total time, last filter]}
+    """
+
+    def __init__(self):
+        self.usages = dict()
+
+    def add(self, table, field, operator, condition, elapsed):
+        """Record a condition of a query which took "elapsed" seconds"""
+        usage = self.usages.setdefault((table, field, operator), [0, 0.0, None])
+        usage[0] += 1
+        usage[1] += elapsed
+        usage[2] = condition
+
+    def clear(self):
+        self.usages.clear()
+
+    def __len__(self):
+        return len(self.usages)
+
+
+def create_table_filter_workload(conn):
+    """Create the table "filter_workload" if it doesn't exist
+
+    Usage of the fields in filters (See FilterWorkload):
+        - table_name, field, operator: a field is recorded once per operator;
+        - count: number of queries;
+        - total_time: total time of these queries in seconds;
+        - last_filter: last condition on the field, as JSON; it is used to
+          measure the speedup given by an index (See apply_index_advice()).
+    """
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS filter_workload (
+        table_name TEXT NOT NULL, field TEXT NOT NULL, operator TEXT NOT NULL,
+        count INTEGER NOT NULL, total_time REAL NOT NULL, last_filter TEXT,
+        PRIMARY KEY (table_name, field, operator)
+        )"""
+    )
+    conn.commit()
+
+
+def record_filter_workload(conn, builder, filters, elapsed):
+    """Record the conditions of the filters of a query in the workload of the connection
+
+    Conditions on genotypes read from the genotype matrix can't use indexes;
+    they are not recorded.
+
+    :param conn: Connection; nothing is recorded for other sqlite3 connections
+    :param builder: QueryBuilder which executed the query
+    :param filters: Filters of the query (See QueryBuilder)
+    :param elapsed: Time of the query in seconds
+    """
+    workload = getattr(conn, "filter_workload", None)
+    if workload is None:
+        return
+
+    for condition in QueryBuilder._filters_to_flat(filters):
+        field = condition["field"]
+        if isinstance(field, tuple):
+            _, sample_name, field_name = field
+            if builder._in_genotype_matrix(sample_name, field_name):
+                continue
+            table = "sample_has_variant"
+        else:
+            table = builder.get_table_of_column(field)
+            field_name = field.split(".")[-1]
+            if table is None or field_name == "id":
+                continue
+        workload.add(table, field_name, str(condition["operator"]).upper(), condition, elapsed)
+
+
+def save_filter_workload(conn, workload=None):
+    """Add the given workload to the table "filter_workload" and clear it
+
+    :param conn: Writable connection
+    :key workload: FilterWorkload; by default the workload of the connection.
+        The workload of a read-only connection can be saved with another
+        connection to the same database.
+    """
+    if workload is None:
+        workload = getattr(conn, "filter_workload", None)
+    if not workload:
+        return
+
+    create_table_filter_workload(conn)
+    for (table, field, operator), (count, total_time, condition) in workload.usages.items():
+        last_filter = json.dumps(condition, default=str)
+        conn.execute(
+            """INSERT OR IGNORE INTO filter_workload VALUES (?, ?, ?, 0, 0.0, ?)""",
+            (table, field, operator, last_filter),
+        )
+        conn.execute(
+            """UPDATE filter_workload
+            SET count = count + ?, total_time = total_time + ?, last_filter = ?
+            WHERE table_name = ? AND field = ? AND operator = ?""",
+            (count, total_time, last_filter, table, field, operator),
+        )
+    conn.commit()
+    workload.clear()
+
+
+def get_filter_workload(conn):
+    """Return the usage of fields saved in the table "filter_workload"
+
+    :return: Dictionnaries with the columns of the table; last_filter is
+        decoded and the fields of genotypes are tuples again.
+    :rtype: <list <dict>>
+    """
+    if not get_schema_catalog(conn).has_table("filter_workload"):
+        return []
+
+    cursor = conn.cursor()
+    cursor.row_factory = sqlite3.Row
+    usages = []
+    for record in cursor.execute(
+        "SELECT * FROM filter_workload ORDER BY count DESC, total_time DESC"
+    ):
+        usage = dict(record)
+        condition = json.loads(usage["last_filter"]) if usage["last_filter"] else None
+        if condition and isinstance(condition["field"], list):
+            condition["field"] = tuple(condition["field"])
+        usage["last_filter"] = condition
+        usages.append(usage)
+    return usages
+
+
+def get_advisor_indexes(conn):
+    """Return the indexes created by the advisor
+
+    :return: {index name: (table, field)}
+    :rtype: <dict>
+    """
+    indexes = dict()
+    for name, table in conn.execute(
+        "SELECT name, tbl_name FROM sqlite_master WHERE type = 'index' AND name GLOB ?",
+        (INDEX_ADVISOR_PREFIX + "*",),
+    ):
+        # Indexed columns: prefix columns of the table then the field
+        columns = [info[2] for info in conn.execute(f"PRAGMA index_info(`{name}`)")]
+        indexes[name] = (table, columns[-1])
+    return indexes
+
+
+def _is_indexed(conn, table, columns):
+    """Return True if an index of the table starts with the given columns
+
+    Indexes of primary keys and unique constraints are taken into account;
+    partial indexes are not (they can't be used by every filter).
+    """
+    # Columns of index_list: seq, name, unique, origin ("c", "u", "pk"), partial
+    for index in conn.execute(f"PRAGMA index_list(`{table}`)"):
+        if index[4]:
+            continue
+        index_columns = [info[2] for info in conn.execute(f"PRAGMA index_info(`{index[1]}`)")]
+        if index_columns[: len(columns)] == list(columns):
+            return True
+    return False
+
+
+def _estimate_index(conn, table, field):
+    """Return the number of rows and the estimated size of an index on a field
+
+    Field statistics are used when they exist (See compute_field_stats());
+    the size of keys is measured on the first rows of the table.
+
+    :return: (rows, indexed rows, estimated size in bytes)
+    """
+    category = {v[0]: k for k, v in FIELD_STATS_TABLES.items()}.get(table)
+    stats = get_field_stats(conn, field, category) if category else None
+    if stats:
+        row_count = stats["row_count"]
+        # Missing values include empty strings
+        indexed_count = row_count - stats["null_count"]
+    else:
+        row_count = conn.execute(f"SELECT COUNT(*) FROM `{table}`").fetchone()[0]
+        indexed_count = row_count
+
+    columns = INDEX_ADVISOR_TABLES[table] + (field,)
+    key_size = " + ".join(f"IFNULL(LENGTH(CAST(`{column}` AS BLOB)), 1)" for column in columns)
+    average = conn.execute(
+        f"SELECT AVG({key_size}) FROM (SELECT * FROM `{table}` LIMIT 10000)"
+    ).fetchone()[0]
+    size = int(indexed_count * ((average or 0) + INDEX_ADVISOR_ENTRY_OVERHEAD))
+    return row_count, indexed_count, size
+
+
+def advise_indexes(conn, min_count=3, min_time=0.0):
+    """Advise indexes from the workload of filters
+
+    Secondary indexes are advised for fields often filtered with operators
+    able to use indexes (See INDEX_ADVISOR_OPERATORS) and not yet indexed;
+    indexes of fields with many missing values are partial
+    (See INDEX_ADVISOR_PARTIAL_RATIO). The indexes of the advisor which are
+    no longer used enough are advised to be dropped.
+
+    .. note:: The workload of the connection is saved before
+        (See save_filter_workload()).
+
+    :key min_count: Minimum number of queries using a field
+    :key min_time: Minimum average time of these queries in seconds
+    :return: Advice as dictionnaries:
+        - action: "create" or "drop"
+        - name, table, columns, where: index and its partial condition
+        - count, mean_time: usage of the field
+        - rows, estimated_size: indexed rows and size in bytes of the index
+        - last_filter: condition used to measure the speedup
+    :rtype: <list <dict>>
+    """
+    save_filter_workload(conn)
+
+    # Usage of fields with all their indexable operators
+    usages = dict()
+    for usage in get_filter_workload(conn):
+        if usage["operator"] not in INDEX_ADVISOR_OPERATORS:
+            continue
+        key = (usage["table_name"], usage["field"])
+        if key not in usages:
+            usages[key] = dict(usage, total_time=0.0, count=0)
+        usages[key]["count"] += usage["count"]
+        usages[key]["total_time"] += usage["total_time"]
+
+    catalog = get_schema_catalog(conn)
+    advisor_indexes = get_advisor_indexes(conn)
+    advice = []
+    for (table, field), usage in usages.items():
+        name = f"{INDEX_ADVISOR_PREFIX}{table}_{field}"
+        mean_time = usage["total_time"] / usage["count"]
+        if (
+            table not in INDEX_ADVISOR_TABLES
+            or field not in catalog.get_columns(table)
+            or name in advisor_indexes
+            or usage["count"] < min_count
+            or mean_time < min_time
+        ):
+            continue
+
+        columns = INDEX_ADVISOR_TABLES[table] + (field,)
+        if _is_indexed(conn, table, columns):
+            continue
+
+        row_count, indexed_count, size = _estimate_index(conn, table, field)
+        partial = row_count and (row_count - indexed_count) / row_count > INDEX_ADVISOR_PARTIAL_RATIO
+        advice.append(
+            {
+                "action": "create",
+                "name": name,
+                "table": table,
+                "columns": columns,
+                "where": f"`{field}` IS NOT NULL" if partial else None,
+                "count": usage["count"],
+                "mean_time": mean_time,
+                "rows": indexed_count if partial else row_count,
+                "estimated_size": size if partial else int(
+                    size * row_count / max(1, indexed_count)
+                ),
+                "last_filter": usage["last_filter"],
+            }
+        )
+
+    # Unused indexes of the advisor
+    for name, (table, field) in advisor_indexes.items():
+        usage = usages.get((table, field))
+        if usage and usage["count"] >= min_count:
+            continue
+        advice.append(
+            {
+                "action": "drop",
+                "name": name,
+                "table": table,
+                "columns": INDEX_ADVISOR_TABLES.get(table, ()) + (field,),
+                "where": None,
+                "count": usage["count"] if usage else 0,
+                "mean_time": usage["total_time"] / usage["count"] if usage else 0.0,
+                "rows": None,
+                "estimated_size": get_index_size(conn, name),
+                "last_filter": None,
+            }
+        )
+
+    # Most time consuming fields first
+    advice.sort(key=lambda item: item["count"] * item["mean_time"], reverse=True)
+    return advice
+
 
-    :param samples: List of samples names
-        .. todo:: only names in this list ?
-    :type samples: <list <str>>
-    """
-    cursor = conn.cursor()
-    cursor.executemany(
-        """INSERT INTO samples (name) VALUES (?)""", ((sample,) for sample in samples)
-    )
-    conn.commit()
+def get_index_size(conn, name):
+    """Return the size of an index in bytes, or None if it can't be measured
 
+    .. note:: The dbstat virtual table is not always compiled in SQLite.
+    """
+    try:
+        return conn.execute(
+            "SELECT SUM(pgsize) FROM dbstat WHERE name = ?", (name,)
+        ).fetchone()[0]
+    except sqlite3.OperationalError:
+        return None
 
-def get_samples(conn):
-    """"Get samples from sample table
 
-    :param con: sqlite3.conn
-    :return: Generator of dictionnaries with as sample fields as values.
-        :Example: ({'id': <unique_id>, 'name': <sample_name>})
+def _time_filter(conn, condition, repeat=3):
+    """Return the best time of a query counting the variants of a condition"""
+    builder = QueryBuilder(conn, filters={"AND": [condition]})
+    # Genotypes are read from "sample_has_variant", where indexes are
+    builder.use_genotype_matrix = False
+    builder.genotype_array = None
+    params = []
+    query = builder.count_sql(params=params)
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        conn.execute(query, params).fetchall()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def apply_index_advice(conn, advice, min_speedup=1.5):
+    """Create and drop the indexes of the given advice
+
+    The speedup of each created index is measured with the last condition
+    on its field (See get_filter_workload()); indexes which don't speed up
+    this query by min_speedup are dropped.
+
+    :param advice: Advice returned by advise_indexes()
+    :key min_speedup: Minimum speedup to keep an index
+    :return: Generator of the advice with the results:
+        - speedup: measured speedup (None if it can't be measured)
+        - size: measured size in bytes of the created index
+        - applied: True if the index has been created/dropped
     :rtype: <generator <dict>>
     """
-    conn.row_factory = sqlite3.Row
-    return (dict(data) for data in conn.execute("""SELECT * FROM samples"""))
+    for item in advice:
+        item = dict(item)
+        name = item["name"]
+        if item["action"] == "drop":
+            conn.execute(f"DROP INDEX IF EXISTS `{name}`")
+            conn.commit()
+            item.update(speedup=None, size=None, applied=True)
+            LOGGER.info("apply_index_advice:: %s dropped", name)
+            yield item
+            continue
+
+        condition = item["last_filter"]
+        before = _time_filter(conn, condition) if condition else None
+        columns = ", ".join(f"`{column}`" for column in item["columns"])
+        where = f" WHERE {item['where']}" if item["where"] else ""
+        conn.execute(f"CREATE INDEX `{name}` ON `{item['table']}` ({columns}){where}")
+        conn.commit()
+        # Statistics used by the query planner to choose between indexes
+        conn.execute(f"ANALYZE `{name}`")
+        conn.commit()
+        after = _time_filter(conn, condition) if condition else None
+
+        speedup = before / after if before is not None and after else None
+        applied = speedup is None or speedup >= min_speedup
+        item.update(speedup=speedup, size=get_index_size(conn, name), applied=applied)
+        if not applied:
+            conn.execute(f"DROP INDEX `{name}`")
+            conn.commit()
+        LOGGER.info(
+            "apply_index_advice:: %s %s (speedup: %s)",
+            name,
+            "created" if applied else "rejected",
+            speedup,
+        )
+        yield item
+
+    invalidate_schema_catalog(conn)
+    bump_generation(conn)
 
 
 ## ============== VARIANTS QUERY THINGS ... ======================
@@ -1044,6 +4322,12 @@ def __init__(
         self.selection = selection
         self.order_by = order_by
         self.order_desc = order_desc
+        # Use keyset pagination in items() and trees() when it's possible
+        self.keyset_pagination = True
+        # Read genotypes from the genotype matrix when it's possible
+        self.use_genotype_matrix = True
+        # Store of saved selections (See SELECTION_STORES)
+        self.selection_store = DEFAULT_SELECTION_STORE
 
     @property
     def conn(self):
@@ -1052,12 +4336,39 @@ def conn(self):
     @conn.setter
     def conn(self, conn):
         self._conn = conn
-        # Read those data only once from sqliute
-        self.cache_annotations_columns = get_columns(conn, "annotations")
-        self.cache_variants_columns = get_columns(conn, "variants")
+        # Anchors of pages for keyset pagination: {page: (order value, id)}
+        self._page_anchors = dict()
+        self._page_anchors_key = None
+        # Read those data only once per connection (See SchemaCatalog)
+        catalog = get_schema_catalog(conn)
+        self.cache_annotations_columns = catalog.get_columns("annotations")
+        self.cache_variants_columns = catalog.get_columns("variants")
+        self.cache_has_annotations_summary = catalog.has_table("annotations_summary")
 
         #  Read samples and make possible to map the sample id from the sample name
-        self.cache_samples_ids = dict([(i["name"], i["id"]) for i in get_samples(conn)])
+        self.cache_samples_ids = catalog.samples_ids
+
+        # Fields of the genotype matrix and indexes of samples in it
+        # (samples are ordered by id, See get_genotype_matrix_samples())
+        self.cache_genotype_matrix_fields = [
+            column
+            for column in catalog.get_columns("genotype_matrix")
+            if column != "variant_id"
+        ]
+        self.cache_genotype_matrix_indexes = dict()
+        if self.cache_genotype_matrix_fields:
+            register_genotype_functions(conn)
+            self.cache_genotype_matrix_indexes = {
+                name: index for index, name in enumerate(catalog.samples)
+            }
+
+        # NumPy array of genotypes used to evaluate genotype filters
+        # (None if it's not available) and temporary tables of the variants
+        # they select: {filters: table name}
+        from cutevariant.core.genotypes import GenotypeArray
+
+        self.genotype_array = GenotypeArray.open(conn)
+        self._genotype_filter_tables = dict()
 
     @staticmethod
     def _filters_to_flat(filters: dict):
@@ -1094,11 +4405,15 @@ def _filters_to_flat(filters: dict):
             for i in filters:
                 yield from QueryBuilder._filters_to_flat(i)
 
-    def _filters_to_sql(self, node: dict, format_sql = True):
+    def _filters_to_sql(self, node: dict, format_sql = True, params = None):
         """Recursive function to convert the filter hierarchical dictionnary into a SQL WHERE clause.
         
         Args:
             filters (dict): a nested tree of condition. @See example
+            params (list, optional): If a list is given, values are replaced
+                by "?" placeholders and appended to it (in the order of the
+                clause); IN operators take tuples or lists of values
+                (raw strings are inserted as they are). Defaults to None.
 
         Returns:
             Return (str): a Sql Where clause
@@ -1120,13 +4435,17 @@ def _filters_to_sql(self, node: dict, format_sql = True):
             operator = node["operator"]
             field = node["field"]
 
+            if format_sql:
+                # Format for SQL 
+                field = self.column_to_sql(field, use_alias=False)
+
+            if params is not None:
+                value = self._value_to_sql(value, params, operator)
+                return "%s %s %s" % (field, operator, value)
+
             if type(value) == str:
                 value = f"'{value}'"
 
-            if format_sql:
-                # Format for SQL 
-                field = self.column_to_sql(field, use_alias=False)
-        
             # TODO ... c'est degeulasse ....
             if operator in ("IN", "NOT IN"):
                 # DO NOT enclose value in quotes
@@ -1152,7 +4471,7 @@ def _filters_to_sql(self, node: dict, format_sql = True):
             #   {'field': 'alt', 'operator': 'IN', 'value': "('A', 'T', 'G', 'C')"}
             # ]}
             # Wanted: ref IN ('A', 'T', 'G', 'C') AND alt IN ('A', 'T', 'G', 'C')
-            out = [self._filters_to_sql(child, format_sql) for child in node[logic_op]]
+            out = [self._filters_to_sql(child, format_sql, params) for child in node[logic_op]]
             # print("OUT", out, "LOGIC", logic_op)
             # OUT ["refIN'('A', 'T', 'G', 'C')'", "altIN'('A', 'T', 'G', 'C')'"]
             if len(out) == 1:
@@ -1188,10 +4507,19 @@ def column_to_sql(self, column, use_alias=True):
         if isinstance(column, tuple):
             function_name, arg, field_name = column
             if function_name == QueryBuilder._GENOTYPE_FUNCTION_NAME:
+                if self._in_genotype_matrix(arg, field_name):
+                    typecode = GENOTYPE_MATRIX_FIELDS[field_name]
+                    index = self.cache_genotype_matrix_indexes[arg]
+                    field = (
+                        f"{GENOTYPE_MATRIX_SQL_FUNCTIONS[typecode]}"
+                        f"(`genotype_matrix`.`{field_name}`, {index})"
+                    )
+                else:
+                    field = f"`gt_{arg}`.`{field_name}`"
                 if use_alias:
-                    return f"`gt_{arg}`.`{field_name}` AS `gt_{arg}.{field_name}`"
+                    return f"{field} AS `gt_{arg}.{field_name}`"
                 else:
-                    return f"`gt_{arg}`.`{field_name}`"
+                    return field
 
 
         if column.startswith("annotations.") or column in self.cache_annotations_columns:
@@ -1204,6 +4532,143 @@ def column_to_sql(self, column, use_alias=True):
 
         return column
 
+    def _in_genotype_matrix(self, sample_name, field_name):
+        """Return True if the field of the sample is read from the genotype matrix"""
+        return (
+            self.use_genotype_matrix
+            and field_name in self.cache_genotype_matrix_fields
+            and sample_name in self.cache_genotype_matrix_indexes
+        )
+
+    def _samples_to_sql(self, columns):
+        """Return the SQL joins needed by the genotypes of the given columns
+
+        Genotypes stored in the genotype matrix need one join on the table
+        "genotype_matrix" for all samples; other genotypes need one join
+        on "sample_has_variant" per sample.
+
+        Args:
+            columns (list): Columns of the query and of its filters
+
+        Returns:
+            str: SQL joins
+        """
+        sql_query = ""
+        genotypes = set(self._get_functions(columns))
+        if any(self._in_genotype_matrix(arg, field) for _, arg, field in genotypes):
+            sql_query += (
+                " LEFT JOIN genotype_matrix ON genotype_matrix.variant_id = variants.id"
+            )
+
+        samples_in_query = sorted(
+            set(arg for _, arg, field in genotypes if not self._in_genotype_matrix(arg, field))
+        )
+        for sample_name in samples_in_query:
+            sample_id = self.cache_samples_ids[sample_name]
+            sql_query += (
+                f" LEFT JOIN sample_has_variant `gt_{sample_name}`"
+                f" ON `gt_{sample_name}`.variant_id = variants.id"
+                f" AND `gt_{sample_name}`.sample_id = {sample_id}"
+            )
+        return sql_query
+
+    def _push_genotype_filters(self, filters, materialize=False):
+        """Replace filters on genotypes by a selection of variants made with NumPy
+
+        Conditions on genotypes supported by the genotype array (See
+        genotypes.GenotypeArray.is_supported()) are evaluated on it; the
+        variants they select are stored in a temporary table and the
+        conditions are replaced by a condition on the ids of variants.
+        Filters are returned as they are if there is no genotype array.
+
+        Building SQL has no side effect: conditions whose table has not been
+        created yet are kept as they are (SQL joins); tables are created
+        before the execution of queries (See _materialize_genotype_filters()).
+
+        Args:
+            filters (dict): Filters (See _filters_to_sql())
+            materialize (bool): Create the missing temporary tables
+
+        Returns:
+            dict: Filters without SQL joins for the supported conditions
+        """
+        if self.genotype_array is None or not filters:
+            return filters
+
+        if self.genotype_array.is_supported(filters):
+            condition = self._genotype_filter_to_ids(filters, materialize)
+            return filters if condition is None else {"AND": [condition]}
+
+        if len(filters) != 1:
+            return filters
+
+        logic_op, children = next(iter(filters.items()))
+        if not isinstance(children, list):
+            return filters
+
+        supported = [child for child in children if self.genotype_array.is_supported(child)]
+        children = [
+            self._push_genotype_filters(child, materialize)
+            for child in children
+            if not self.genotype_array.is_supported(child)
+        ]
+        if supported:
+            condition = self._genotype_filter_to_ids({logic_op: supported}, materialize)
+            if condition is None:
+                children.extend(supported)
+            else:
+                children.append(condition)
+        return {logic_op: children}
+
+    def _materialize_genotype_filters(self):
+        """Create the temporary tables of the genotype filters of the query
+
+        Called before the execution of queries of the current filters.
+        """
+        self._push_genotype_filters(self.filters, materialize=True)
+
+    def _genotype_filter_to_ids(self, filters, materialize=False):
+        """Return a condition on the ids of the variants selected by the given
+        genotype filters; they are stored in a temporary table
+
+        Tables are named from the filters and the genotype array, so they are
+        reused by all queries of the connection.
+
+        Returns:
+            dict: The condition, or None if the table doesn't exist and
+            materialize is False
+        """
+        key = repr((self.genotype_array.filepath, self.genotype_array.mtime, filters))
+        table = self._genotype_filter_tables.get(key)
+        if table is None:
+            table = "genotype_filter_" + hashlib.sha1(key.encode()).hexdigest()[:16]
+            exists = self.conn.execute(
+                "SELECT 1 FROM sqlite_temp_master WHERE type = 'table' AND name = ?",
+                (table,),
+            ).fetchone()
+            if not exists:
+                if not materialize:
+                    return None
+                # Only the transaction opened by the insertions is committed:
+                # it would keep the snapshot of the database for next reads
+                in_transaction = self.conn.in_transaction
+                self.conn.execute(
+                    f"CREATE TEMP TABLE `{table}` (variant_id INTEGER PRIMARY KEY)"
+                )
+                self.conn.executemany(
+                    f"INSERT INTO temp.`{table}` (variant_id) VALUES (?)",
+                    ((variant_id,) for variant_id in self.genotype_array.select(filters)),
+                )
+                if not in_transaction:
+                    self.conn.commit()
+            self._genotype_filter_tables[key] = table
+
+        return {
+            "field": "variants.id",
+            "operator": "IN",
+            "value": f"(SELECT variant_id FROM temp.`{table}`)",
+        }
+
     def get_table_of_column(self, column):
         """Return table's name of a specific column
         
@@ -1224,6 +4689,201 @@ def get_table_of_column(self, column):
 
         return None
 
+    @staticmethod
+    def _value_to_sql(value, params, operator="="):
+        """Return the SQL placeholder(s) of a value and append it to params
+
+        Tuples and lists (IN operators) give a list of placeholders;
+        strings given to IN operators are SQL lists and are kept as they are.
+        """
+        if isinstance(value, (tuple, list)):
+            params.extend(value)
+            return "(" + ",".join("?" * len(value)) + ")"
+        if isinstance(value, str) and operator in ("IN", "NOT IN"):
+            return value
+        params.append(value)
+        return "?"
+
+    @staticmethod
+    def _sql_literal(value):
+        """Return the SQL literal of a parameter value (See _value_to_sql())"""
+        if value is None:
+            return "NULL"
+        if isinstance(value, str):
+            return "'" + value.replace("'", "''") + "'"
+        if isinstance(value, bytes):
+            return f"X'{value.hex()}'"
+        # bool is a subclass of int
+        return repr(value if isinstance(value, float) else int(value))
+
+    def _execute(self, query, params):
+        """Execute a query of the current filters and record them with its time
+
+        Args:
+            query (str): SQL query
+            params (list): Parameters of the query
+
+        Returns:
+            list: Rows of the query (See cached_query())
+        """
+        start = time.perf_counter()
+        rows = cached_query(self.conn, query, params)
+        record_filter_workload(self.conn, self, self.filters, time.perf_counter() - start)
+        return rows
+
+    def _use_annotations_summary(self, grouped, filters):
+        """Return True if grouped rows are read from "annotations_summary"
+
+        Variants are grouped without GROUP BY: each variant is joined to its
+        number of annotations and to the annotation with the worst impact.
+        This is not possible if annotations are filtered (the displayed
+        annotation and the count depend on the filters).
+
+        .. seealso:: create_annotations_summary()
+        """
+        return (
+            grouped
+            and self.cache_has_annotations_summary
+            and not self._need_join_annotations([], filters)
+        )
+
+    def _need_join_annotations(self, columns, filters):
+        """Return True if annotations table is required by the given columns or filters"""
+        columns_in_filters = [i["field"] for i in self._filters_to_flat(filters)]
+        return any(
+            self.get_table_of_column(col) == "annotations"
+            for col in columns + columns_in_filters
+        )
+
+    def _seek_to_sql(self, order_by, order_desc, seek, params=None):
+        """Return the WHERE condition selecting rows after the given anchor
+
+        Rows are ordered by (order_by, variants.id); NULL values of order_by
+        come first in ascending order and last in descending order (SQLite
+        behavior), they can't be compared with a row value.
+
+        Args:
+            order_by (str or tuple): Column used in ORDER BY statement
+            order_desc (bool): Descendant order
+            seek (tuple): (order_by value, variant id) of the last row of
+                the previous page
+            params (list, optional): If a list is given, values are replaced
+                by "?" placeholders and appended to it. Defaults to None.
+
+        Returns:
+            str: A SQL condition
+        """
+        value, variant_id = seek
+        column = self.column_to_sql(order_by, use_alias=False)
+        operator = "<" if order_desc else ">"
+        # Values are always given as parameters, then inlined if params is None
+        seek_params = []
+
+        if column == "`variants`.`id`":
+            variant_id = self._value_to_sql(int(variant_id), seek_params)
+            condition = f"`variants`.`id` {operator} {variant_id}"
+
+        elif value is None:
+            variant_id = self._value_to_sql(int(variant_id), seek_params)
+            # Next rows are NULL with a greater id (or less in descendant order)
+            condition = f"({column} IS NULL AND `variants`.`id` {operator} {variant_id})"
+            if not order_desc:
+                # Non NULL values come after NULL values
+                condition = f"({condition} OR {column} IS NOT NULL)"
+
+        else:
+            # The value comes before the id in the condition
+            value = self._value_to_sql(value, seek_params)
+            variant_id = self._value_to_sql(int(variant_id), seek_params)
+            condition = f"({column},`variants`.`id`) {operator} ({value},{variant_id})"
+            if order_desc:
+                # NULL values come after non NULL values
+                condition = f"({condition} OR {column} IS NULL)"
+
+        if params is not None:
+            params.extend(seek_params)
+            return condition
+        # Placeholders are the only "?" of the condition (quoted column names)
+        parts = condition.split("?")
+        return parts[0] + "".join(
+            self._sql_literal(seek_param) + part
+            for seek_param, part in zip(seek_params, parts[1:])
+        )
+
+    def _paginate(self, grouped, limit, offset):
+        """Get the parameters to query the page starting at the given offset
+
+        Keyset pagination is used when the anchor (order_by value, id) of the
+        last row of the previous page is known: SQLite seeks directly to the
+        page instead of computing and discarding the previous rows.
+        If it is unknown, the closest previous anchor is used, with an
+        offset for the remaining rows.
+
+        Keyset pagination is not possible if a variant can be on several
+        rows (annotations without grouping) or if order_by is not a
+        displayed column (its value must be read in the rows).
+
+        Returns:
+            tuple: (order_by, order_desc, seek, offset, anchor_index);
+            anchor_index is the index of order_by value in a row or None
+            if keyset pagination is not used.
+        """
+        order_by, order_desc = self.order_by, self.order_desc
+
+        if (
+            not self.keyset_pagination
+            or not limit
+            or offset % limit
+            or (order_by is not None and order_by not in self.columns)
+        ):
+            return order_by, order_desc, None, offset, None
+
+        if grouped:
+            if (
+                order_by is not None
+                and self.get_table_of_column(order_by) == "annotations"
+                and not self._use_annotations_summary(grouped, self.filters)
+            ):
+                # The annotation of a group is arbitrary
+                return order_by, order_desc, None, offset, None
+        elif self._need_join_annotations(self.columns, self.filters):
+            return order_by, order_desc, None, offset, None
+
+        if order_by is None:
+            # Order by id to get stable pages; the column is qualified
+            # because selections are joined
+            order_by, order_desc, anchor_index = "variants.id", False, 0
+        else:
+            anchor_index = self.columns.index(order_by) + 1
+
+        # Forget the anchors of the previous query
+        key = (
+            repr(self.columns),
+            repr(self.filters),
+            self.selection,
+            order_by,
+            order_desc,
+            grouped,
+            limit,
+        )
+        if key != self._page_anchors_key:
+            self._page_anchors = dict()
+            self._page_anchors_key = key
+
+        page = offset // limit
+        # Closest known previous page
+        anchor_page = max((i for i in self._page_anchors if i <= page), default=0)
+        seek = self._page_anchors.get(anchor_page)
+        return order_by, order_desc, seek, (page - anchor_page) * limit, anchor_index
+
+    def _save_page_anchor(self, limit, offset, rows, anchor_index):
+        """Remember the anchor of the page following the given rows"""
+        if anchor_index is not None and len(rows) == limit:
+            last_row = rows[-1]
+            self._page_anchors[offset // limit + 1] = (
+                last_row[anchor_index],
+                last_row[0],
+            )
 
     def headers(self):
         """ Return a clean list of columns 
@@ -1252,6 +4912,8 @@ def build_sql(
         grouped = False,
         limit=20,
         offset=0,
+        seek=None,
+        params=None,
     ):
         """Build a SQL Select statement from internal parameters columns, filters, selections.
         see items() and tree() methods
@@ -1265,11 +4927,20 @@ def build_sql(
             group_by (list, optional): List of columns to group. Defaults to None.
             limit (int, optional): LIMIT SQL statement for record per page. Defaults to 20.
             offset (int, optional): OFFSET SQL statement for page number. Defaults to 0.
+            seek (tuple, optional): Keyset pagination: (order_by value, variant id)
+                of the last row of the previous page; rows are taken after it.
+                Defaults to None.
+            params (list, optional): Parameterized query: if a list is given,
+                values (filters, selection, pagination) are replaced by "?"
+                placeholders and appended to it, so that SQLite can reuse the
+                prepared statement. Defaults to None.
         
         Returns:
             [type]: [description]
         """
 
+        filters = self._push_genotype_filters(filters)
+
         #  Build Select statement
         sql_query = ""
 
@@ -1277,24 +4948,33 @@ def build_sql(
         sql_columns = ["`variants`.`id`"] + [self.column_to_sql(col) for col in columns]
         sql_query = f"SELECT {','.join(sql_columns)} "
 
-        # Add child count if grouped 
-        if grouped:
+        need_join_annotations = self._need_join_annotations(columns, filters)
+        use_annotations_summary = need_join_annotations and self._use_annotations_summary(
+            grouped, filters
+        )
+        # Without annotations, there is one row per variant
+        need_group_by = grouped and need_join_annotations and not use_annotations_summary
+
+        # Add child count if grouped 
+        if use_annotations_summary:
+            sql_query += ", IFNULL(`annotations_summary`.`annotation_count`, 1) as `children`"
+        elif need_group_by:
             sql_query += ", COUNT(*) as `children`"
+        elif grouped:
+            sql_query += ", 1 as `children`"
 
-        #  Add source table
+        #  Add source table
         sql_query += f"FROM variants"
 
-        #  Add Join Annotations
+        #  Add Join Annotations
         columns_in_filters = [i["field"] for i in self._filters_to_flat(filters)]
-        
-        # Loop over columns and check is annotations is required 
-        need_join_annotations = False
-        for col in columns + columns_in_filters:
-            if self.get_table_of_column(col) == "annotations":
-                need_join_annotations = True
-                break
 
-        if need_join_annotations:
+        if use_annotations_summary:
+            sql_query += (
+                " LEFT JOIN annotations_summary ON annotations_summary.variant_id = variants.id"
+                " LEFT JOIN annotations ON annotations.rowid = annotations_summary.annotation_id"
+            )
+        elif need_join_annotations:
             sql_query += (
                 " LEFT JOIN annotations ON annotations.variant_id = variants.id"
             )
@@ -1302,43 +4982,48 @@ def build_sql(
         #  Add Join Selection
         # TODO: set variants as global variables
         if selection != "variants":
-            sql_query += (
-                " INNER JOIN selection_has_variant sv ON sv.variant_id = variants.id "
-                f"INNER JOIN selections s ON s.id = sv.selection_id AND s.name = '{selection}'"
+            selection_name = (
+                f"'{selection}'" if params is None else self._value_to_sql(selection, params)
             )
+            sql_query += selection_join_sql(self.conn, selection, selection_name)
 
-        #  Add Join Samples
+        #  Add Join Samples
         ## detect if columns contains function like (genotype,TUMOR,gt)
         all_columns = columns_in_filters + columns
-        samples_in_query = set([fct[1] for fct in self._get_functions(all_columns)])
-        ## Create Sample Join
-        for sample_name in samples_in_query:
-            sample_id = self.cache_samples_ids[sample_name]
-            sql_query += (
-                f" LEFT JOIN sample_has_variant `gt_{sample_name}`"
-                f" ON `gt_{sample_name}`.variant_id = variants.id"
-                f" AND `gt_{sample_name}`.sample_id = {sample_id}"
-            )
+        sql_query += self._samples_to_sql(all_columns)
 
         #  Add Where Clause
+        where_clauses = []
         if filters:
-            where_clause = self._filters_to_sql(filters)
+            where_clause = self._filters_to_sql(filters, params=params)
             # TODO : filter_to_sql should returns empty instead of ()
             if where_clause and where_clause != "()":
-                sql_query += " WHERE " + where_clause
+                where_clauses.append(where_clause)
 
-        #  Add Group By
-        if grouped:
+        if seek is not None and order_by:
+            where_clauses.append(self._seek_to_sql(order_by, order_desc, seek, params))
+
+        if where_clauses:
+            sql_query += " WHERE " + " AND ".join(where_clauses)
+
+        #  Add Group By
+        if need_group_by:
             sql_query += " GROUP BY " + ",".join(["chr","pos","ref","alt"])
 
         #  Add Order By
         if order_by:
             # TODO : sqlite escape field with quote
             orientation = "DESC" if order_desc else "ASC"
-            order_by = self.column_to_sql(order_by)
-            sql_query += f" ORDER BY {order_by} {orientation}"
-
-        if limit:
+            order_column = self.column_to_sql(order_by, use_alias=False)
+            sql_query += f" ORDER BY {order_column} {orientation}"
+            if order_column != "`variants`.`id`":
+                # Variant id breaks ties: pages must be stable for keyset pagination
+                sql_query += f",`variants`.`id` {orientation}"
+
+        if limit and params is not None:
+            sql_query += " LIMIT ? OFFSET ?"
+            params.extend((limit, offset))
+        elif limit:
             sql_query += f" LIMIT {limit} OFFSET {offset}"
 
         return sql_query
@@ -1411,10 +5096,29 @@ def items(self, limit=20, offset=0):
 
         """
         self.conn.row_factory = sqlite3.Row
-        sql = self.sql(limit, offset)
-        LOGGER.debug(sql)
+        self._materialize_genotype_filters()
+        order_by, order_desc, seek, page_offset, anchor_index = self._paginate(
+            False, limit, offset
+        )
+        params = []
+        sql = self.build_sql(
+            self.columns,
+            self.filters,
+            self.selection,
+            order_by,
+            order_desc,
+            False,
+            limit,
+            page_offset,
+            seek,
+            params,
+        )
+        LOGGER.debug("%s %s", sql, params)
 
-        for variant in self.conn.execute(sql):
+        variants = self._execute(sql, params)
+        self._save_page_anchor(limit, offset, variants, anchor_index)
+
+        for variant in variants:
             yield list(dict(variant).values())
 
     def trees(self, grouped = True, limit=20, offset=0):
@@ -1449,20 +5153,27 @@ def trees(self, grouped = True, limit=20, offset=0):
 
         """
         self.conn.row_factory = sqlite3.Row
-    
-        
+        self._materialize_genotype_filters()
+        order_by, order_desc, seek, page_offset, anchor_index = self._paginate(
+            grouped, limit, offset
+        )
+
+        params = []
         query = self.build_sql(
             self.columns, 
             self.filters, 
             self.selection,
-            self.order_by, 
-            self.order_desc,
-            grouped, # Grouped 
-            limit, offset)
+            order_by, 
+            order_desc,
+            grouped, # Grouped 
+            limit, page_offset, seek, params)
+
+        LOGGER.debug("%s %s", query, params)
 
-        LOGGER.debug(query)
+        variants = self._execute(query, params)
+        self._save_page_anchor(limit, offset, variants, anchor_index)
 
-        for variant in self.conn.execute(query):
+        for variant in variants:
             if grouped:
             # Return child count, rows with last ( which is children)
                 yield variant["children"], list(dict(variant).values())[:-1]
@@ -1480,61 +5191,251 @@ def trees(self, grouped = True, limit=20, offset=0):
             #yield items
             
     def children(self, variant_id):
-        """ Return children annotations """ 
+        """ Return children annotations 
+
+        .. seealso:: children_many()
+        """ 
+        yield from self.children_many([variant_id]).get(variant_id, [])
+
+    def children_many(self, variant_ids):
+        """Return children annotations of several variants in one query
+
+        For each variant, the annotation displayed by the parent row in
+        grouped views is the last child.
+
+        Args:
+            variant_ids (list): Ids of parent variants
+
+        Returns:
+            dict: Variant ids as keys, lists of children as values
+        """
+        variant_ids = tuple(int(variant_id) for variant_id in set(variant_ids))
+        if not variant_ids:
+            return dict()
 
         self.conn.row_factory = sqlite3.Row
-        ann_filter = {"AND": [{"field": "annotations.variant_id", "operator": "=", "value": variant_id}]}
-        sub_query = self.build_sql(self.columns,ann_filter,self.selection, limit = None)
-        for variant in self.conn.execute(sub_query):
-            yield list(dict(variant).values())
+        if len(variant_ids) == 1:
+            ann_filter = {"AND": [{"field": "annotations.variant_id", "operator": "=", "value": variant_ids[0]}]}
+        else:
+            ann_filter = {"AND": [{"field": "annotations.variant_id", "operator": "IN", "value": variant_ids}]}
+        params = []
+        sub_query = self.build_sql(self.columns,ann_filter,self.selection, limit = None, params = params)
+
+        if self.cache_has_annotations_summary:
+            # The annotation displayed by the parent must be the last one
+            sub_query += (
+                " ORDER BY annotations.variant_id,"
+                " annotations.rowid = (SELECT annotation_id FROM annotations_summary"
+                " WHERE annotations_summary.variant_id = annotations.variant_id),"
+                " annotations.rowid"
+            )
+        else:
+            sub_query += " ORDER BY annotations.variant_id, annotations.rowid"
+
+        children = dict()
+        for variant in cached_query(self.conn, sub_query, params):
+            children.setdefault(variant[0], []).append(list(dict(variant).values()))
+        return children
         
             
 
-    def count(self):
-        """Wrapped function with a memoizing callable that saves up to the
-        maxsize most recent calls.
+    def count_sql(self, grouped=False, id_ranges=None, params=None):
+        """Build a SQL query counting the rows of the current query
+
+        Only the joins required by the filters are made: sample joins never
+        change the number of rows (one row per variant and sample at most);
+        annotations are joined for filters, or for columns if
+        variants are not grouped (one row per annotation).
+
+        Args:
+            grouped (bool): Count variants instead of rows
+                (See trees() with grouped=True)
+            id_ranges (list, optional): Count only variants with ids in
+                these (first, last) ranges. Defaults to None.
+            params (list, optional): Parameterized query, See build_sql().
+                Defaults to None.
+
+        Returns:
+            str: A SQL query returning one row with the count
+        """
+        filters = self._push_genotype_filters(self.filters)
+        need_join_annotations = self._need_join_annotations([], filters)
+        if not grouped and not need_join_annotations:
+            # Annotations displayed in columns give one row per annotation
+            need_join_annotations = self._need_join_annotations(self.columns, [])
+
+        if grouped and need_join_annotations:
+            # Several annotations of a variant can match the filters
+            sql_query = "SELECT COUNT(DISTINCT `variants`.`id`) FROM variants"
+        else:
+            sql_query = "SELECT COUNT(*) FROM variants"
+
+        if need_join_annotations:
+            sql_query += " LEFT JOIN annotations ON annotations.variant_id = variants.id"
+
+        if self.selection != "variants":
+            selection_name = (
+                f"'{self.selection}'"
+                if params is None
+                else self._value_to_sql(self.selection, params)
+            )
+            sql_query += selection_join_sql(self.conn, self.selection, selection_name)
+
+        columns_in_filters = [i["field"] for i in self._filters_to_flat(filters)]
+        sql_query += self._samples_to_sql(columns_in_filters)
+
+        where_clauses = []
+        if filters:
+            where_clause = self._filters_to_sql(filters, params=params)
+            if where_clause and where_clause != "()":
+                where_clauses.append(where_clause)
+
+        if id_ranges:
+            if params is None:
+                ranges = [f"{int(first)} AND {int(last)}" for first, last in id_ranges]
+            else:
+                ranges = ["? AND ?"] * len(id_ranges)
+                for id_range in id_ranges:
+                    params.extend(id_range)
+            where_clauses.append(
+                "("
+                + " OR ".join(f"`variants`.`id` BETWEEN {ids}" for ids in ranges)
+                + ")"
+            )
+
+        if where_clauses:
+            sql_query += " WHERE " + " AND ".join(where_clauses)
+
+        return sql_query
+
+    def _fast_count(self, grouped):
+        """Return the count from statistics if the query has no filter
+
+        Returns:
+            int: The count or None if it can't be known without a query
+        """
+        if self.filters or (not grouped and self._need_join_annotations(self.columns, [])):
+            return None
+
+        # Trick to accelerate UI refresh on basic queries
+        if self.selection == "variants":
+            return self.conn.execute(
+                "SELECT MAX(variants.id) as count FROM variants"
+            ).fetchone()[0] or 0
+
+        # Count saved with the selection
+        record = self.conn.execute(
+            "SELECT count FROM selections WHERE name = ?", (self.selection,)
+        ).fetchone()
+        return record[0] if record else None
 
-        .. note:: The LRU feature performs best when maxsize is a power-of-two.
+    def count(self, grouped=False):
+        """Return the number of rows of the current query
 
         .. note:: The COUNT() aggregation function is expensive on partially
             indexed tables (because dynamically built) for large dataset
             and it seems difficult to predict which fields will be requested
             by the user.
+
+        .. seealso:: count_sql(), estimate_count()
+
+        Args:
+            grouped (bool): Count variants instead of rows
+                (See trees() with grouped=True)
         """
-        query = self.sql(limit = None)
+        count = self._fast_count(grouped)
+        if count is not None:
+            return count
 
-        # Trick to accelerate UI refresh on basic queries
-        if self.selection == "variants" and not self.filters:
-            return self.conn.execute(
-                "SELECT MAX(variants.id) as count FROM variants"
-            ).fetchone()[0]
+        self._materialize_genotype_filters()
+        params = []
+        query = self.count_sql(grouped, params=params)
+        return self._execute(query, params)[0][0]
 
-        return self.conn.execute(
-            f"SELECT COUNT(*) as count FROM ({query})"
-        ).fetchone()[0]
+    def estimate_count(self, grouped=False, sample_size=50000, blocks=50):
+        """Return a fast estimate of count()
+
+        Filters are evaluated on a sample of variants made of ranges of ids
+        spread over the table; the count is extrapolated from the matching
+        variants of the sample.
+
+        Args:
+            grouped (bool): Count variants instead of rows
+            sample_size (int): Number of variant ids in the sample
+            blocks (int): Number of ranges of ids in the sample
+
+        Returns:
+            tuple: (count, is_exact); the count is exact if it is known
+            without a query or if the sample contains all the variants.
+        """
+        count = self._fast_count(grouped)
+        if count is not None:
+            return count, True
+
+        # Subqueries: MIN() and MAX() are optimized only if they are alone
+        min_id, max_id = self.conn.execute(
+            "SELECT (SELECT MIN(id) FROM variants), (SELECT MAX(id) FROM variants)"
+        ).fetchone()
+        if max_id is None or max_id - min_id + 1 <= sample_size:
+            return self.count(grouped), True
+
+        id_count = max_id - min_id + 1
+        step = id_count // blocks
+        block_size = sample_size // blocks
+        id_ranges = [
+            (min_id + i * step, min_id + i * step + block_size - 1)
+            for i in range(blocks)
+        ]
+
+        self._materialize_genotype_filters()
+        params = []
+        query = self.count_sql(grouped, id_ranges, params)
+        count = cached_query(self.conn, query, params)[0][0]
+        return round(count * id_count / (block_size * blocks)), False
 
-    @lru_cache(maxsize=128)
     def cache_count(self):
-        """ Return lru_cache from self.count 
+        """ Return self.count; results are cached by the connection
+
+        .. seealso:: cached_query()
         """
         return self.count()
 
-    def save(self, name):
+    def save(self, name, store=None):
         """Save Variant Query into a new selection
 
         This methods will get all variant.id extracted from self.sql() 
-        and insert them into select_has_variant table 
+        and insert them into select_has_variant table, or into a bitmap
+        (See create_selection_from_ids())
 
         Args:
             name (str): Selection name
+            store (str, optional): "table" or "bitmap"; self.selection_store
+                by default.
 
         Return:
             sql index of selection
         """
 
+        self._materialize_genotype_filters()
         cursor = self.conn.cursor()
-        count = self.count() # Get count .. Can take a while 
+        if (store or self.selection_store) == "bitmap":
+            params = []
+            sql_query = self.build_sql(
+                columns=[], filters=self.filters, selection=self.selection, limit=None, params=params
+            )
+            cursor.row_factory = None
+            # The count is the number of ids: no COUNT() query
+            variant_ids = sorted({row[0] for row in cursor.execute(sql_query, params)})
+            sql_query = self.build_sql(
+                columns=[], filters=self.filters, selection=self.selection, limit=None
+            )
+            return create_selection_from_ids(
+                self.conn, name, variant_ids, query=sql_query, store="bitmap"
+            )
+
+        count = self.count(grouped=True) # Get count .. Can take a while 
 
+        # Query saved in the selection
         sql_query = self.build_sql(
             columns = [],
             filters = self.filters,
@@ -1546,6 +5447,15 @@ def save(self, name):
         # Create selection
         selection_id = insert_selection(cursor,sql_query, name=name, count=count)
 
+        # Same query with bound parameters
+        params = []
+        sql_query = self.build_sql(
+            columns = [],
+            filters = self.filters,
+            selection = self.selection,
+            limit = None,
+            params = params)
+
         # DROP indexes
         # For joints between selections and variants tables
         try:
@@ -1566,7 +5476,7 @@ def save(self, name):
 
         LOGGER.debug(q)
 
-        cursor.execute(q)
+        cursor.execute(q, params)
 
         # # REBUILD INDEXES
         # # For joints between selections and variants tables
@@ -1593,9 +5503,16 @@ class Selection:
     """Binding object over selection which allows to do set operations on variants
     associated to it
 
+    Set operations are evaluated in memory on bitsets of variant ids
+    (See get_selection_bitset()); the count of the result is known without
+    any query.
+
     Attributes:
         - cls.conn: Class attribute for sqlite3 connection.
-        - self.query: SQL query ready to be used in set operations.
+        - self.bitset: Variant ids as an integer: bit i is set if the
+          variant i is in the set.
+        - self.expression: VQL set expression which built the set
+          (See set_expression_to_vql()).
         - self.mode: Define the way variants are compared to each other.
             - "variant" (default): chr,pos,ref,alt = variant.id
             - "site": chr,pos
@@ -1605,36 +5522,72 @@ class Selection:
     # Class attribute, shared accross all instances
     conn = None
 
-    def __init__(self, sql_query=None, mode="variant"):
-        """Create a new selection object"""
-        self.sql_query = sql_query
+    def __init__(self, bitset=0, expression="", mode="variant"):
+        """Create a new selection object
+
+        :raises ValueError: If mode is not in SET_OPERATION_MODES
+        """
+        if mode not in SET_OPERATION_MODES:
+            raise ValueError(f"Selection:: Unknown mode '{mode}'")
+        self.bitset = bitset
+        self.expression = expression
         # Define the way variants are compared
         self.mode = mode
 
+    def _operation(self, set_operator, other):
+        if self.mode == "site":
+            bitset = apply_site_operator(
+                Selection.conn, set_operator, (self.bitset, other.bitset)
+            )
+        else:
+            bitset = SET_OPERATORS[set_operator](self.bitset, other.bitset)
+        return Selection(
+            bitset, f"({self.expression} {set_operator} {other.expression})", self.mode
+        )
+
     def __add__(self, other):
-        sql_query = union_variants(self.sql_query, other.sql_query, mode=self.mode)
-        return Selection(sql_query, self.mode)
+        return self._operation("+", other)
 
     def __and__(self, other):
-        sql_query = intersect_variants(self.sql_query, other.sql_query, mode=self.mode)
-        return Selection(sql_query, self.mode)
+        return self._operation("&", other)
 
     def __sub__(self, other):
-        sql_query = subtract_variants(self.sql_query, other.sql_query, mode=self.mode)
-        return Selection(sql_query, self.mode)
+        return self._operation("-", other)
+
+    def __xor__(self, other):
+        return self._operation("^", other)
+
+    @property
+    def count(self):
+        """Number of variants in the set"""
+        return _popcount(self.bitset)
+
+    def variant_ids(self):
+        """Return the ids of the variants in ascending order"""
+        return _bitset_positions(_int_to_bytes(self.bitset))
 
     def __repr__(self):
-        return "<Selection>: " + self.sql_query
+        return "<Selection>: " + self.expression
 
     def save(self, name):
-        """Create the new selection in the database"""
-        return create_selection_from_sql(
-            Selection.conn, self.sql_query, name, from_selection=True
+        """Create the new selection in the database, stored as a bitmap"""
+        return create_selection_from_bitset(
+            Selection.conn, name, self.bitset, query=self.expression
         )
 
+    @classmethod
+    def from_selection_name(cls, name, mode="variant"):
+        """Get new Selection object with the variants of the given selection
+
+        :param name: Name of the selection; "variants" for all the variants
+        :rtype: <Selection>
+        """
+        bitset = int.from_bytes(get_selection_bitset(cls.conn, name), "little")
+        return cls(bitset, name, mode=mode)
+
     @classmethod
     def from_selection_id(cls, selection_id, mode="variant"):
-        """Get new Selection object based on a sql query that defines it
+        """Get new Selection object with the variants of the given selection
 
         .. note:: Called from the UI. It is here that 'mode' is selected.
 
@@ -1646,23 +5599,20 @@ def from_selection_id(cls, selection_id, mode="variant"):
             'selection_has_variant' for 'variant_id' field.
             - site: (chr, pos) modifies the default definition of the unicity
             of a variant.
-            => joint on 'variants' table is mandatory here.
         :type selection_id: <int>
         :type mode: <str>
         :return: A new Selection object.
         :rtype: <Selection>
         """
         if selection_id == 1:
-            # Get ids from the default selection
-            sql_query = """SELECT id as variant_id FROM variants"""
-        else:
-            # A variant is defined as chr,pos,ref,alt
-            # which is the primary key (unique)
-            # So these columns are synonyms of 'variants.id' for the table 'variants'
-            # or 'variant_id' for 'selection_has_variant' table.
-            # No further joints are required here.
-            sql_query = f"""SELECT variant_id
-            FROM selection_has_variant sv
-             WHERE sv.selection_id = {selection_id}"""
-
-        return cls(sql_query, mode=mode)
+            # The default selection
+            return cls.from_selection_name("variants", mode=mode)
+
+        record = cls.conn.execute(
+            "SELECT name FROM selections WHERE id = ?", (selection_id,)
+        ).fetchone()
+        if record is None:
+            raise ValueError(
+                f"Selection.from_selection_id:: Unknown selection {selection_id}"
+            )
+        return cls.from_selection_name(record[0], mode=mode)
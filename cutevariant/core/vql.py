@@ -6,6 +6,8 @@
 import textx
 from pkg_resources import resource_string
 
+from cutevariant.core.sql import GENOTYPE_COUNTER_NAMES
+
 
 def model_class(name: str, bases: tuple, attrs: dict) -> type:
     """Metaclass to automatically build the __init__ to get the properties,
@@ -115,6 +117,11 @@ def value(self):
 class Function(metaclass=model_class):
     @property
     def value(self):
+        if not self.arg:
+            # Functions without argument are per-variant columns:
+            # count_het() => "count_het" (See sql.GENOTYPE_COUNTER_FIELDS)
+            # Others are rejected by check_function()
+            return self.func.lower()
         if not self.extra:
             self.extra = "gt"
         return (self.func, self.arg, self.extra)
@@ -154,22 +161,54 @@ def value(self):
         }
 
 
+class SetExpression(metaclass=model_class):
+    @property
+    def value(self):
+        """Operators are left-associative: "a + b - c" => {"-": [{"+": ["a", "b"]}, "c"]}
+        Successive identical operators are merged: "a + b + c" => {"+": ["a", "b", "c"]}
+        """
+        out = self.op[0].value
+        for set_operator, operand in zip(self.op[1::2], self.op[2::2]):
+            if isinstance(out, dict) and set_operator in out:
+                out[set_operator].append(operand.value)
+            else:
+                out = {set_operator: [out, operand.value]}
+        return out
+
+
+class SetOperand(metaclass=model_class):
+    @property
+    def value(self):
+        return self.op if isinstance(self.op, str) else self.op.value
+
+
 class SetCmd(metaclass=model_class):
     @property
     def value(self):
         return {
-        "cmd": "set_cmd",
-        "target": self.target,
-        "expression": "todo" #self.expression
+            "cmd": "set_cmd",
+            "target": self.target,
+            "expression": self.expression.value,
         }
 
 
+def check_function(function: Function):
+    """Object processor: reject functions without argument which are not
+    genotype counters (a typo like "genotyp()" is not a column)"""
+    if not function.arg and function.func.lower() not in GENOTYPE_COUNTER_NAMES:
+        raise VQLSyntaxError(
+            f"unknown function '{function.func}()'",
+            textx.get_location(function)["col"],
+        )
+
+
 METAMODEL = textx.metamodel_from_str(
     resource_string(__name__, "vql.tx").decode(),  # grammar extraction from vql.tx
     classes=model_class.classes,
     debug=False,
     ignore_case=True,
 )
+METAMODEL.register_obj_processors({"Function": check_function})
 
 
 def execute_vql(raw_vql: str) -> list:
@@ -257,7 +257,7 @@ def __init__(self, conn):
         self.conn = conn
 
     def create(self, sql_field):
-        field = sql.get_field_by_name(self.conn, sql_field)
+        field = sql.get_schema_catalog(self.conn).get_field(sql_field)
 
         if field["type"] == "int":
             w = IntegerField()
@@ -935,7 +935,7 @@ def createEditor(self, parent, option, index: QModelIndex) -> QWidget:
 
             if item.type() == FilterItem.CONDITION_TYPE:
                 w = ColumnField(parent)
-                columns = [i["name"] for i in sql.get_fields(conn)]
+                columns = [field["name"] for field in sql.get_schema_catalog(conn).fields]
                 w.set_columns(columns)
                 return w
 
@@ -344,7 +344,7 @@ def open_project(self):
 
     def show_settings(self):
         """Slot to show settings window"""
-        widget = SettingsWidget()
+        widget = SettingsWidget(self.conn)
         widget.exec()
 
     def aboutCutevariant(self):
@@ -380,6 +380,7 @@ def closeEvent(self, event):
         .. note:: Reset windowState if asked.
         """
         self.write_settings()
+        self.query_widget.model.stop_query_thread()
         super().closeEvent(event)
 
     def write_settings(self):
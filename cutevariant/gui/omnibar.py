@@ -3,6 +3,7 @@
 from PySide2.QtGui import *
 
 from cutevariant.core.query import Query
+from cutevariant.core import sql
 from cutevariant.gui.ficon import FIcon
 import re
 
@@ -34,13 +35,8 @@ def query(self):
 
         coord = self.to_coordinate()
         if coord:
-            self._query.filter = {
-                "AND": [
-                    {"field": "chr", "operator": "=", "value": coord[0]},
-                    {"field": "pos", "operator": ">", "value": coord[1]},
-                    {"field": "pos", "operator": "<", "value": coord[2]},
-                ]
-            }
+            # Filter on genomic bins to use the index idx_variants_bin
+            self._query.filter = sql.get_region_filter(self._query.conn, *coord)
 
         return self._query
 
@@ -87,9 +87,9 @@ def load(self):
         font.setBold(True)
         samples_items.setFont(font)
 
-        for sample in sql.get_samples(self.conn):
-            sample_item = self.load_fields("samples", parent_name = sample["name"])
-            sample_item.setText(sample["name"])
+        for sample in sql.get_schema_catalog(self.conn).samples:
+            sample_item = self.load_fields("samples", parent_name = sample)
+            sample_item.setText(sample)
             samples_items.appendRow(sample_item)
 
 
@@ -105,7 +105,7 @@ def load_fields(self, category, parent_name = None):
         font.setBold(True)
         root_item.setFont(font)
 
-        for field in sql.get_field_by_category(self.conn,category):
+        for field in sql.get_schema_catalog(self.conn).get_fields_by_category(category):
             item1 = QStandardItem(field["name"])
             item2 = QStandardItem(field["description"])
             item1.setCheckable(True)
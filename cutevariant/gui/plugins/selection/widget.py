@@ -167,6 +167,9 @@ def __init__(self, conn=None, parent=None):
         self.model = selectionModel()
         self.view = QTableView()
         self.is_loading = False  #  Flag to avoid signals loop
+        # Definition of the unicity of variants in set operations
+        # (See sql.Selection)
+        self.set_mode = "variant"
         self.view.setModel(self.model)
         self.view.setSelectionBehavior(QAbstractItemView.SelectRows)
         self.view.setSelectionMode(QAbstractItemView.SingleSelection)
@@ -270,6 +273,10 @@ def menu_setup(self, locked_selection=False):
             menu.addMenu(self._create_set_operation_menu(FIcon(icon_id), text))
             for icon_id, text in zip(set_icons_ids, set_texts)
         ]
+        site_action = menu.addAction(self.tr("Compare variants by site (chr, pos)"))
+        site_action.setCheckable(True)
+        site_action.setChecked(self.set_mode == "site")
+        site_action.toggled.connect(self._set_site_mode)
 
         if not locked_selection:
             menu.addSeparator()
@@ -355,6 +362,11 @@ def _create_set_operation_menu(self, icon, menu_name):
 
         return menu
 
+    @Slot(bool)
+    def _set_site_mode(self, checked):
+        """Compare variants of set operations by site (chr, pos) or by variant"""
+        self.set_mode = "site" if checked else "variant"
+
     def _make_set_operation(self):
         """Do set operation
 
@@ -371,9 +383,8 @@ def _make_set_operation(self):
         # Get the records and extract their database id to build 2 Selections objects
         record_1 = self.model.record(self.view.selectionModel().currentIndex())
         record_2 = self.model.record(self.model.find_record(action.text()))
-        # TODO: handle modes for creation of selections
-        selection_1 = sql.Selection.from_selection_id(record_1["id"])
-        selection_2 = sql.Selection.from_selection_id(record_2["id"])
+        selection_1 = sql.Selection.from_selection_id(record_1["id"], self.set_mode)
+        selection_2 = sql.Selection.from_selection_id(record_2["id"], self.set_mode)
 
         new_selection_name, success = QInputDialog.getText(
             self, self.tr("Type a name for selection"), self.tr("Selection name:")
@@ -390,7 +401,9 @@ def _make_set_operation(self):
             selection_3 = selection_1 & selection_2
 
         LOGGER.debug(
-            "Query:_make_set_operation:: New selection query: %s", selection_3.sql_query
+            "Query:_make_set_operation:: New selection: %s (%s variants)",
+            selection_3.expression,
+            selection_3.count,
         )
 
         if not selection_3.save(new_selection_name):
@@ -435,8 +448,8 @@ def create_selection_from_bed(self):
 
         if result:
             bed_file = result[0]
+            # Intervals are streamed from the file during the insertion
             bedtool = BedTool(bed_file)
-            intervals = tuple(bedtool)
 
             current_index = self.view.selectionModel().currentIndex()
             current_selection = self.model.record(current_index)
@@ -448,7 +461,7 @@ def create_selection_from_bed(self):
             # TODO : create a sql.selection_exists(name) to check if selection already exists
             if target:
                 sql.create_selection_from_bed(
-                    self.query.conn, source, target, intervals
+                    self.query.conn, source, target, bedtool
                 )
                 self.model.load()
 
@@ -11,6 +11,8 @@
 import sys
 import sqlite3
 import re
+import queue
+import time
 
 # Qt imports
 from PySide2.QtWidgets import (
@@ -31,6 +33,7 @@
 )
 from PySide2.QtCore import (
     QAbstractItemModel,
+    QThread,
     QRect,
     Signal,
     Slot,
@@ -58,6 +61,144 @@
 LOGGER = logger()
 
 
+class QueryThread(QThread):
+    """Thread used to execute the queries of QueryModel out of the GUI thread
+
+    The thread opens its own read-only connection to the database; queries
+    are executed one after the other by a QueryBuilder on this connection.
+    Results are sent with the query id given by start_query(); the results
+    of a query are never sent if a newer query has been started.
+
+    Variants are sent with an estimate of the total (See
+    QueryBuilder.estimate_count()); then the children of grouped variants
+    are prefetched in one query and sent by children_finished; the exact
+    total is sent last by count_finished if the estimate is not exact.
+
+    .. warning:: SQLite objects created in a thread can only be used in that
+        same thread; self.conn is only used in run() (interrupt() is the
+        exception).
+    .. seealso:: QueryModel.load()
+    """
+
+    # Qt signals
+    # query id, total, total is exact, variants
+    query_finished = Signal(int, int, bool, list)
+    # query id, exact total
+    count_finished = Signal(int, int)
+    # query id, children by variant id (dict)
+    children_finished = Signal(int, object)
+    # query id, error message
+    query_failed = Signal(int, str)
+
+    # Minimum time between two saves of the filters used by queries
+    # (See _save_filter_workload())
+    WORKLOAD_SAVE_INTERVAL = 60
+
+    def __init__(self, db_filepath):
+        super().__init__()
+        self.db_filepath = db_filepath
+        self.conn = None
+        self.query_id = 0
+        self._queries = queue.Queue()
+
+    def start_query(self, builder, grouped, limit, offset):
+        """Execute the query of the given builder; cancel the current one
+
+        :param builder: QueryBuilder from which columns, filters, selection
+            and order are taken.
+        :return: Id of the query.
+        :rtype: <int>
+        """
+        self.query_id += 1
+        params = {
+            "columns": list(builder.columns),
+            "filters": copy.deepcopy(builder.filters),
+            "selection": builder.selection,
+            "order_by": builder.order_by,
+            "order_desc": builder.order_desc,
+        }
+        # Interrupt before queueing: the new query can't be dequeued and
+        # interrupted; the current one is identified as outdated by its id
+        self.cancel()
+        self._queries.put((self.query_id, params, grouped, limit, offset))
+        return self.query_id
+
+    def cancel(self):
+        """Interrupt the query being executed"""
+        if self.conn:
+            self.conn.interrupt()
+
+    def stop(self):
+        """Stop the thread after the current query"""
+        self._queries.put(None)
+        self.cancel()
+
+    def run(self):
+        """Overrided QThread method
+
+        Wait for queries and execute the last one started.
+        """
+        self.conn = sql.get_sql_connexion(self.db_filepath, read_only=True)
+        builder = QueryBuilder(self.conn)
+        workload_saved_at = time.time()
+
+        while True:
+            query = self._queries.get()
+            if query is None:
+                break
+            query_id, params, grouped, limit, offset = query
+            if query_id != self.query_id:
+                # A newer query is waiting
+                continue
+
+            for key, value in params.items():
+                setattr(builder, key, value)
+            try:
+                total, is_exact = builder.estimate_count(grouped)
+                variants = list(builder.trees(grouped=grouped, limit=limit, offset=offset))
+                self.query_finished.emit(query_id, total, is_exact, variants)
+
+                # Prefetch children of the page
+                parent_ids = [variant[0] for children, variant in variants if children > 1]
+                if parent_ids and query_id == self.query_id:
+                    self.children_finished.emit(query_id, builder.children_many(parent_ids))
+
+                if not is_exact and query_id == self.query_id:
+                    self.count_finished.emit(query_id, builder.count(grouped))
+            except sqlite3.OperationalError as e:
+                if query_id != self.query_id:
+                    # Interrupted by a newer query
+                    continue
+                LOGGER.exception(e)
+                self.query_failed.emit(query_id, str(e))
+
+            if (
+                self._queries.empty()
+                and time.time() - workload_saved_at > self.WORKLOAD_SAVE_INTERVAL
+            ):
+                self._save_filter_workload()
+                workload_saved_at = time.time()
+
+        self._save_filter_workload()
+        self.conn.close()
+        self.conn = None
+
+    def _save_filter_workload(self):
+        """Save the filters used by the queries of the thread for the index advisor
+
+        The connection of the thread is read-only: the workload is saved
+        with a temporary connection (See sql.save_filter_workload()).
+        """
+        if not self.conn.filter_workload:
+            return
+        try:
+            conn = sql.get_sql_connexion(self.db_filepath)
+            sql.save_filter_workload(conn, self.conn.filter_workload)
+            conn.close()
+        except sqlite3.Error as e:
+            LOGGER.warning("QueryThread:: filters can't be saved: %s", e)
+
+
 class QueryModel(QAbstractItemModel):
     """
     QueryModel is a Qt model class which contains variants datas from sql.VariantBuilder . 
@@ -103,15 +244,20 @@ class QueryModel(QAbstractItemModel):
     NO_PARENT_INTERNAL_ID = 99999
 
     changed = Signal()
+    # Emitted when the exact total replaces the estimated one
+    count_changed = Signal()
 
     def __init__(self, conn=None, parent=None):
         super().__init__()
+        self.query_thread = None
         self.conn = conn
         self.limit = 50
         self.page = 0
         self.total = 0
+        self.total_is_exact = True
         self.grouped = True
         self.variants = []
+        self.prefetched_children = dict()
         self.builder = None
 
     @property
@@ -124,6 +270,7 @@ def conn(self, conn):
         """ Set sqlite connection """
         if conn is not None:
             self.builder = QueryBuilder(conn)
+            self._start_query_thread(conn)
             self.emit_changed = True
             self.load()
 
@@ -342,8 +489,11 @@ def fetchMore(self, parent: QModelIndex):
             return
 
         variant_id = self.variants[parent.row()][0][0]
+        children = self.prefetched_children.get(variant_id)
+        if children is None:
+            children = list(self.builder.children(variant_id))
         # The root parent is the last one.. Reverse to have it at first
-        children = list(self.builder.children(variant_id))[:-1]
+        children = children[:-1]
 
         self.variants[parent.row()][1:] = []
 
@@ -352,9 +502,39 @@ def fetchMore(self, parent: QModelIndex):
         self.endInsertRows()
 
 
+    def _start_query_thread(self, conn):
+        """Start the thread executing the queries of the given connection
+
+        Databases without file (in-memory) can't be opened by another
+        connection; their queries are executed in the GUI thread.
+        """
+        self.stop_query_thread()
+
+        db_filepath = sql.get_database_filepath(conn)
+        if db_filepath is None:
+            return
+
+        self.query_thread = QueryThread(db_filepath)
+        self.query_thread.query_finished.connect(self._on_query_finished)
+        self.query_thread.count_finished.connect(self._on_count_finished)
+        self.query_thread.children_finished.connect(self._on_children_finished)
+        self.query_thread.query_failed.connect(self._on_query_failed)
+        self.query_thread.start()
+
+    def stop_query_thread(self):
+        """Stop the thread executing the queries"""
+        if self.query_thread is None:
+            return
+        self.query_thread.stop()
+        self.query_thread.wait()
+        self.query_thread = None
+
     def load(self, emit_changed = True):
         """Load variant data into the model from query attributes
 
+        The query is executed by the query thread; the model is updated
+        when the results arrive. The current query is cancelled.
+
         Args:
             emit_changed (bool): emit the signal changed()
 
@@ -366,23 +546,80 @@ def load(self, emit_changed = True):
         if self.conn is None:
             return
 
+        LOGGER.debug(self.builder.sql())
+
+        if self.query_thread is None:
+            # Synchronous load
+            total = self.builder.count(grouped=self.grouped)
+            self.total_is_exact = True
+            variants = list(
+                self.builder.trees(
+                    grouped=self.grouped, limit=self.limit, offset=self.page * self.limit
+                )
+            )
+            self._set_variants(total, variants, emit_changed)
+            return
+
+        self._emit_changed = emit_changed
+        self.query_thread.start_query(
+            self.builder, self.grouped, self.limit, self.page * self.limit
+        )
+
+    @Slot(int, int, bool, list)
+    def _on_query_finished(self, query_id, total, is_exact, variants):
+        """Called when the query thread sends results"""
+        if query_id != self.query_thread.query_id:
+            # Stale results
+            return
+        # If the total is estimated, the exact one is sent by count_finished
+        self.total_is_exact = is_exact
+        self._set_variants(total, variants, self._emit_changed)
+
+    @Slot(int, int)
+    def _on_count_finished(self, query_id, total):
+        """Called when the query thread sends the exact total of variants"""
+        if query_id != self.query_thread.query_id:
+            return
+        self.total = total
+        self.total_is_exact = True
+        self.count_changed.emit()
+
+    @Slot(int, object)
+    def _on_children_finished(self, query_id, children):
+        """Called when the query thread sends the children of the current page"""
+        if query_id != self.query_thread.query_id:
+            return
+        self.prefetched_children = children
+
+    @Slot(int, str)
+    def _on_query_failed(self, query_id, message):
+        """Called when the query thread fails to execute a query"""
+        if query_id == self.query_thread.query_id:
+            LOGGER.error("QueryModel: query failed: %s", message)
+
+    def _set_variants(self, total, variants, emit_changed):
+        """Set the model data from the results of a query
+
+        Args:
+            total (int): Total of variants for pagination
+            variants (list): Variants from QueryBuilder.trees()
+            emit_changed (bool): emit the signal changed()
+        """
         self.beginResetModel()
         # Set total of variants for pagination
-        self.total = self.builder.count()
+        self.total = total
 
         # Append a list because child can be append after
         self.variants = []
         self.variants_sql_indexes = []
         self.variants_children_count = []
-        for variant in self.builder.trees(
-            grouped=self.grouped, limit=self.limit, offset=self.page * self.limit
-        ):
+        # Children of the page by variant id, See fetchMore()
+        self.prefetched_children = dict()
+        for variant in variants:
             self.variants_children_count.append(variant[0])
             self.variants.append([variant[1]])
         self.endResetModel()
 
-        LOGGER.debug(self.builder.sql())
-
         if emit_changed:
             self.changed.emit()
 
@@ -740,6 +977,7 @@ def __init__(self, conn=None):
         self.setLayout(main_layout)
 
         self.model.modelReset.connect(self.updateInfo)
+        self.model.count_changed.connect(self.updateInfo)
 
         # Create menu
         # self.context_menu = VariantPopupMenu()
@@ -776,9 +1014,12 @@ def updateInfo(self):
         """
 
         # Set text
+        # Estimated totals are prefixed with "~"
+        total = self.model.total if self.model.total_is_exact else f"~{self.model.total}"
+        first_id, last_id, _ = self.model.displayed()
         self.page_info.setText(
             self.tr("{} variant(s)  {}-{} of {}").format(
-                self.model.total, *self.model.displayed()
+                total, first_id, last_id, total
             )
         )
         page_box_text = str(self.model.page)
@@ -9,7 +9,8 @@
         require internet connection
         - StyleSettingsWidget
         - PluginsSettingsWidget
-        - DatabaseSettingsWidget
+        - DatabaseSettingsWidget: Allow to optimize the indexes of the opened
+        database
         - VariantSettingsWidget: Allow to add personal templates to search a
         variant in a third-party database
 
@@ -33,6 +34,7 @@
 # Custom imports
 import cutevariant.commons as cm
 from cutevariant.gui.ficon import FIcon
+from cutevariant.core import sql
 
 from cutevariant.gui import plugin
 
@@ -272,16 +274,78 @@ def load(self):
 
 
 class DatabaseSettingsWidget(BaseWidget):
-    def __init__(self):
+    """Optimize the indexes of the opened database
+
+    Indexes are advised from the filters of previous queries and kept only
+    if they speed up these queries (See sql.advise_indexes()).
+    """
+
+    def __init__(self, conn=None):
         super().__init__()
         self.setWindowTitle(self.tr("database"))
         self.setWindowIcon(FIcon(0xF1B8))
+        self.conn = conn
+
+        self.view = QTreeWidget()
+        self.view.setColumnCount(6)
+        self.view.setHeaderLabels(
+            [
+                self.tr("Index"),
+                self.tr("Action"),
+                self.tr("Queries"),
+                self.tr("Mean time (ms)"),
+                self.tr("Size (KB)"),
+                self.tr("Speedup"),
+            ]
+        )
+        self.optimize_button = QPushButton(self.tr("Optimize indexes"))
+        self.optimize_button.setEnabled(conn is not None)
+        self.optimize_button.clicked.connect(self.optimize_indexes)
+
+        main_layout = QVBoxLayout()
+        main_layout.addWidget(self.view)
+        main_layout.addWidget(self.optimize_button)
+        self.setLayout(main_layout)
 
     def save(self):
         pass
 
     def load(self):
-        pass
+        """Display the advised indexes"""
+        self.view.clear()
+        if self.conn is None:
+            return
+        for advice in sql.advise_indexes(self.conn):
+            self.add_advice_item(advice)
+
+    def add_advice_item(self, advice: dict):
+        """Add an advice of sql.advise_indexes() or sql.apply_index_advice() in the view"""
+        size = advice.get("size") or advice["estimated_size"]
+        speedup = advice.get("speedup")
+        item = QTreeWidgetItem()
+        item.setText(0, advice["name"])
+        item.setToolTip(0, advice["where"] or "")
+        item.setText(1, advice["action"])
+        item.setText(2, str(advice["count"]))
+        item.setText(3, "%.2f" % (advice["mean_time"] * 1000))
+        item.setText(4, str(size // 1024) if size is not None else "")
+        item.setText(5, "x%.1f" % speedup if speedup else "")
+        if advice.get("applied") is False:
+            # Created then dropped: the index doesn't speed up queries
+            item.setDisabled(True)
+        self.view.addTopLevelItem(item)
+
+    def optimize_indexes(self):
+        """Create and drop the advised indexes"""
+        self.view.clear()
+        QApplication.setOverrideCursor(Qt.WaitCursor)
+        try:
+            advice = sql.advise_indexes(self.conn)
+            for result in sql.apply_index_advice(self.conn, advice):
+                self.add_advice_item(result)
+                qApp.processEvents()
+        finally:
+            QApplication.restoreOverrideCursor()
 
 
 class VariantSettingsWidget(BaseWidget):
@@ -423,7 +487,10 @@ class SettingsWidget(QDialog):
     in tabs.
     """
 
-    def __init__(self):
+    def __init__(self, conn=None):
+        """
+        :key conn: Connection to the opened database, if any
+        """
         super().__init__()
         self.setWindowTitle(self.tr("Cutevariant - Settings"))
         self.setWindowIcon(QIcon(cm.DIR_ICONS + "app.png"))
@@ -461,7 +528,7 @@ def __init__(self):
         self.addPanel(general_settings)
         self.addPanel(PluginsSettingsWidget())
         self.addPanel(VariantSettingsWidget())
-        self.addPanel(DatabaseSettingsWidget())
+        self.addPanel(DatabaseSettingsWidget(conn))
         self.load_plugins()
 
         self.resize(800, 400)
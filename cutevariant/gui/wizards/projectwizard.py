@@ -31,11 +31,19 @@ def __init__(self):
         self.project_path_edit.setText(os.getcwd())
         self.browse_button = QPushButton("Browse")
         self.reference = QComboBox()
+        self.append_checkbox = QCheckBox(
+            self.tr("Add the file to the project if it already exists")
+        )
+        self.resume_checkbox = QCheckBox(
+            self.tr("Resume the interrupted import of the file in the project")
+        )
 
         self.reference.addItem("hg19")
         self.registerField("project_name", self.project_name_edit, "text")
         self.registerField("project_path", self.project_path_edit, "text")
         self.registerField("reference", self.reference, "currentText")
+        self.registerField("append", self.append_checkbox)
+        self.registerField("resume", self.resume_checkbox)
 
         v_layout = QFormLayout()
 
@@ -47,6 +55,8 @@ def __init__(self):
         v_layout.addRow(self.tr("Reference genom"), self.reference)
         v_layout.addRow(self.tr("Project Name"), self.project_name_edit)
         v_layout.addRow(self.tr("Create in"), browse_layout)
+        v_layout.addRow(self.append_checkbox)
+        v_layout.addRow(self.resume_checkbox)
 
         self.setLayout(v_layout)
 
@@ -196,14 +206,19 @@ def run(self):
         """
         self._stop = False
 
-        if os.path.exists(self.db_filename):
+        project_settings = dict(self.project_settings)
+        resume = project_settings.pop("resume", False)
+        if not os.path.exists(self.db_filename):
+            # Nothing to append to or to resume: create the project
+            project_settings["append"] = resume = False
+        elif not (resume or project_settings.get("append")):
             os.remove(self.db_filename)
         self.conn = get_sql_connexion(self.db_filename)
 
         try:
             # Import the file
             for value, message in async_import_file(
-                self.conn, self.filename, self.project_settings
+                self.conn, self.filename, project_settings, resume=resume
             ):
                 if self._stop == True:
                     self.conn.close()
@@ -320,6 +335,10 @@ def run(self):
                     "reference": self.field("reference"),
                     # Project's name
                     "project_name": self.field("project_name"),
+                    # Add the file to the existing project
+                    "append": self.field("append"),
+                    # Resume the interrupted import of the file
+                    "resume": self.field("resume"),
                 },
             )
 
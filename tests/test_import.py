@@ -3,10 +3,20 @@
 import os
 import sqlite3
 import warnings
-from cutevariant.core.importer import import_reader
+import gzip
+from cutevariant.core.importer import (
+    import_reader,
+    import_file,
+    async_import_reader,
+    async_import_file,
+    async_import_vcf_parallel,
+    async_import_files,
+)
+from cutevariant.core.readerfactory import create_reader
+from cutevariant.core import sql
 from cutevariant.core.reader import VcfReader, FakeReader
 import os
-from .utils import table_exists
+from .utils import table_exists, write_multiallelic_vcf
 
 READERS = [
 FakeReader(),
@@ -28,6 +38,60 @@ def test_import(reader):
 
 
 
+def test_import_genotype_counters():
+    """Genotype counters are computed at import and can be refreshed"""
+    conn = sql.get_sql_connexion(":memory:")
+    import_file(conn, "examples/test.snpeff.vcf")
+    samples = [sample["name"] for sample in sql.get_samples(conn)]
+    query = "SELECT " + ",".join(sql.GENOTYPE_COUNTER_NAMES) + " FROM variants ORDER BY id"
+    expected = [tuple(row) for row in conn.execute(query)]
+
+    for variant_id, row in enumerate(expected, 1):
+        gts = [
+            gt
+            for gt, in conn.execute(
+                "SELECT gt FROM sample_has_variant WHERE variant_id = ? ORDER BY sample_id",
+                (variant_id,),
+            )
+        ]
+        assert row[:4] == (gts.count(0), gts.count(1), gts.count(2), gts.count(1) + gts.count(2))
+        assert row[5] == ",".join(name for name, gt in zip(samples, gts) if gt > 0)
+
+    sql.update_genotype_counters(conn)
+    assert [tuple(row) for row in conn.execute(query)] == expected
+
+    builder = sql.QueryBuilder(conn, ["chr", "carriers"], {"AND": [{"field": "count_het", "operator": ">=", "value": 1}]})
+    assert builder.count() == len([row for row in expected if row[1] >= 1])
+
+
+@pytest.mark.parametrize(
+    "filename", ["examples/test.vcf", "examples/test.snpeff.vcf", "examples/test.vep.vcf"]
+)
+def test_import_genotype_matrix(filename):
+    """The genotype matrix must give the values of "sample_has_variant"
+    (missing values are stored as empty strings)"""
+    conn = sql.get_sql_connexion(":memory:")
+    for _ in async_import_file(conn, filename, {"genotype_matrix": True}):
+        pass
+    fields = sql.get_genotype_matrix_fields(conn)
+    assert "gt" in fields
+
+    sql.register_genotype_functions(conn)
+    sample_ids = [row[0] for row in conn.execute("SELECT id FROM samples ORDER BY id")]
+    for field in fields:
+        function = sql.GENOTYPE_MATRIX_SQL_FUNCTIONS[sql.GENOTYPE_MATRIX_FIELDS[field]]
+        for index, sample_id in enumerate(sample_ids):
+            for value, expected in conn.execute(
+                f"""SELECT {function}(genotype_matrix.`{field}`, ?),
+                sample_has_variant.`{field}` FROM genotype_matrix
+                LEFT JOIN sample_has_variant
+                ON sample_has_variant.variant_id = genotype_matrix.variant_id
+                AND sample_has_variant.sample_id = ?""",
+                (index, sample_id),
+            ):
+                assert value == (None if expected == "" else expected)
+
+
 # def test_import_file_vcf_gz(conn):
 #     path = "exemples/test.vcf.gz"
 #     import_file(conn, path)
@@ -35,3 +99,253 @@ def test_import(reader):
 # def test_import_file_csv(conn):
 #     path = "exemples/test.csv"
 #     import_file(conn, path)
+
+
+@pytest.mark.parametrize(
+    "filename", ["examples/test.vcf", "examples/test.snpeff.vcf", "examples/test.vep.vcf"]
+)
+@pytest.mark.parametrize(
+    "members", [0, 1, 2], ids=["vcf", "vcf.gz", "multi-member vcf.gz"]
+)
+def test_import_vcf_parallel(filename, members, tmp_path):
+    """Parallel import must give the same database as the sequential one"""
+    if members:
+        path = str(tmp_path / os.path.basename(filename)) + ".gz"
+        with open(filename, "rb") as f_in, open(path, "wb") as f_out:
+            lines = f_in.readlines()
+            # Concatenated gzip members, like bgzip
+            step = len(lines) // members + 1
+            for index in range(0, len(lines), step):
+                f_out.write(gzip.compress(b"".join(lines[index : index + step])))
+    else:
+        path = filename
+
+    expected = sqlite3.connect(":memory:")
+    import_file(expected, path)
+
+    conn = sqlite3.connect(":memory:")
+    progress = [
+        percent
+        for percent, message in async_import_vcf_parallel(
+            conn, path, processes=2, chunk_size=3
+        )
+        if message.endswith("variants inserted.")
+    ]
+    # Progress is measured in the same unit as the size of the file
+    assert progress == sorted(progress)
+    assert progress[-1] == 100
+
+    for table in ("variants", "annotations", "sample_has_variant", "selections"):
+        query = f"SELECT * FROM {table}"
+        assert conn.execute(query).fetchall() == expected.execute(query).fetchall()
+
+
+def test_resume_import(tmp_path):
+    """An interrupted import must be resumed from its last checkpoint"""
+    filename = "examples/test.snpeff.vcf"
+    expected = sqlite3.connect(":memory:")
+    import_file(expected, filename)
+
+    db_filename = str(tmp_path / "test.db")
+    conn = sqlite3.connect(db_filename)
+    with create_reader(filename) as reader:
+        get_variants = reader.get_variants
+
+        def interrupted_variants():
+            for index, variant in enumerate(get_variants()):
+                if index == 5:
+                    raise InterruptedError()
+                yield variant
+
+        reader.get_variants = interrupted_variants
+        with pytest.raises(InterruptedError):
+            for _ in async_import_reader(conn, reader, batch_size=1, commit_every=2):
+                pass
+    conn.close()
+
+    conn = sqlite3.connect(db_filename)
+    metadatas = sql.get_metadatas(conn)
+    assert metadatas["import_status"] == "running"
+    assert metadatas["import_variant_count"] == "4"
+    assert sql.get_variants_count(conn) == 4
+
+    for _ in async_import_file(conn, filename, resume=True):
+        pass
+
+    assert sql.get_metadatas(conn)["import_status"] == "done"
+    for table in ("variants", "annotations", "sample_has_variant", "selections"):
+        query = f"SELECT * FROM {table}"
+        assert conn.execute(query).fetchall() == expected.execute(query).fetchall()
+
+
+@pytest.mark.parametrize("compressed", [False, True], ids=["vcf", "vcf.gz"])
+def test_resume_import_seek(compressed, tmp_path):
+    """Imports with FastVcfReader must be resumed at the checkpoint, even in
+    the middle of a record with several ALT"""
+    filename = str(tmp_path / ("test.vcf.gz" if compressed else "test.vcf"))
+    write_multiallelic_vcf(filename, compressed)
+    expected = sqlite3.connect(":memory:")
+    import_file(expected, filename)
+
+    db_filename = str(tmp_path / "test.db")
+    conn = sqlite3.connect(db_filename)
+    with create_reader(filename, fast=True) as reader:
+        get_variants = reader.get_variants
+
+        def interrupted_variants():
+            for index, variant in enumerate(get_variants()):
+                if index == 3:
+                    raise InterruptedError()
+                yield variant
+
+        reader.get_variants = interrupted_variants
+        with pytest.raises(InterruptedError):
+            for _ in async_import_reader(conn, reader, batch_size=1, commit_every=2):
+                pass
+    conn.close()
+
+    conn = sqlite3.connect(db_filename)
+    metadatas = sql.get_metadatas(conn)
+    # First ALT of the second record
+    assert metadatas["import_variant_count"] == "2"
+    assert metadatas["import_record_variants"] == "1"
+
+    parsed_lines = []
+    with create_reader(filename, fast=True) as reader:
+        read_lines = reader._read_lines
+
+        def spied_lines():
+            for line in read_lines():
+                parsed_lines.append(line)
+                yield line
+
+        reader._read_lines = spied_lines
+        for _ in async_import_reader(conn, reader, resume=True):
+            pass
+    # Records before the checkpoint are not parsed again
+    assert not any(line.startswith("#") for line in parsed_lines)
+    assert len(parsed_lines) == len(expected.execute("SELECT * FROM variants").fetchall()) - 2
+
+    for table in ("variants", "annotations", "sample_has_variant", "selections"):
+        query = f"SELECT * FROM {table}"
+        assert conn.execute(query).fetchall() == expected.execute(query).fetchall()
+
+
+def write_other_vcf(path, suffix, shift=1):
+    """Write the 6 first variants of test.snpeff.vcf and 2 new variants with
+    a new INFO field; samples are renamed with the given suffix"""
+    with open("examples/test.snpeff.vcf") as file:
+        lines = file.readlines()
+    header = [line for line in lines if line.startswith("##")]
+    columns = next(line for line in lines if line.startswith("#CHROM"))
+    records = [line.split("\t") for line in lines if not line.startswith("#")]
+
+    with open(path, "w") as file:
+        file.writelines(header)
+        file.write('##INFO=<ID=NEWKEY,Number=1,Type=Integer,Description="New">\n')
+        file.write(columns.replace("NORMAL", "NORMAL" + suffix).replace("TUMOR", "TUMOR" + suffix))
+        for record in records[:6]:
+            file.write("\t".join(record))
+        for record in records[:2]:
+            record = [record[0], str(int(record[1]) + shift)] + record[2:]
+            record[7] = "NEWKEY=1;" + record[7]
+            file.write("\t".join(record))
+    return records
+
+
+def test_append_import(tmp_path):
+    """A VCF file with new samples must be added to an existing database"""
+    filename = "examples/test.snpeff.vcf"
+    # 6 variants already imported, 2 new variants with a new INFO field
+    path = str(tmp_path / "other.vcf")
+    records = write_other_vcf(path, "2")
+
+    conn = sql.get_sql_connexion(str(tmp_path / "test.db"))
+    import_file(conn, filename)
+    for _ in async_import_file(conn, path, append=True):
+        pass
+
+    assert sql.get_metadatas(conn)["import_status"] == "done"
+    assert [sample["name"] for sample in sql.get_samples(conn)] == [
+        "NORMAL", "TUMOR", "NORMAL2", "TUMOR2"
+    ]
+    assert sql.get_variants_count(conn) == len(records) + 2
+    assert "newkey" in sql.get_columns(conn, "variants")
+    assert conn.execute("SELECT COUNT(*) FROM variants WHERE newkey = 1").fetchone()[0] == 2
+    # New samples are linked to old and new variants
+    assert conn.execute(
+        "SELECT COUNT(*) FROM sample_has_variant WHERE sample_id > 2"
+    ).fetchone()[0] == 2 * 8
+    selection = next(
+        s for s in sql.get_selections(conn) if s["name"] == "variants"
+    )
+    assert selection["count"] == len(records) + 2
+
+    # Statistics of counters include existing variants
+    assert sql.get_field_range(conn, "count_var") == tuple(
+        conn.execute("SELECT MIN(count_var), MAX(count_var) FROM variants").fetchone()
+    )
+    # Incremental statistics are those of a full computation, including the
+    # rows of new samples attached to existing variants
+    fields = [
+        (field["name"], field["category"])
+        for field in sql.get_fields(conn)
+        if field["category"] in sql.FIELD_STATS_TABLES
+        and field["name"]
+        in sql.get_columns(conn, sql.FIELD_STATS_TABLES[field["category"]][0])
+    ]
+    # "dp" is a field of variants (INFO) and of samples (FORMAT)
+    assert {("dp", "variants"), ("dp", "samples")} <= set(fields)
+    updated = {field: sql.get_field_stats(conn, *field) for field in fields}
+    assert None not in updated.values()
+    sql.compute_field_stats(conn)
+    for field, stats in updated.items():
+        expected = sql.get_field_stats(conn, *field)
+        del stats["histogram"], expected["histogram"]
+        assert stats == expected, field
+    # The range of the first field of a name, like get_field_by_name()
+    assert sql.get_field_by_name(conn, "dp")["category"] == "variants"
+    assert sql.get_field_range(conn, "dp") == tuple(
+        conn.execute("SELECT MIN(dp), MAX(dp) FROM variants").fetchone()
+    )
+
+    # Incremental counters are those of a full computation
+    query = "SELECT " + ",".join(sql.GENOTYPE_COUNTER_NAMES) + " FROM variants ORDER BY id"
+    counters = conn.execute(query).fetchall()
+    sql.update_genotype_counters(conn)
+    assert conn.execute(query).fetchall() == counters
+
+    # Samples can't be appended twice
+    with pytest.raises(ValueError):
+        for _ in async_import_file(conn, path, append=True):
+            pass
+
+
+def test_import_files(tmp_path):
+    """Files imported in parallel must give the database of successive appends"""
+    filenames = ["examples/test.snpeff.vcf"]
+    for index in range(2, 4):
+        filenames.append(str(tmp_path / f"other{index}.vcf"))
+        write_other_vcf(filenames[-1], str(index), shift=index)
+
+    expected = sql.get_sql_connexion(str(tmp_path / "expected.db"))
+    import_file(expected, filenames[0])
+    for filename in filenames[1:]:
+        for _ in async_import_file(expected, filename, append=True):
+            pass
+
+    conn = sql.get_sql_connexion(str(tmp_path / "test.db"))
+    for _ in async_import_files(conn, filenames, processes=2):
+        pass
+
+    assert sql.get_metadatas(conn)["import_status"] == "done"
+    assert list(sql.get_fields(conn)) == list(sql.get_fields(expected))
+    for table in ("variants", "annotations", "samples", "sample_has_variant", "selections"):
+        query = f"SELECT * FROM {table}"
+        assert conn.execute(query).fetchall() == expected.execute(query).fetchall()
+
+    # A sample can't be in several files
+    conn = sql.get_sql_connexion(":memory:")
+    with pytest.raises(ValueError):
+        for _ in async_import_files(conn, filenames + filenames[1:2], processes=2):
+            pass
@@ -2,6 +2,7 @@
 
 from cutevariant.core import sql
 from cutevariant.core.reader.bedreader import BedTool
+from cutevariant.core.importer import import_file
 from .utils import table_exists, table_count
 
 FIELDS = [
@@ -121,6 +122,34 @@ def test_build_variant_query(conn, args, expected):
     assert sql.QueryBuilder(conn, **args).sql() == expected
 
 
+def test_build_parameterized_query(conn):
+    """Values are bound: queries with other values have the same SQL"""
+    builder = sql.QueryBuilder(conn, ["chr", "pos", ("genotype", "boby", "gt")])
+    filters = {
+        "AND": [
+            {"field": "chr", "operator": "=", "value": "chr1"},
+            {"field": ("genotype", "boby", "gt"), "operator": "=", "value": 1},
+            {"field": "ref", "operator": "IN", "value": ("A", "G")},
+        ]
+    }
+    params = []
+    query = builder.build_sql(builder.columns, filters, "other", params=params)
+    assert "'" not in query
+    assert params == ["other", "chr1", 1, "A", "G", 20, 0]
+
+    other_params = []
+    filters["AND"][0]["value"] = "chr2"
+    assert builder.build_sql(builder.columns, filters, "other", params=other_params) == query
+    assert other_params[1] == "chr2"
+
+    # Same results as literal queries
+    filters["AND"][0]["value"] = "chr1"
+    params = []
+    query = builder.build_sql(builder.columns, filters, params=params)
+    literal_query = builder.build_sql(builder.columns, filters)
+    assert conn.execute(query, params).fetchall() == conn.execute(literal_query).fetchall()
+    assert len(conn.execute(query, params).fetchall()) == 1
+
 def test_select_tree(conn):
     args = {}
     args["columns"] = ["chr","pos","ref","gene"]
@@ -134,6 +163,15 @@ def test_select_children(conn):
 
 
 
+def test_select_children_many(conn):
+    """Children of several variants are read in one query"""
+    builder = sql.QueryBuilder(conn, ["chr", "pos", "gene", "transcript"])
+    children = builder.children_many([1, 2, 3])
+    assert sorted(children) == [1, 2]
+    for variant_id in (1, 2):
+        assert children[variant_id] == list(builder.children(variant_id))
+    assert [row[4] for row in children[1]] == ["transcript1", "transcript2"]
+
 
 def test_column_to_sql(conn):
 
@@ -157,6 +195,39 @@ def test_filters_to_sql(conn):
 def test_count(conn):
     assert sql.QueryBuilder(conn).count() == 2
 
+def test_count_sql(conn):
+    """Count queries make only the joins required by the filters"""
+    builder = sql.QueryBuilder(conn, ["chr", "gene", ("genotype", "boby", "gt")])
+    # One row per annotation, but 2 variants
+    assert builder.count() == 3
+    assert builder.count(grouped=True) == 2
+    assert "annotations" not in builder.count_sql(grouped=True)
+    assert "gt_boby" not in builder.count_sql()
+
+    builder.filters = {"AND": [{"field": "gene", "operator": "=", "value": "gene1"}]}
+    assert builder.count() == builder.count(grouped=True) * 2 == 2
+
+    builder.filters = {"AND": [{"field": ("genotype", "boby", "gt"), "operator": "=", "value": 1}]}
+    assert "gt_boby" in builder.count_sql()
+    assert builder.count(grouped=True) == 1
+
+
+def test_estimate_count(conn):
+    """Estimates are extrapolated from a sample of variant ids"""
+    sql.insert_many_variants(
+        conn,
+        [{"chr": "chr2", "pos": i, "ref": "A", "alt": "C", "extra1": i % 4} for i in range(1000)],
+    )
+    builder = sql.QueryBuilder(conn)
+    assert builder.estimate_count() == (1002, True)
+
+    builder.filters = {"AND": [{"field": "extra1", "operator": "=", "value": 0}]}
+    assert builder.estimate_count() == (builder.count(), True)
+
+    count, is_exact = builder.estimate_count(sample_size=200, blocks=10)
+    assert not is_exact
+    assert abs(count - builder.count()) < 25
+
 def test_save(conn):
     selector = sql.QueryBuilder(conn)
     selector.filters = {"AND": [ {"field": "pos", "operator": "=", "value": 45}]}
@@ -170,3 +241,199 @@ def test_save(conn):
     selector.selection = "denovo"
     selector.filters = None
     assert selector.count() == 1
+
+
+def test_save_bitmap(conn):
+    selector = sql.QueryBuilder(conn)
+    selector.filters = {"AND": [{"field": "pos", "operator": ">", "value": 5}]}
+    selector.save("all", store="bitmap")
+    selector.selection_store = "bitmap"
+    selector.filters = {"AND": [{"field": "gene", "operator": "=", "value": "gene2"}]}
+    selector.save("gene2")
+    assert [(i["name"], i["count"]) for i in sql.get_selections(conn)][1:] == [
+        ("all", 2),
+        ("gene2", 1),
+    ]
+
+    selector.selection = "gene2"
+    selector.filters = None
+    assert [variant[2] for variant in selector.items()] == [45]
+    assert selector.count() == 1
+    selector.selection = "all"
+    selector.filters = {"AND": [{"field": "pos", "operator": "=", "value": 10}]}
+    assert selector.count() == 1
+
+
+@pytest.mark.parametrize("order_by", [None, "pos", "extra1", ("genotype", "boby", "gt")])
+@pytest.mark.parametrize("order_desc", [True, False])
+@pytest.mark.parametrize("grouped", [True, False])
+def test_keyset_pagination(conn, order_by, order_desc, grouped):
+    """Pages read with keyset pagination must be the pages read with OFFSET"""
+    # Duplicated and NULL values in extra1 and gt
+    sql.insert_many_variants(
+        conn,
+        [
+            {
+                "chr": "chr2", "pos": i, "ref": "A", "alt": "C",
+                "extra1": None if i % 5 == 0 else i % 3,
+                "samples": [{"name": "boby", "gt": None if i % 4 == 0 else i % 2}],
+            }
+            for i in range(1, 48)
+        ],
+    )
+    columns = ["chr", "pos", "extra1", ("genotype", "boby", "gt")]
+    builder = sql.QueryBuilder(conn, columns, order_by=order_by, order_desc=order_desc)
+    reference = sql.QueryBuilder(conn, columns, order_by=order_by, order_desc=order_desc)
+    reference.keyset_pagination = False
+    if order_by is None:
+        reference.order_by, reference.order_desc = "id", False
+
+    def read_page(builder, page):
+        return [row for _, row in builder.trees(grouped, limit=10, offset=page * 10)]
+
+    expected = [read_page(reference, page) for page in range(5)]
+    assert sum(len(rows) for rows in expected) == 49
+
+    # Next pages, then previous pages: anchors are reused
+    assert [read_page(builder, page) for page in range(5)] == expected
+    assert len(builder._page_anchors) == 4
+    assert [read_page(builder, page) for page in (3, 2, 0)] == [expected[3], expected[2], expected[0]]
+
+    # Random jump: closest anchor + offset
+    builder = sql.QueryBuilder(conn, columns, order_by=order_by, order_desc=order_desc)
+    assert read_page(builder, 3) == expected[3]
+    assert read_page(builder, 4) == expected[4]
+
+
+@pytest.mark.parametrize(
+    "order_by, seek",
+    [
+        ("chr", ("chr1' OR '?", 1)),
+        ("extra1", (10.5, 1)),
+        ("extra1", (True, 1)),
+        ("chr", (b"chr1", 1)),
+        ("pos", (None, 1)),
+        ("id", (1, 1)),
+    ],
+)
+@pytest.mark.parametrize("order_desc", [True, False])
+def test_seek_to_sql(conn, order_by, seek, order_desc):
+    """Literal seek conditions must select the rows of parameterized ones"""
+    builder = sql.QueryBuilder(conn)
+    params = []
+    condition = builder._seek_to_sql(order_by, order_desc, seek, params)
+    literal_condition = builder._seek_to_sql(order_by, order_desc, seek)
+
+    query = "SELECT id FROM variants WHERE "
+    assert (
+        conn.execute(query + literal_condition).fetchall()
+        == conn.execute(query + condition, params).fetchall()
+    )
+
+
+def test_annotations_summary(conn):
+    """Grouped views read the annotations summary instead of grouping rows"""
+    builder = sql.QueryBuilder(conn, ["chr", "pos", "gene", "transcript"])
+    expected = list(builder.trees(grouped=True))
+
+    sql.create_annotations_summary(conn)
+    builder = sql.QueryBuilder(conn, ["chr", "pos", "gene", "transcript"])
+    assert "GROUP BY" not in builder.build_sql(builder.columns, {}, grouped=True)
+    trees = list(builder.trees(grouped=True))
+    assert [children for children, _ in trees] == [children for children, _ in expected]
+    # The first annotation is displayed without impact field
+    assert trees[0][1][3:] == ["gene1", "transcript1"]
+    # The parent is the last child
+    assert list(builder.children(1))[-1] == trees[0][1]
+
+    # Annotations are grouped if they are filtered
+    builder.filters = {"AND": [{"field": "transcript", "operator": "=", "value": "transcript2"}]}
+    assert "GROUP BY" in builder.build_sql(builder.columns, builder.filters, grouped=True)
+    assert [children for children, _ in builder.trees(grouped=True)] == [1, 1]
+
+
+def test_annotations_summary_impact():
+    """The annotation with the worst impact is displayed"""
+    conn = sql.get_sql_connexion(":memory:")
+    import_file(conn, "examples/test.snpeff.vcf")
+    assert sql.has_annotations_summary(conn)
+
+    ranks = {impact: rank for rank, impact in enumerate(sql.ANNOTATION_IMPACT_RANKS)}
+    builder = sql.QueryBuilder(conn, ["chr", "pos", "impact"])
+    for children, variant in builder.trees(grouped=True, limit=None):
+        impacts = [row[3] for row in builder.children(variant[0])]
+        assert len(impacts) == children
+        assert ranks[variant[3]] == min(ranks[impact] for impact in impacts)
+
+
+def test_genotype_matrix(conn):
+    """Genotypes read from the genotype matrix give the same results as joins"""
+    columns = ["chr", "pos", ("genotype", "sacha", "gt"), ("genotype", "boby", "dp")]
+    filters = {
+        "AND": [
+            {"field": ("genotype", "sacha", "gt"), "operator": "=", "value": 1},
+            {"field": ("genotype", "boby", "dp"), "operator": "<", "value": 50},
+        ]
+    }
+    builder = sql.QueryBuilder(conn, columns, filters)
+    expected = list(builder.items())
+    assert len(expected) == 1
+
+    assert sql.create_genotype_matrix(conn) == ["gt", "dp"]
+    builder = sql.QueryBuilder(conn, columns, filters)
+    query = builder.build_sql(builder.columns, builder.filters)
+    assert "sample_has_variant" not in query
+    assert query.count("JOIN genotype_matrix") == 1
+    assert list(builder.items()) == expected
+    assert builder.count() == 1
+
+    # Fields not stored in the matrix are still joined
+    sql.create_genotype_matrix(conn, ["gt"])
+    builder = sql.QueryBuilder(conn, columns, filters)
+    assert "sample_has_variant `gt_boby`" in builder.build_sql(builder.columns, builder.filters)
+    assert list(builder.items()) == expected
+
+    builder.use_genotype_matrix = False
+    assert "genotype_matrix" not in builder.build_sql(builder.columns, builder.filters)
+
+
+def test_genotype_array(tmp_path):
+    """Genotype filters evaluated with NumPy give the same results as joins"""
+    pytest.importorskip("numpy")
+    from cutevariant.core import genotypes
+
+    conn = sql.get_sql_connexion(str(tmp_path / "test.db"))
+    import_file(conn, "examples/test.snpeff.vcf")
+    samples = [sample["name"] for sample in sql.get_samples(conn)]
+    filters = {
+        "AND": [
+            {"field": "pos", "operator": ">", "value": 0},
+            {"field": ("genotype", samples[-1], "gt"), "operator": "=", "value": 1},
+            {
+                "OR": [
+                    {"field": ("genotype", samples[0], "gt"), "operator": "IN", "value": (0, 2)},
+                    {"field": ("genotype", samples[0], "gt"), "operator": "!=", "value": 1},
+                ]
+            },
+        ]
+    }
+    builder = sql.QueryBuilder(conn, ["chr", "pos"], filters)
+    assert builder.genotype_array is None
+    expected = list(builder.items(limit=None))
+    assert expected
+
+    genotypes.write_genotype_array(conn)
+    builder = sql.QueryBuilder(conn, ["chr", "pos"], filters)
+    assert builder.genotype_array is not None
+    # Building SQL has no side effect: joins until the filters are executed
+    total_changes = conn.total_changes
+    assert "sample_has_variant" in builder.build_sql(builder.columns, builder.filters)
+    assert conn.total_changes == total_changes and not conn.in_transaction
+    assert list(builder.items(limit=None)) == expected
+    query = builder.build_sql(builder.columns, builder.filters)
+    assert "sample_has_variant" not in query
+    assert "`variants`.`pos` >" in query
+    assert builder.count() == len(expected)
+
+    builder.filters = {"AND": [{"field": ("genotype", samples[0], "gt"), "operator": "=", "value": 1}]}
+    assert builder.count() == 0
@@ -1,13 +1,19 @@
 # Standard imports
 import pytest
 import sqlite3
+import gzip
+import io
+import json
+import os
 from collections import OrderedDict
 
 # Custom imports
-from cutevariant.core.reader import VcfReader, FakeReader
+from cutevariant.core.reader import VcfReader, FastVcfReader, FakeReader
+from cutevariant.core.readerfactory import create_reader
 from cutevariant.core.reader.bedreader import BedTool
 from cutevariant.core.reader import check_variant_schema, check_field_schema
 from cutevariant.core import sql
+from .utils import write_multiallelic_vcf
 
 
 READERS = [
@@ -15,6 +21,9 @@
     VcfReader(open("examples/test.vcf")),
     VcfReader(open("examples/test.vep.vcf"), "vep"),
     VcfReader(open("examples/test.snpeff.vcf"), "snpeff"),
+    FastVcfReader(open("examples/test.vcf")),
+    FastVcfReader(open("examples/test.vep.vcf"), "vep"),
+    FastVcfReader(open("examples/test.snpeff.vcf"), "snpeff"),
 ]
 
 
@@ -121,6 +130,67 @@ def test_create_db(reader):
     assert sql.get_variants_count(conn) == variant_count
 
 
+@pytest.mark.parametrize(
+    "filename", ["examples/test.vcf", "examples/test.snpeff.vcf", "examples/test.vep.vcf"]
+)
+@pytest.mark.parametrize("compressed", [False, True], ids=["vcf", "vcf.gz"])
+def test_fast_vcf_reader(filename, compressed, tmp_path):
+    """FastVcfReader must give the same fields and variants as VcfReader"""
+    if compressed:
+        path = str(tmp_path / os.path.basename(filename)) + ".gz"
+        with open(filename, "rb") as f_in, gzip.open(path, "wb") as f_out:
+            f_out.write(f_in.read())
+    else:
+        path = filename
+
+    # Compare through json to handle nan values
+    def dump(reader):
+        return (
+            reader.get_fields(),
+            [json.dumps(variant, sort_keys=True) for variant in reader.get_variants()],
+        )
+
+    with create_reader(path) as reader:
+        expected = dump(reader)
+
+    with create_reader(path, fast=True) as reader:
+        assert isinstance(reader, FastVcfReader)
+        assert dump(reader) == expected
+        # Progression is based on the real offset in the (uncompressed) file
+        assert reader.read_bytes == reader.file_size
+
+
+@pytest.mark.parametrize("compressed", [False, True], ids=["vcf", "vcf.gz"])
+def test_fast_vcf_reader_seek(compressed, tmp_path):
+    """FastVcfReader must resume at the position of any variant"""
+    path = str(tmp_path / ("test.vcf.gz" if compressed else "test.vcf"))
+    write_multiallelic_vcf(path, compressed)
+
+    with create_reader(path, fast=True) as reader:
+        reader.get_fields()
+        variants = []
+        positions = []
+        for variant in reader.get_variants():
+            variants.append(json.dumps(variant, sort_keys=True))
+            positions.append(reader.tell())
+    # The second ALT is on the line of the first one
+    assert positions[1] == (positions[2][0], 1)
+
+    for index, position in enumerate(positions):
+        with create_reader(path, fast=True) as reader:
+            reader.get_fields()
+            assert reader.seek(position)
+            assert [
+                json.dumps(variant, sort_keys=True) for variant in reader.get_variants()
+            ] == variants[index + 1 :]
+
+    # Readers of text without binary buffer can't seek
+    with open("examples/test.vcf") as file:
+        reader = FastVcfReader(io.StringIO(file.read()))
+    assert reader.tell() is None and not reader.seek((0, 0))
+    assert VcfReader(open("examples/test.vcf")).tell() is None
+
+
 def test_bedreader_from_string():
     """Test bed string"""
 
@@ -287,6 +357,26 @@ def test_bedreader_from_file():
     assert bedtool.count == 4
 
 
+def test_bedreader_tuples():
+    """Test the streaming of compact intervals"""
+    large_string = """
+        track name=test
+        chr1 1    10   feature1  0 +
+        chr1 50   60
+    """
+    bedtool = BedTool(large_string)
+    assert list(bedtool.tuples()) == [("chr1", 1, 10, "feature1"), ("chr1", 50, 60, None)]
+    assert bedtool.count == 2
+
+    for filepath in ("examples/test.bed.gz", "examples/test_with_headers.bed"):
+        bedtool = BedTool(filepath)
+        expected = [
+            (i["chrom"], int(i["start"]), int(i["end"]), i["name"]) for i in bedtool
+        ]
+        assert list(bedtool.tuples()) == expected
+        assert bedtool.count == 4
+
+
 # def test_vcf():
 #     filename = "exemples/test.vcf"
 #     # assert os.path.exists(filename), "file doesn't exists"
@@ -1,4 +1,5 @@
 import pytest
+import sqlite3
 
 from cutevariant.core import sql
 from cutevariant.core.reader.bedreader import BedTool
@@ -76,6 +77,107 @@ def conn():
 
     return conn
 
+
+@pytest.mark.parametrize("deferred_unique_index", [False, True])
+def test_insert_many_variants_by_batch(conn, deferred_unique_index):
+    """Batched insertion must give the same database as the one by one insertion"""
+    batch_conn = sql.get_sql_connexion(":memory:")
+    sql.create_table_fields(batch_conn)
+    sql.insert_many_fields(batch_conn, FIELDS)
+    sql.create_table_selections(batch_conn)
+    sql.create_table_annotations(batch_conn, sql.get_field_by_category(batch_conn, "annotations"))
+    sql.create_table_samples(batch_conn, sql.get_field_by_category(batch_conn, "samples"))
+    sql.insert_many_samples(batch_conn, SAMPLES)
+    sql.create_table_variants(
+        batch_conn,
+        sql.get_field_by_category(batch_conn, "variants"),
+        deferred_unique_index=deferred_unique_index,
+    )
+    assert sql.has_variants_unique_index(batch_conn) != deferred_unique_index
+
+    # The duplicated variant must be rejected with its data
+    sql.insert_many_variants(batch_conn, VARIANTS + VARIANTS[:1], batch_size=2)
+
+    for table in ("variants", "annotations", "sample_has_variant"):
+        query = f"SELECT * FROM {table}"
+        expected = [tuple(row) for row in conn.execute(query)]
+        assert [tuple(row) for row in batch_conn.execute(query)] == expected
+
+    selection = next(sql.get_selections(batch_conn))
+    assert selection["count"] == len(VARIANTS)
+    assert sql.has_variants_unique_index(batch_conn)
+
+
+def test_append_to_missing_variant(conn):
+    """Variants rejected for another reason than their unicity are skipped"""
+    context = sql.build_insert_context(conn, append=True)
+    values, _, samples = sql.variant_to_rows(
+        dict(VARIANTS[0], pos=VARIANTS[0]["pos"] + 1000), context
+    )
+    assert sql._append_to_variant(conn.cursor(), values, samples, context) is None
+
+
+def test_set_connexion_profile(tmp_path):
+    conn = sql.get_sql_connexion(str(tmp_path / "test.db"))
+
+    sql.set_connexion_profile(conn, "bulk")
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert conn.execute("PRAGMA synchronous").fetchone()[0] == 0
+    sql.create_project(conn, "test", "hg19")
+    assert conn.execute("PRAGMA page_size").fetchone()[0] == 8192
+
+    sql.set_connexion_profile(conn, "interactive")
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "delete"
+    assert conn.execute("PRAGMA synchronous").fetchone()[0] == 2
+
+
+def test_read_only_connexion(conn, tmp_path):
+    assert sql.get_database_filepath(conn) is None
+
+    filepath = str(tmp_path / "test.db")
+    write_conn = sql.get_sql_connexion(filepath)
+    sql.create_project(write_conn, "test", "hg19")
+    assert sql.get_database_filepath(write_conn) == filepath
+
+    read_conn = sql.get_sql_connexion(filepath, read_only=True)
+    assert read_conn.execute("SELECT name FROM projects").fetchone()[0] == "test"
+    with pytest.raises(sqlite3.OperationalError):
+        read_conn.execute("DELETE FROM projects")
+
+
+def test_query_cache(conn, tmp_path):
+    """Cached results are invalidated when the database is modified"""
+    query = "SELECT COUNT(*) FROM selections"
+    cache = conn.query_cache
+    cache.clear()
+    count = sql.cached_query(conn, query)[0][0]
+    assert sql.cached_query(conn, "  SELECT COUNT(*)\n FROM selections")[0][0] == count
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    selection_id = sql.insert_selection(conn, "", name="test")
+    assert sql.cached_query(conn, query)[0][0] == count + 1
+    assert cache.invalidations == 1
+    sql.edit_selection(conn, {"id": selection_id, "name": "renamed", "count": 0})
+    sql.delete_selection(conn, selection_id)
+    assert sql.cached_query(conn, query)[0][0] == count
+    assert cache.invalidations == 2
+
+    # Bounded memory
+    cache.max_results = 2
+    for value in range(3):
+        sql.cached_query(conn, "SELECT ?", (value,))
+    assert len(cache) == 2 and cache.evictions == 2
+
+    # Writes of other connections
+    filepath = str(tmp_path / "test.db")
+    write_conn = sql.get_sql_connexion(filepath)
+    sql.create_project(write_conn, "test", "hg19")
+    read_conn = sql.get_sql_connexion(filepath, read_only=True)
+    assert sql.cached_query(read_conn, "SELECT COUNT(*) FROM projects")[0][0] == 1
+    write_conn.execute("INSERT INTO projects (name) VALUES ('other')")
+    write_conn.commit()
+    assert sql.cached_query(read_conn, "SELECT COUNT(*) FROM projects")[0][0] == 2
+
 def test_create_connexion(conn):
     assert conn != None
 
@@ -106,6 +208,219 @@ def test_get_samples(conn):
     assert [sample["name"] for sample in sql.get_samples(conn)] == SAMPLES
 
 
+def test_field_stats(conn, monkeypatch):
+    """Statistics of fields answer range and unique values queries"""
+    assert sql.get_field_stats(conn, "pos") is None
+    assert sql.get_field_range(conn, "pos") == (10, 45)
+    sql.compute_field_stats(conn)
+
+    stats = sql.get_field_stats(conn, "pos")
+    assert (stats["row_count"], stats["null_count"], stats["distinct_count"]) == (2, 0, 2)
+    assert stats["histogram"] == [10, 45]
+    assert sql.get_field_range(conn, "pos") == (10, 45)
+    assert sql.get_field_unique_values(conn, "gene") == ["gene1", "gene2"]
+    assert sql.get_field_stats(conn, "transcript")["top_values"] == [
+        ["transcript2", 2],
+        ["transcript1", 1],
+    ]
+    assert sql.get_field_stats(conn, "dp", "samples")["max"] == 70
+
+    # Unique values include missing values
+    conn.execute("UPDATE variants SET extra2 = '' WHERE pos = 45")
+    sql.compute_field_stats(conn)
+    assert sql.get_field_unique_values(conn, "extra2") == ["", 100]
+    assert sql.get_field_range(conn, "extra2") == (100, 100)
+
+    # Incremental update with new variants
+    sql.insert_many_variants(
+        conn,
+        [
+            {"chr": "chr2", "pos": 5, "ref": "G", "alt": "A", "extra1": 10,
+            "annotations": [{"gene": "gene3", "transcript": "transcript2"}]},
+        ],
+    )
+    # Statistics are not used until they are updated
+    assert sql.get_field_stats(conn, "pos") is None
+    assert sql.get_field_range(conn, "pos") == (5, 45)
+    sql.update_field_stats(conn)
+    stats = sql.get_field_stats(conn, "extra2")
+    assert (stats["row_count"], stats["null_count"], stats["distinct_count"]) == (3, 2, 1)
+    assert stats["missing_values"] == [""]
+    assert sql.get_field_range(conn, "pos") == (5, 45)
+    assert sql.get_field_stats(conn, "transcript")["top_values"] == [
+        ["transcript2", 3],
+        ["transcript1", 1],
+    ]
+    updated = {name: sql.get_field_stats(conn, name) for name in ("chr", "gene", "extra1")}
+    sql.compute_field_stats(conn)
+    for name, stats in updated.items():
+        expected = sql.get_field_stats(conn, name)
+        del stats["histogram"], expected["histogram"]
+        assert stats == expected
+
+    # Values which are not all kept are read from the table
+    monkeypatch.setattr(sql, "FIELD_STATS_MAX_VALUES", 1)
+    sql.compute_field_stats(conn)
+    assert not sql.get_field_stats(conn, "gene")["complete"]
+    assert sorted(sql.get_field_unique_values(conn, "gene")) == ["gene1", "gene2", "gene3"]
+
+    # Statistics of values modified by update_genotype_counters() are dropped
+    sql.update_genotype_counters(conn)
+    assert sql.get_field_stats(conn, "count_var") is None
+    sql.update_field_stats(conn)
+    assert sql.get_field_range(conn, "count_var") == tuple(
+        conn.execute("SELECT MIN(count_var), MAX(count_var) FROM variants").fetchone()
+    )
+
+
+def test_schema_catalog(conn):
+    """The schema catalog is shared until the schema, fields or samples change"""
+    catalog = sql.get_schema_catalog(conn)
+    assert sql.get_schema_catalog(conn) is catalog
+    assert sql.QueryBuilder(conn).cache_variants_columns is catalog.get_columns("variants")
+    assert catalog.get_columns("variants") == set(sql.get_columns(conn, "variants"))
+    assert catalog.samples == SAMPLES
+    assert catalog.get_field("gt")["category"] == "samples"
+    assert [field["name"] for field in catalog.get_fields_by_category("annotations")] == [
+        "gene",
+        "transcript",
+    ]
+
+    sql.insert_sample(conn, "kevin")
+    catalog = sql.get_schema_catalog(conn)
+    assert catalog.samples == SAMPLES + ["kevin"]
+
+    # A name used by an INFO and a FORMAT field
+    sql.insert_many_fields(
+        conn,
+        [
+            {"name": "dp", "category": "variants", "type": "int", "description": "depth"},
+        ],
+    )
+    catalog = sql.get_schema_catalog(conn)
+    assert catalog.get_field("dp") == sql.get_field_by_name(conn, "dp")
+    assert catalog.get_field("dp", "variants")["description"] == "depth"
+    assert catalog.get_field("dp", "samples")["category"] == "samples"
+    for category in ("variants", "samples"):
+        assert catalog.get_fields_by_category(category) == list(
+            sql.get_field_by_category(conn, category)
+        )
+
+    conn.execute("ALTER TABLE variants ADD COLUMN extra3 INTEGER")
+    assert "extra3" in sql.get_schema_catalog(conn).get_columns("variants")
+    assert sql.get_schema_catalog(conn) is not catalog
+
+
+def test_update_genotype_counters(conn):
+    """Genotype counters are added to databases imported without them"""
+    sql.update_genotype_counters(conn)
+    assert set(sql.GENOTYPE_COUNTER_NAMES) <= set(sql.get_columns(conn, "variants"))
+    assert {field["name"] for field in sql.get_field_by_category(conn, "variants")} >= set(
+        sql.GENOTYPE_COUNTER_NAMES
+    )
+
+    counters = [
+        sql.count_genotypes(variant.get("samples", ())) for variant in VARIANTS
+    ]
+    for variant_id, expected in enumerate(counters, 1):
+        record = dict(conn.execute("SELECT * FROM variants WHERE id = ?", (variant_id,)).fetchone())
+        assert {name: record[name] for name in sql.GENOTYPE_COUNTER_NAMES} == expected
+
+
+def test_genotype_matrix(conn):
+    """Genotypes are packed per variant and read by SQL functions"""
+    blob = sql.pack_genotype_values([1, None, -1, "", "x"], "gt")
+    assert len(blob) == 5
+    assert sql.unpack_genotype_values(blob, "gt") == [1, None, -1, None, None]
+    blob = sql.pack_genotype_values([70, None, 100000, 12.0], "dp")
+    assert sql.unpack_genotype_values(blob, "dp") == [70, None, 100000, 12]
+    # Values are never rounded or clamped
+    with pytest.raises(ValueError):
+        sql.pack_genotype_values([1, 300], "gt")
+    with pytest.raises(ValueError):
+        sql.pack_genotype_values([1.5], "dp")
+
+    sql.create_genotype_matrix(conn)
+    assert sql.get_genotype_matrix_fields(conn) == ["gt", "dp"]
+    assert sql.get_genotype_matrix_samples(conn) == SAMPLES
+
+    sql.register_genotype_functions(conn)
+    for variant_id, gt_blob, dp_blob in conn.execute("SELECT * FROM genotype_matrix"):
+        for index, sample_id in enumerate((1, 2)):
+            gt, dp = conn.execute(
+                "SELECT gt, dp FROM sample_has_variant WHERE variant_id = ? AND sample_id = ?",
+                (variant_id, sample_id),
+            ).fetchone() or (None, None)
+            assert tuple(
+                conn.execute(
+                    "SELECT sample_gt(?, ?), sample_value(?, ?)",
+                    (gt_blob, index, dp_blob, index),
+                ).fetchone()
+            ) == (gt, dp)
+        # Out of range
+        assert conn.execute("SELECT sample_gt(?, 2)", (gt_blob,)).fetchone()[0] is None
+
+    gt_blob = sql.pack_genotype_values([1, 1, 0, None], "gt")
+    assert tuple(
+        conn.execute(
+            "SELECT count_gt(?, 1), count_gt(?, 0), count_gt(?, NULL), count_gt(?, 2)",
+            (gt_blob,) * 4,
+        ).fetchone()
+    ) == (2, 1, 1, 0)
+
+
+def test_index_advisor(conn):
+    builder = sql.QueryBuilder(conn)
+    builder.filters = {"AND": [
+        {"field": "gene", "operator": "=", "value": "gene1"},
+        {"field": ("genotype", "sacha", "gt"), "operator": "=", "value": 1},
+        {"field": "extra2", "operator": "!=", "value": 5},
+    ]}
+    for _ in range(3):
+        list(builder.items())
+    builder.count()
+
+    # Workload recorded in memory, then saved by the advisor
+    assert len(conn.filter_workload) == 3
+    advice = sql.advise_indexes(conn, min_count=4)
+    assert len(conn.filter_workload) == 0
+    workload = {(i["table_name"], i["field"], i["operator"]): i for i in sql.get_filter_workload(conn)}
+    assert workload[("annotations", "gene", "=")]["count"] == 4
+    assert workload[("sample_has_variant", "gt", "=")]["last_filter"]["field"] == ("genotype", "sacha", "gt")
+
+    # Operators which can't use indexes are ignored
+    assert {(i["name"], i["columns"], i["action"]) for i in advice} == {
+        ("idx_advisor_annotations_gene", ("gene",), "create"),
+        ("idx_advisor_sample_has_variant_gt", ("sample_id", "gt"), "create"),
+    }
+    assert all(i["estimated_size"] > 0 for i in advice)
+    assert sql.advise_indexes(conn, min_count=5) == []
+
+    # Speedups can't be measured on such small tables
+    results = list(sql.apply_index_advice(conn, advice, min_speedup=0))
+    assert all(i["applied"] and i["speedup"] is not None for i in results)
+    assert sql.get_advisor_indexes(conn) == {
+        "idx_advisor_annotations_gene": ("annotations", "gene"),
+        "idx_advisor_sample_has_variant_gt": ("sample_has_variant", "gt"),
+    }
+    assert sql.advise_indexes(conn, min_count=4) == []
+
+    # Indexes no longer used enough are dropped
+    advice = sql.advise_indexes(conn, min_count=10)
+    assert {(i["name"], i["action"]) for i in advice} == {
+        ("idx_advisor_annotations_gene", "drop"),
+        ("idx_advisor_sample_has_variant_gt", "drop"),
+    }
+    list(sql.apply_index_advice(conn, advice))
+    assert sql.get_advisor_indexes(conn) == {}
+
+    # Leading columns of existing indexes (unique constraints included)
+    sql.create_variants_indexes(conn)
+    builder.filters = {"AND": [{"field": "chr", "operator": "=", "value": "11"}]}
+    for _ in range(3):
+        list(builder.items())
+    advice = sql.advise_indexes(conn, min_count=3)
+    assert ("variants", "chr") not in {(i["table"], i["columns"][-1]) for i in advice}
 
 
 def test_selections(conn):
@@ -152,6 +467,39 @@ def test_selections(conn):
     # assert conn.in_transaction == False
 
 
+def test_selection_bitmap(conn):
+    # Containers: array, runs, bitset and a run over a whole container
+    variant_ids = (
+        [1, 5, 7, 100000]
+        + list(range(65536 * 2 + 10, 65536 * 2 + 5000))
+        + list(range(65536 * 3, 65536 * 4, 3))
+        + list(range(65536 * 5, 65536 * 6))
+    )
+    bitmap = sql.encode_selection_bitmap(variant_ids)
+    assert len(bitmap) < 8192 + 100
+    assert sql.decode_selection_bitmap(bitmap) == variant_ids
+    bitset = sql.selection_bitmap_to_bitset(bitmap)
+    assert [i for i in range(len(bitset) * 8) if bitset[i >> 3] >> (i & 7) & 1] == variant_ids
+    assert sql.decode_selection_bitmap(sql.encode_selection_bitmap([])) == []
+
+    # Selections stored as bitmaps: one row in "selections"
+    query = "SELECT variants.id, chr, pos FROM variants WHERE pos = 45"
+    selection_id = sql.create_selection_from_sql(conn, query, "bitmap", store="bitmap")
+    assert conn.execute("SELECT count FROM selections WHERE id = ?", (selection_id,)).fetchone()[0] == 1
+    assert conn.execute("SELECT COUNT(*) FROM selection_has_variant").fetchone()[0] == 0
+    assert [tuple(row) for row in conn.execute(
+        "SELECT variants.pos FROM variants" + sql.selection_join_sql(conn, "bitmap")
+    )] == [(45,)]
+
+    # Bitmap selections as sources
+    bed_intervals = [{"chrom": "chr1", "start": 0, "end": 100, "name": "bed"}]
+    sub_id = sql.create_selection_from_bed(conn, "bitmap", "sub_bitmap", bed_intervals)
+    assert conn.execute("SELECT count FROM selections WHERE id = ?", (sub_id,)).fetchone()[0] == 1
+    sql.Selection.conn = conn
+    selection = sql.Selection.from_selection_id(selection_id)
+    assert selection.variant_ids() == [2]
+
+
 def test_selection_operation(conn):
     """test set operations on selections
     PS: try to handle precedence of operators"""
@@ -160,81 +508,120 @@ def test_selection_operation(conn):
     query = """SELECT variants.id,chr,pos,ref,alt FROM variants"""
     id_all = sql.create_selection_from_sql(conn, query, "all", count=None)
 
-    # Select only ref = C (4 variants)
-    query = """SELECT variants.id,chr,pos,ref,alt FROM variants WHERE ref='C'"""
+    # Select only pos = 10 (1 variant)
+    query = """SELECT variants.id,chr,pos,ref,alt FROM variants WHERE pos=10"""
     id_A = sql.create_selection_from_sql(conn, query, "setA", count=None,)
 
-    # Select only alt = C (2 variants among setA)
-    query = """SELECT variants.id,chr,pos,ref,alt FROM variants WHERE alt='C'"""
+    # Select only alt = A (2 variants, setA included)
+    query = """SELECT variants.id,chr,pos,ref,alt FROM variants WHERE alt='A'"""
     id_B = sql.create_selection_from_sql(conn, query, "setB", count=None)
 
-    # assert all((id_all, id_A, id_B))
-
-    # selections = [selection["name"] for selection in sql.get_selections(conn)]
-
-    # assert "setA" in selections
-    # assert "setB" in selections
-
-    # sql.Selection.conn = conn
-
-    # All = sql.Selection.from_selection_id(id_all)
-    # A = sql.Selection.from_selection_id(id_A)
-    # B = sql.Selection.from_selection_id(id_B)
-
-    # # 8 - (4 & 2) = 8 - 2 = 6
-    # C = All - (B&A)
-    # # Query:
-    # # SELECT variant_id
-    # #    FROM selection_has_variant sv
-    # #     WHERE sv.selection_id = 2 EXCEPT SELECT * FROM (SELECT variant_id
-    # #    FROM selection_has_variant sv
-    # #     WHERE sv.selection_id = 4 INTERSECT SELECT variant_id
-    # #    FROM selection_has_variant sv
-    # #     WHERE sv.selection_id = 3)
-
-
-    # C.save("newset")
-
-    # print(A.sql_query)
-    # expected_number = 0
-    # for expected_number, variant in enumerate(conn.execute(A.sql_query), 1):
-    #     print(dict(variant))
-
-    # assert expected_number == 4
-
-    # print(B.sql_query)
-    # expected_number = 0
-    # for expected_number, variant in enumerate(conn.execute(B.sql_query), 1):
-    #     print(dict(variant))
-
-    # assert expected_number == 2
-
-    # print(C.sql_query)
-    # expected_number = 0
-    # for expected_number, variant in enumerate(conn.execute(C.sql_query), 1):
-    #     print(dict(variant))
-
-    # assert expected_number == 6
-
-    # selections = [selection["name"] for selection in sql.get_selections(conn)]
-    # "newset" in selections
-
-    # # (8 - 2) & 4 = 2
-    # C = (All - B) & A
-    # # Query:
-    # # SELECT * FROM (SELECT variant_id
-    # #        FROM selection_has_variant sv
-    # #         WHERE sv.selection_id = 2 EXCEPT SELECT variant_id
-    # #        FROM selection_has_variant sv
-    # #         WHERE sv.selection_id = 4 INTERSECT SELECT variant_id
-    # #        FROM selection_has_variant sv
-    # #         WHERE sv.selection_id = 3)
-    # print(C.sql_query)
-    # expected_number = 0
-    # for expected_number, variant in enumerate(conn.execute(C.sql_query), 1):
-    #     print(dict(variant))
-
-    # assert expected_number == 2
+    sql.Selection.conn = conn
+
+    All = sql.Selection.from_selection_id(id_all)
+    A = sql.Selection.from_selection_id(id_A)
+    B = sql.Selection.from_selection_id(id_B)
+    assert (All.count, A.count, B.count) == (2, 1, 2)
+    assert sql.Selection.from_selection_id(1).bitset == All.bitset
+
+    # 2 - (2 & 1) = 2 - 1 = 1
+    C = All - (B & A)
+    assert C.count == 1
+    assert C.variant_ids() == [2]
+    assert C.expression == "(all - (setB & setA))"
+    new_id = C.save("newset")
+    assert tuple(conn.execute(
+        "SELECT count, query FROM selections WHERE id = ?", (new_id,)
+    ).fetchone()) == (C.count, C.expression)
+    assert sql.Selection.from_selection_name("newset").bitset == C.bitset
+
+    # (2 - 2) & 1 = 0
+    C = (All - B) & A
+    assert C.count == 0
+    assert (A ^ B).variant_ids() == [2]
+    assert (A + B).variant_ids() == B.variant_ids()
+
+    # Expressions of VQL set commands
+    expression = {"&": [{"-": ["all", "setB"]}, "setA"]}
+    assert sql.evaluate_set_expression(conn, expression) == C.bitset
+    new_id = sql.create_selection_from_expression(conn, "fromvql", expression)
+    assert tuple(conn.execute(
+        "SELECT count, query FROM selections WHERE id = ?", (new_id,)
+    ).fetchone()) == (0, "((all - setB) & setA)")
+    assert sql.Selection.from_selection_name("fromvql").bitset == C.bitset
+
+    with pytest.raises(ValueError):
+        sql.evaluate_set_expression(conn, {"+": ["setA", "unknown"]})
+
+
+def test_site_set_operations(conn):
+    assert sql.get_site_key("chr1", 10) == sql.get_site_key("1", 10) == 1 << 32 | 10
+    assert sql.get_site_key("chrX", 1) > sql.get_site_key("chr22", 10 ** 8)
+    assert sql.get_chromosome_index("chrUn_KI270302v1") > sql.get_chromosome_index("chrMT")
+
+    # Another alternative allele at the site chr1:10 (id 3)
+    sql.insert_many_variants(
+        conn, [{"chr": "chr1", "pos": 10, "ref": "G", "alt": "T", "extra1": 0, "extra2": 0}]
+    )
+    assert [tuple(row) for row in conn.execute("SELECT id, site FROM variants")] == [
+        (1, 1 << 32 | 10), (2, 1 << 32 | 45), (3, 1 << 32 | 10)
+    ]
+    sql.create_selection_from_sql(conn, "SELECT id FROM variants WHERE alt = 'A'", "A")
+    sql.create_selection_from_sql(conn, "SELECT id FROM variants WHERE alt = 'T'", "T")
+
+    def variant_ids(expression, mode):
+        bitset = sql.evaluate_set_expression(conn, expression, mode)
+        return [i for i in range(bitset.bit_length()) if bitset >> i & 1]
+
+    assert variant_ids({"&": ["A", "T"]}, "variant") == []
+    # Variants of chr1:10 don't have consecutive ids: sets of site keys are used
+    assert sql.get_site_runs(conn) is None
+    assert variant_ids({"&": ["A", "T"]}, "site") == [1, 3]
+    assert variant_ids({"-": ["A", "T"]}, "site") == [2]
+    assert variant_ids({"^": ["A", "T"]}, "site") == [2]
+    assert variant_ids({"+": ["A", "T"]}, "site") == [1, 2, 3]
+
+    sql.Selection.conn = conn
+    A = sql.Selection.from_selection_name("A", mode="site")
+    T = sql.Selection.from_selection_name("T", mode="site")
+    assert (A & T).variant_ids() == [1, 3]
+    assert (T - A).count == 0
+
+    # Variants of chr1:45 have consecutive ids: operations on bitsets
+    conn.execute("UPDATE variants SET pos = 45, site = ? WHERE id = 3", (1 << 32 | 45,))
+    assert sql.get_site_runs(conn) == 1 << 3
+    assert variant_ids({"&": ["A", "T"]}, "site") == [2, 3]
+    assert variant_ids({"-": ["A", "T"]}, "site") == [1]
+    assert variant_ids({"^": ["T", "A"]}, "site") == [1]
+    assert variant_ids({"+": ["A", "T"]}, "site") == [1, 2, 3]
+
+    # Databases without site keys
+    conn.execute("UPDATE variants SET site = NULL")
+    assert sql.get_site_runs(conn) is None
+    assert variant_ids({"&": ["A", "T"]}, "site") == [2, 3]
+    assert sql.update_site_keys(conn) == 3
+    assert conn.execute("SELECT COUNT(*) FROM variants WHERE site IS NULL").fetchone()[0] == 0
+
+    # Unknown modes are rejected before any operation
+    with pytest.raises(ValueError):
+        sql.evaluate_set_expression(conn, {"&": ["A", "T"]}, "position")
+    with pytest.raises(ValueError):
+        sql.Selection.from_selection_name("A", mode="position")
+
+
+def test_encode_selection_bitset():
+    # Containers: array, runs, bitset, a run over a whole container
+    variant_ids = (
+        [1, 5, 7, 100000]
+        + list(range(65536 * 2 + 10, 65536 * 2 + 5000))
+        + list(range(65536 * 3, 65536 * 4, 3))
+        + list(range(65536 * 5, 65536 * 6))
+    )
+    bitset = sql.selection_bitmap_to_bitset(sql.encode_selection_bitmap(variant_ids))
+    bitmap = sql.encode_selection_bitset(bitset)
+    assert bitmap == sql.encode_selection_bitset(int.from_bytes(bitset, "little"))
+    assert sql.decode_selection_bitmap(bitmap) == variant_ids
+    assert sql.encode_selection_bitset(0) == b""
 
 
 # ============ TEST VARIANTS QUERY 
@@ -288,6 +675,96 @@ def test_selection_from_bedfile(conn):
     # assert bed_selection["count"] == 4 
 
 
+def test_reg2bins():
+    """Bins of a region must contain the bin of each overlapping variant"""
+    assert sql.reg2bin(0, 1) == 4681
+    assert sql.reg2bin(0, 1 << 26) == 1
+    assert sql.reg2bin(0, 1 << 30) == 0
+
+    for start, end in ((0, 1), (16000, 17000), (1 << 20, (1 << 20) + 500000)):
+        bins = sql.reg2bins(start, end)
+        for pos in (start, (start + end) // 2, end - 1):
+            assert sql.reg2bin(pos, pos + 1) in bins
+        # Large variant overlapping the region
+        assert sql.reg2bin(start - 1 if start else 0, end + 1000000) in bins
+
+
+def test_selection_from_bed_bins(conn):
+    """Variants selected through bins must be those with start <= pos <= end"""
+    bed_intervals = [
+        {"chrom": "chr1", "start": "1", "end": "10", "name": "a"},
+        {"chrom": "chr1", "start": "40", "end": "44", "name": "b"},
+        {"chrom": "chr1", "start": "45", "end": "45", "name": "c"},
+        {"chrom": "chr2", "start": "1", "end": "100", "name": "d"},
+    ]
+    selection_id = sql.create_selection_from_bed(conn, "variants", "bed", bed_intervals)
+
+    variants = conn.execute(
+        "SELECT variant_id FROM selection_has_variant WHERE selection_id = ?",
+        (selection_id,),
+    )
+    assert sorted(row[0] for row in variants) == [1, 2]
+
+    # Same result from a selection
+    selection_id = sql.create_selection_from_bed(conn, "bed", "sub_bed", bed_intervals[:1])
+    assert next(s for s in sql.get_selections(conn) if s["name"] == "sub_bed")["count"] == 1
+
+
+def test_selection_from_sorted_bed(conn):
+    """Sweep line intersection must select the same variants as the SQL join"""
+    bed_intervals = [
+        {"chrom": "chr1", "start": "1", "end": "8", "name": "a"},
+        {"chrom": "chr1", "start": "5", "end": "10", "name": "b"},
+        {"chrom": "chr1", "start": "40", "end": "45", "name": "c"},
+        {"chrom": "chr2", "start": "1", "end": "100", "name": "d"},
+    ]
+    sql.create_selection_from_bed(conn, "variants", "bed", bed_intervals)
+    selection_id = sql.create_selection_from_sorted_bed(
+        conn, "variants", "sorted_bed", bed_intervals
+    )
+
+    def selected(name):
+        return sorted(
+            row[0]
+            for row in conn.execute(
+                """SELECT variant_id FROM selection_has_variant sv
+                INNER JOIN selections ON selections.id = sv.selection_id
+                WHERE selections.name = ?""",
+                (name,),
+            )
+        )
+
+    assert selected("sorted_bed") == selected("bed")
+    selection = next(s for s in sql.get_selections(conn) if s["id"] == selection_id)
+    assert selection["count"] == len(selected("bed"))
+
+    # From a selection
+    sql.create_selection_from_sorted_bed(conn, "sorted_bed", "sub_bed", bed_intervals[:2])
+    assert selected("sub_bed") == [1]
+
+    # Unsorted intervals
+    with pytest.raises(ValueError):
+        sql.create_selection_from_sorted_bed(
+            conn, "variants", "error", bed_intervals[::-1]
+        )
+    with pytest.raises(ValueError):
+        sql.create_selection_from_sorted_bed(
+            conn, "variants", "error", bed_intervals[2:] + bed_intervals[:1]
+        )
+
+
+def test_region_filter(conn):
+    """Region filters use bins and include the boundaries"""
+    filters = sql.get_region_filter(conn, "chr1", 10, 45)
+    assert [node["field"] for node in filters["AND"]] == ["chr", "bin", "pos", "pos"]
+
+    builder = sql.QueryBuilder(conn, columns=["chr", "pos"], filters=filters)
+    assert builder.count() == 2
+
+    builder.filters = sql.get_region_filter(conn, "chr1", 11, 45)
+    assert builder.count() == 1
+
+
 def test_selection_from_bedfile_and_subselection(conn):
     """Test the creation of a selection based on BED data
 
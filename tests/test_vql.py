@@ -42,6 +42,12 @@
         "columns": ["chr", "pos", ('genotype','sacha','gt')],
         "source": "variants"
         },
+    "SELECT chr, count_het() FROM variants WHERE count_hom() > 2": {
+        "cmd":"select_cmd",
+        "columns": ["chr", "count_het"],
+        "source": "variants",
+        "filter": {'AND': [{'field': 'count_hom', 'operator': '>', 'value': 2}]},
+    },
     "SELECT chr FROM variants WHERE some_field IN ('one', 'two')": {
         "cmd":"select_cmd",
         "columns": ["chr"],
@@ -63,11 +69,17 @@
         "filter": {'AND': [{'field': 'some_field', 'operator': 'IN', 'value': ('one', 'two')}]},
     },
 
-#    "CREATE denovo = boby & alex": {
-#         "cmd":"create_cmd",
-#         "target": "denovo",
-#         "expression":"todo"
-#         },
+    "CREATE denovo = boby & alex": {
+        "cmd":"set_cmd",
+        "target": "denovo",
+        "expression": {"&": ["boby", "alex"]},
+    },
+
+    "CREATE denovo = boby + alex + sacha - (kevin ^ alex)": {
+        "cmd":"set_cmd",
+        "target": "denovo",
+        "expression": {"-": [{"+": ["boby", "alex", "sacha"]}, {"^": ["kevin", "alex"]}]},
+    },
 
 }
 
@@ -97,6 +109,19 @@ def test_vql_function():
 
     found = next(execute_vql(q))
 
-    exp = found["expression"]
-    a = 3
+    assert found["expression"] == {"&": ["alex", "toi"]}
+
+
+@pytest.mark.parametrize(
+    "vql, col",
+    [
+        ("SELECT chr, genotyp() FROM variants", 13),
+        ("SELECT chr FROM variants WHERE count_hetero() > 2", 32),
+    ],
+)
+def test_vql_unknown_function(vql, col):
+    """Functions without argument must be genotype counters"""
+    with pytest.raises(VQLSyntaxError) as error:
+        next(execute_vql(vql))
 
+    assert error.value.col == col
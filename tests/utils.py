@@ -1,3 +1,4 @@
+import gzip
 import sqlite3
 
 
@@ -16,3 +17,15 @@ def table_count(conn: sqlite3.Connection, name):
 def table_drop(conn, name):
     c = conn.cursor()
     c.execute(f"DROP TABLE IF EXISTS {name}")
+
+
+def write_multiallelic_vcf(path, compressed=False):
+    """Write test.snpeff.vcf with a second ALT on its second record"""
+    with open("examples/test.snpeff.vcf") as file:
+        lines = file.readlines()
+    records = [index for index, line in enumerate(lines) if not line.startswith("#")]
+    row = lines[records[1]].split("\t")
+    row[4] += ",C"
+    lines[records[1]] = "\t".join(row)
+    with (gzip.open if compressed else open)(path, "wt") as file:
+        file.writelines(lines)